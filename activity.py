@@ -0,0 +1,156 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from firestore_queue import SERVER_TIMESTAMP
+
+
+class ActivityTracker:
+    """Writes user activity to the `users` collection only when it adds something.
+
+    The last state written for each user (username, last message, when) is
+    kept in memory. A new user or a changed username is written on the next
+    tick (`tick` seconds), since /reply and /broadcast look users up by it. A
+    new last message is
+    written at most once per `interval` per user; messages in between only
+    replace the pending value, so a burst of taps costs one write. A touch
+    that changes nothing is dropped unless the user's `updated_at` is older
+    than `heartbeat`. Pending writes are handed to the FirestoreWriter by a
+    background loop and on `stop()`.
+
+    `max_entries` bounds the snapshot; an evicted user costs one extra write
+    the next time they show up.
+    """
+
+    def __init__(self, writer, interval=60, heartbeat=3600, max_entries=50000, tick=1.0, clock=time.monotonic):
+        self.writer = writer
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_entries = max_entries
+        self.tick = min(tick, interval) if interval > 0 else tick
+        self.clock = clock
+
+        self._written = OrderedDict()  # user_id -> (username, last_message, written_at)
+        self._dirty = {}  # user_id -> (username, last_message)
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+
+        self.touches = 0
+        self.writes = 0
+        self.skipped = 0
+        self.coalesced = 0
+
+    # ------------------------ Lifecycle ------------------------
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        self.flush(force=True)
+
+    async def _loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.flush()
+
+    def seed(self, users):
+        """Record (user_id, username, last_message) rows already in Firestore, e.g. from the warm-up."""
+        now = self.clock()
+        for user_id, username, last_message in users:
+            if user_id not in self._written:
+                self._written[user_id] = (username, last_message or "", now)
+                self._written.move_to_end(user_id, last=False)
+        self._evict()
+
+    # ------------------------ Tracking ------------------------
+
+    def touch(self, user_id, username, last_message=""):
+        self.touches += 1
+        now = self.clock()
+        if user_id in self._dirty:
+            self.coalesced += 1
+            self._dirty[user_id] = (username, last_message)
+            return
+        written = self._written.get(user_id)
+        if written is None or written[0] != username:
+            self._dirty[user_id] = (username, last_message)
+            return
+        self._written.move_to_end(user_id)
+        _, written_message, written_at = written
+        if last_message == written_message and now - written_at < self.heartbeat:
+            self.skipped += 1
+            return
+        if now - written_at >= self.interval:
+            self._write(user_id, username, last_message, now)
+        else:
+            self._dirty[user_id] = (username, last_message)
+
+    def _write(self, user_id, username, last_message, now):
+        self._dirty.pop(user_id, None)
+        self._written[user_id] = (username, last_message, now)
+        self._written.move_to_end(user_id)
+        self._upsert(user_id, username, last_message)
+        self._evict()
+
+    def _upsert(self, user_id, username, last_message):
+        self.writer.upsert_user(user_id, {
+            "username": username,
+            "last_message": last_message,
+            "updated_at": SERVER_TIMESTAMP,
+        })
+        self.writes += 1
+
+    def _evict(self):
+        while len(self._written) > self.max_entries:
+            user_id, _ = self._written.popitem(last=False)
+            pending = self._dirty.pop(user_id, None)
+            if pending:
+                self._upsert(user_id, *pending)
+
+    def _due(self, user_id, username, now):
+        written = self._written.get(user_id)
+        return written is None or written[0] != username or now - written[2] >= self.interval
+
+    def flush(self, force=False):
+        """Write pending updates that are due (all of them with `force`)."""
+        if not self._dirty:
+            return 0
+        now = self.clock()
+        due = [user_id for user_id, (username, _) in self._dirty.items() if force or self._due(user_id, username, now)]
+        for user_id in due:
+            username, last_message = self._dirty[user_id]
+            self._write(user_id, username, last_message, now)
+        return len(due)
+
+    # ------------------------ Reporting ------------------------
+
+    @property
+    def pending(self):
+        return len(self._dirty)
+
+    @property
+    def write_reduction(self):
+        """Share of touches that did not turn into a Firestore write."""
+        return 1 - self.writes / self.touches if self.touches else 0.0
+
+    def stats(self):
+        return {
+            "touches": self.touches,
+            "writes": self.writes,
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+            "pending": self.pending,
+            "tracked_users": len(self._written),
+            "write_reduction": round(self.write_reduction, 3),
+        }
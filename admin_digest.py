@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from collections import Counter
+
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+
+class AdminDigest:
+    """Buffers admin notifications and sends them as one digest per window.
+
+    A digest goes out every `window` seconds, or as soon as `max_events` events
+    are buffered. Orders are grouped by delivery slot with per-slot item totals
+    for the kitchen. `urgent=True` skips the buffer and sends right away, and
+    `window=0` turns buffering off entirely.
+    """
+
+    def __init__(self, chat_id, window=60, max_events=25):
+        self.chat_id = chat_id
+        self.window = window
+        self.max_events = max_events
+        self.bot = None
+        self._orders = []
+        self._messages = []
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.digests_sent = 0
+        self.events_batched = 0
+
+    async def start(self, bot):
+        self.bot = bot
+        if self.window > 0:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # ------------------------ Events ------------------------
+
+    @property
+    def pending(self):
+        return len(self._orders) + len(self._messages)
+
+    async def send_now(self, text):
+        await self.bot.send_message(chat_id=self.chat_id, text=text)
+
+    async def add_order(self, order, text, urgent=False):
+        """Queue an order (the dict written to Firestore) with its full admin text."""
+        if urgent or not self._task:
+            await self.send_now(text)
+            return
+        self._orders.append(order)
+        self._queued()
+
+    async def add_message(self, sender, text, urgent=False):
+        if urgent or not self._task:
+            await self.send_now(f"📩 Message from @{sender}:\n{text}")
+            return
+        self._messages.append((sender, text))
+        self._queued()
+
+    def _queued(self):
+        self.events_batched += 1
+        if self.pending >= self.max_events:
+            self._wakeup.set()
+
+    # ------------------------ Digest ------------------------
+
+    @staticmethod
+    def blocks(orders, messages):
+        """The digest as (lines, orders, messages) blocks; a block's lines are sent together.
+
+        Each order gets its own block (contact line, item lines, delivery
+        charge) under its slot's header and item totals, so a chunk that
+        failed to send can be retried with exactly the events it carried.
+        """
+        blocks = []
+        if orders:
+            blocks.append(([f"🛎 {len(orders)} new order(s)"], [], []))
+            by_slot = {}
+            for order in orders:
+                by_slot.setdefault(order["delivery_time"], []).append(order)
+            for slot in sorted(by_slot):
+                slot_orders = by_slot[slot]
+                totals = Counter()
+                for order in slot_orders:
+                    for item in order["items"]:
+                        totals[item["item_name"]] += item["quantity"]
+                header = ["", f"🕒 {slot_orders[0].get('delivery_time_display', slot)} — {len(slot_orders)} order(s)"]
+                header.extend(f"  • {name} x {qty}" for name, qty in sorted(totals.items()))
+                blocks.append((header, [], []))
+                for order in slot_orders:
+                    note = f" — 📝 {order['note']}" if order.get("note") else ""
+                    lines = [f"  @{order['username']} 📱 {order['mobile']} 🏠 {order['address']} 💰 ₹{order['total_price']}{note}"]
+                    lines.extend(f"     {item['item_name']} x {item['quantity']} (₹{item['price']})" for item in order["items"])
+                    # Orders don't store the charge; it is whatever the total adds to the items
+                    charge = order["total_price"] - sum(item["quantity"] * item["price"] for item in order["items"])
+                    if charge > 0:
+                        lines.append(f"     🚚 Delivery charge: ₹{charge}")
+                    blocks.append((lines, [order], []))
+        if messages:
+            blocks.append((["", f"📩 {len(messages)} message(s)"], [], []))
+            blocks.extend(([f"  @{sender}: {text}"], [], [(sender, text)]) for sender, text in messages)
+        return blocks
+
+    @classmethod
+    def format_digest(cls, orders, messages):
+        return "\n".join(line for lines, _, _ in cls.blocks(orders, messages) for line in lines).strip()
+
+    @staticmethod
+    def split(text, limit=MAX_MESSAGE_LENGTH):
+        chunks, current = [], ""
+        for line in text.split("\n"):
+            line = line[:limit]
+            if current and len(current) + len(line) + 1 > limit:
+                chunks.append(current)
+                current = line
+            else:
+                current = f"{current}\n{line}" if current else line
+        if current:
+            chunks.append(current)
+        return chunks
+
+    @classmethod
+    def chunks(cls, orders, messages, limit=MAX_MESSAGE_LENGTH):
+        """(text, orders, messages) per message to send, at most `limit` characters each.
+
+        Blocks are not split across messages unless one alone is too long;
+        its events then belong to the message holding its last line.
+        """
+        chunks, lines, chunk_orders, chunk_messages = [], [], [], []
+
+        def close():
+            parts = cls.split("\n".join(lines).strip(), limit)
+            if parts:
+                chunks.extend((part, [], []) for part in parts[:-1])
+                chunks.append((parts[-1], list(chunk_orders), list(chunk_messages)))
+            lines.clear()
+            chunk_orders.clear()
+            chunk_messages.clear()
+
+        for block_lines, block_orders, block_messages in cls.blocks(orders, messages):
+            if lines and len("\n".join(lines + block_lines).strip()) > limit:
+                close()
+            lines.extend(block_lines)
+            chunk_orders.extend(block_orders)
+            chunk_messages.extend(block_messages)
+        close()
+        return chunks
+
+    async def flush(self):
+        if not self.pending or self.bot is None:
+            return
+        orders, self._orders = self._orders, []
+        messages, self._messages = self._messages, []
+        chunks = self.chunks(orders, messages)
+        for n, (text, _, _) in enumerate(chunks):
+            try:
+                await self.send_now(text)
+            except TelegramError:
+                # Only events that weren't delivered go into the next digest
+                unsent_orders = [order for _, chunk_orders, _ in chunks[n:] for order in chunk_orders]
+                unsent_messages = [message for _, _, chunk_messages in chunks[n:] for message in chunk_messages]
+                logger.exception("Sending admin digest failed, keeping %d events for the next one", len(unsent_orders) + len(unsent_messages))
+                self._orders = unsent_orders + self._orders
+                self._messages = unsent_messages + self._messages
+                return
+        self.digests_sent += 1
+
+    def stats(self):
+        return {"pending": self.pending, "digests_sent": self.digests_sent, "events_batched": self.events_batched}
@@ -0,0 +1,89 @@
+"""Firestore writes for user activity: ActivityTracker vs. a write per update.
+
+    python benchmarks/activity_bench.py --users 5000 --sessions 3
+
+Simulates a day of customers on a virtual clock: each user has --sessions
+visits, each a burst of --taps updates a few seconds apart (an order
+conversation) that starts with /start.
+The old path upserted `users/<id>` on every update and relied on the
+FirestoreWriter merging writes within one flush (1s); the tracker is fed the
+same updates. Prints the writes each approach sends to Firestore.
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from activity import ActivityTracker
+
+WRITER_FLUSH = 1.0
+
+
+class CountingWriter:
+    def __init__(self):
+        self.upserts = 0
+
+    def upsert_user(self, user_id, data):
+        self.upserts += 1
+
+
+def simulate(args, rng):
+    """(time, user_id, username, text) updates for one day, in time order."""
+    events = []
+    day = 24 * 3600
+    for user_id in range(args.users):
+        username = f"user{user_id}"
+        for _ in range(args.sessions):
+            t = rng.uniform(0, day)
+            for tap in range(args.taps):
+                text = "/start" if tap == 0 else rng.choice(["Chicken Biryani", "2", "DONE", "9876543210", "TIME_20:15", "skip", "yes"])
+                heapq.heappush(events, (t, user_id, username, text))
+                t += rng.uniform(args.min_gap, args.max_gap)
+        if rng.random() < args.renames:
+            heapq.heappush(events, (rng.uniform(0, day), user_id, username + "_new", "hi"))
+    return [heapq.heappop(events) for _ in range(len(events))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--sessions", type=int, default=3)
+    parser.add_argument("--taps", type=int, default=12)
+    parser.add_argument("--min-gap", type=float, default=2.0)
+    parser.add_argument("--max-gap", type=float, default=20.0)
+    parser.add_argument("--renames", type=float, default=0.01, help="share of users who change their username")
+    parser.add_argument("--interval", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    events = simulate(args, random.Random(args.seed))
+
+    # Before: one upsert per update, merged per document within a writer flush
+    old_writes = len({(user_id, int(t // WRITER_FLUSH)) for t, user_id, _, _ in events})
+
+    now = [0.0]
+    writer = CountingWriter()
+    tracker = ActivityTracker(writer, interval=args.interval, clock=lambda: now[0])
+    next_tick = tracker.tick
+    for t, user_id, username, text in events:
+        while next_tick <= t:
+            now[0] = next_tick
+            tracker.flush()
+            next_tick += tracker.tick
+        now[0] = t
+        tracker.touch(user_id, username, text)
+    tracker.flush(force=True)
+
+    touches = len(events)
+    print(f"{touches} updates from {args.users} users")
+    print(f"write per update (merged per 1s flush): {old_writes} writes ({1 - old_writes / touches:.1%} fewer than updates)")
+    print(f"ActivityTracker (interval {args.interval:.0f}s): {writer.upserts} writes ({tracker.write_reduction:.1%} fewer than updates)")
+    print(f"-> {old_writes / max(1, writer.upserts):.1f}x fewer user writes; {tracker.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Broadcast throughput and resume check against fake Telegram and Firestore.
+
+    python benchmarks/broadcast_bench.py --users 20000 --rate 1000
+    python benchmarks/broadcast_bench.py --users 5000 --interrupt-after 2000
+
+Seeds `users` with --users documents (every --blocked-every'th user has
+blocked the bot), runs /broadcast through the real handler and outbound
+scheduler, optionally interrupts it with a shutdown after
+--interrupt-after messages and resumes it in a fresh application. Exits with
+code 1 if a reachable user got no message or got it twice, a blocked user
+was not marked, or the job's `sent` counter doesn't match the users reached.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram import Update
+
+import food_order_bot as bot
+from config import Config
+from fakes import FakeBotRequest, FakeFirestore, UpdateFactory
+
+ADMIN = 42
+
+
+class CountingRequest(FakeBotRequest):
+    """Also counts broadcast messages per chat, which `keep=1` can't show."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.received = Counter()
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        code, body = await super().do_request(url, method, request_data, *args, **kwargs)
+        if code == 200 and url.endswith("/sendMessage") and request_data.parameters["chat_id"] != ADMIN:
+            self.received[request_data.parameters["chat_id"]] += 1
+        return code, body
+
+
+async def start_app(db, request, args):
+    config = Config(
+        token="123456:BROADCAST",
+        admin_id=ADMIN,
+        persistence="none",
+        webhook_url="http://localhost",
+        menu_source=os.path.join(ROOT, "menu.json"),
+        order_log_path=os.path.join(tempfile.mkdtemp(), "orders.wal"),
+        admin_digest_window=0,
+        send_rate_global=args.rate,
+        send_rate_per_chat=1e9,
+        broadcast_concurrency=args.concurrency,
+    )
+    app = bot.create_app(config, db=db, request=request)
+    bot.media_cache.store_path = os.path.join(tempfile.mkdtemp(), "media_cache.json")
+    bot.broadcaster.page_size = args.page_size
+    bot.broadcaster.progress_interval = 1
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    return app
+
+
+async def stop_app(app):
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+
+
+async def command(app, text):
+    await app.process_update(Update.de_json(UpdateFactory(ADMIN).message(text), app.bot))
+
+
+async def run(args):
+    db = FakeFirestore(latency=args.firestore_latency)
+    users = [5000000 + i for i in range(args.users)]
+    blocked = {u for i, u in enumerate(users) if args.blocked_every and i % args.blocked_every == 0}
+    for user_id in users:
+        db.collections["users"][str(user_id)] = {"username": f"user{user_id}", "last_message": "hi"}
+    request = CountingRequest(latency=args.api_latency, keep=1, blocked=blocked)
+
+    started = time.perf_counter()
+    app = await start_app(db, request, args)
+    await command(app, "/broadcast We're open! 🍽️\nOrder with /start")
+    if args.interrupt_after:
+        while bot.broadcaster.running and bot.broadcaster.processed < args.interrupt_after:
+            await asyncio.sleep(0.01)
+        await stop_app(app)
+        interrupted = dict(bot.broadcaster.stats())
+        app = await start_app(db, request, args)
+        await command(app, "/broadcast resume")
+    while bot.broadcaster.running:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    job = bot.broadcaster.job
+    await stop_app(app)
+
+    # keep=1: one logged message is enough to show the user was reached
+    missing = [u for u in users if u not in blocked and not request.messages.get(u)]
+    unmarked = [u for u in blocked if "blocked_at" not in db.collections["users"][str(u)]]
+    duplicates = sum(n - 1 for n in request.received.values() if n > 1)
+    reachable = len(users) - len(blocked)
+
+    problems = []
+    if missing:
+        problems.append(f"{len(missing)} reachable users got nothing, e.g. {missing[:5]}")
+    if unmarked:
+        problems.append(f"{len(unmarked)} blocked users not marked")
+    if duplicates:
+        problems.append(f"{duplicates} messages sent to users who already had one")
+    if job["sent"] != reachable:
+        problems.append(f"job counted {job['sent']} sent for {reachable} reachable users")
+    if job["status"] != "done":
+        problems.append(f"job ended as {job['status']}")
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "sent_per_s": round(job["sent"] / elapsed, 1),
+        "job": {k: job[k] for k in ("id", "status", "sent", "blocked", "skipped", "failed", "total")},
+        "interrupted_at": interrupted if args.interrupt_after else None,
+        "duplicates": duplicates,
+        "api_calls": dict(request.calls),
+        "firestore": {"reads": db.reads, "writes": db.writes},
+        "problems": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--blocked-every", type=int, default=20, help="every Nth user has blocked the bot (0: none)")
+    parser.add_argument("--rate", type=float, default=1000, help="global send rate (Telegram allows about 30/s)")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--interrupt-after", type=int, default=0, help="shut down after this many users and resume")
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--firestore-latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(f"{result['job']} in {result['elapsed_s']}s -> {result['sent_per_s']} msg/s")
+    if result["interrupted_at"]:
+        print(f"interrupted at {result['interrupted_at']}, {result['duplicates']} sent twice after resuming")
+    print(f"firestore {result['firestore']}")
+    for problem in result["problems"]:
+        print(f"PROBLEM: {problem}")
+    if result["problems"]:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
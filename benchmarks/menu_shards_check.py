@@ -0,0 +1,116 @@
+"""Check that /soldout and /restock reach every shard when the menu is a file.
+
+    python benchmarks/menu_shards_check.py --workers 2
+
+Starts the sharded workers on a copy of menu.json, sends the admin's /soldout
+to the admin's shard, then asks every worker for its menu stats (as the
+ingress's /stats does) until all of them list the item as sold out. Does the
+same for /restock. Exits with code 1 if a shard never catches up, the flag
+didn't reach the menu file, or a toggle changed the menu version (carts are
+priced by version, so availability alone must not make new ones).
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config
+from fakes import UpdateFactory
+from sharding import ShardedRunner
+
+ADMIN = 42
+ITEM = "Jol Puchka (12 pcs)"
+
+
+def check_app_factory(config):
+    # Runs inside each worker process
+    import food_order_bot
+    from fakes import FakeBotRequest, FakeFirestore
+    app = food_order_bot.create_app(config, db=FakeFirestore(), request=FakeBotRequest())
+    food_order_bot.media_cache.store_path = os.path.join(tempfile.mkdtemp(), "media_cache.json")
+    return app
+
+
+async def sold_out_per_shard(runner):
+    """{shard: sold-out items}, None for a shard that didn't answer."""
+    shards = await runner.collect()
+    return {shard: payload["stats"]["menu"]["sold_out"] if payload.get("stats") else None for shard, payload in shards.items()}
+
+
+async def versions_per_shard(runner):
+    shards = await runner.collect()
+    return {shard: payload["stats"]["menu"]["version"] if payload.get("stats") else None for shard, payload in shards.items()}
+
+
+async def wait_for_shards(runner, sold_out, timeout):
+    """Seconds until every shard reports `sold_out` for ITEM, or None if some never did."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if all(flags is not None and (ITEM in flags) == sold_out for flags in (await sold_out_per_shard(runner)).values()):
+            return time.perf_counter() - started
+        await asyncio.sleep(0.05)
+    return None
+
+
+async def run(args):
+    directory = tempfile.mkdtemp()
+    menu_path = os.path.join(directory, "menu.json")
+    shutil.copy(os.path.join(ROOT, "menu.json"), menu_path)
+    config = Config(
+        token="123456:MENUCHECK",
+        admin_id=ADMIN,
+        persistence="none",
+        menu_source=menu_path,
+        menu_poll_interval=args.poll_interval,
+        order_log_path=os.path.join(directory, "orders.wal"),
+    )
+    runner = ShardedRunner(config, args.workers, app_factory=check_app_factory)
+    await runner.start()
+
+    problems, result = [], {"admin_shard": ADMIN % args.workers}
+    admin = UpdateFactory(ADMIN)
+    versions = await versions_per_shard(runner)
+    for command, sold_out in (("/soldout", True), ("/restock", False)):
+        await runner.dispatch(admin.message(f"{command} {ITEM}"))
+        seconds = await wait_for_shards(runner, sold_out, args.timeout)
+        if seconds is None:
+            problems.append(f"{command}: not every shard caught up within {args.timeout}s, sold out per shard: {await sold_out_per_shard(runner)}")
+        else:
+            result[f"{command[1:]}_s"] = round(seconds, 2)
+        with open(menu_path) as f:
+            on_disk = ITEM in json.load(f)["sold_out"]
+        if on_disk != sold_out:
+            problems.append(f"{command}: menu file lists it as {'sold out' if on_disk else 'available'}")
+
+    if await versions_per_shard(runner) != versions:
+        problems.append(f"menu versions went from {versions} to {await versions_per_shard(runner)}")
+    await runner.drain()
+    shutil.rmtree(directory, ignore_errors=True)
+    return result, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="menu file poll interval in the workers")
+    parser.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    result, problems = asyncio.run(run(args))
+    print(result)
+    for problem in problems:
+        print(f"PROBLEM: {problem}")
+    if problems:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Load generator for the ordering conversation.
+
+Replays simulated customers through the real `conv_handler`
+(start -> choose_item -> enter_quantity -> ... -> confirm) against a fake Bot
+API and an in-memory Firestore, then writes a JSON report:
+
+    python benchmarks/order_flow_bench.py --customers 5000 --concurrency 500
+    python benchmarks/order_flow_bench.py --baseline benchmarks/results/order_flow.json
+
+Handler times and event loop lag are read from the `metrics` histograms the
+bot exports on /metrics, so the percentiles are the same bucket estimates a
+dashboard shows. With --baseline the run fails (exit code 1) when throughput
+drops or any handler's p95 grows by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram import Update
+
+import food_order_bot as bot
+import metrics
+from config import Config
+from fakes import FakeBotRequest, FakeFirestore, UpdateFactory
+
+DEFAULT_OUTPUT = os.path.join(ROOT, "benchmarks", "results", "order_flow.json")
+
+
+def summarize(histogram, label_value):
+    """Calls, mean and bucket-estimated percentiles of one series, as /metrics would show them."""
+    count, total = histogram.totals().get(label_value, (0, 0.0))
+    return {
+        "count": count,
+        "mean_ms": round(total / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(histogram.quantile(label_value, 0.50) * 1000, 3),
+        "p95_ms": round(histogram.quantile(label_value, 0.95) * 1000, 3),
+        "p99_ms": round(histogram.quantile(label_value, 0.99) * 1000, 3),
+    }
+
+
+async def run_customer(app, request, user_id, rng, outcome):
+    factory = UpdateFactory(user_id, username=f"customer{user_id}")
+
+    async def send(data):
+        await app.process_update(Update.de_json(data, app.bot))
+        # A real customer's next tap comes later; without this, a fast fake API lets
+        # one customer's whole conversation run in a single task step
+        await asyncio.sleep(0)
+
+    await send(factory.message("/start"))
+    for _ in range(rng.randint(1, 3)):
+        await send(factory.callback(rng.choice(bot.catalog.current.available)))
+        await send(factory.message(str(rng.randint(1, 4))))
+    await send(factory.callback("DONE"))
+    await send(factory.message("98765" + str(user_id).zfill(5)[-5:]))
+    await send(factory.message(f"{user_id} Test Street"))
+    await send(factory.callback("SCHEDULE"))
+
+    # Pick the first slot the bot offered, like a customer tapping the keyboard
+    markup = request.last_markup(user_id) or {}
+    slots = [b["callback_data"] for row in markup.get("inline_keyboard", []) for b in row if b.get("callback_data", "").startswith("TIME_")]
+    if not slots:
+        outcome["no_slots"] += 1
+        return
+    await send(factory.callback(slots[0]))
+    await send(factory.message("skip"))
+    await send(factory.message("yes"))
+    outcome["completed"] += 1
+
+
+async def run(args):
+    db = FakeFirestore(latency=args.firestore_latency)
+    request = FakeBotRequest(latency=args.api_latency)
+    # Without --rate-limit the scheduler is still in the path, just never throttles
+    unlimited = 1e9
+    config = Config(
+        token="123456:BENCHMARK",
+        persistence="none",
+        menu_source=os.path.join(ROOT, "menu.json"),
+        slot_capacity=args.slot_capacity,
+        order_log_path=os.path.join(tempfile.mkdtemp(), "orders.wal"),
+        admin_digest_window=args.digest_window,
+        webhook_url="http://localhost",  # no Updater; updates are fed directly
+        send_rate_global=Config.send_rate_global if args.rate_limit else unlimited,
+        send_rate_per_chat=Config.send_rate_per_chat if args.rate_limit else unlimited,
+    )
+    app = bot.create_app(config, db=db, request=request)
+    bot.media_cache.store_path = os.path.join(tempfile.mkdtemp(), "media_cache.json")
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+
+    # create_app instrumented the handlers; count only this run's updates
+    metrics.handler_seconds.reset()
+    metrics.loop_lag_seconds.reset()
+    lag_task = asyncio.create_task(metrics.monitor_loop_lag(interval=0.01))
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    rng = random.Random(args.seed)
+    outcome = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def customer(user_id):
+        async with semaphore:
+            await run_customer(app, request, user_id, rng, outcome)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(1000000 + i) for i in range(args.customers)))
+    await bot.order_log.drain()
+    await bot.writer.flush()
+    elapsed = time.perf_counter() - started
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    tracemalloc.stop()
+    lag_task.cancel()
+    await asyncio.gather(lag_task, return_exceptions=True)
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+
+    updates = sum(request.calls.values())
+    handler_calls = {name: count for name, (count, _) in metrics.handler_seconds.totals().items()}
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "customers": dict(outcome),
+        "throughput": {
+            "orders_per_s": round(outcome["completed"] / elapsed, 2),
+            "handler_calls_per_s": round(sum(handler_calls.values()) / elapsed, 2),
+            "api_calls_per_s": round(updates / elapsed, 2),
+        },
+        "handlers": {name: summarize(metrics.handler_seconds, name) for name in sorted(handler_calls)},
+        "event_loop_lag": summarize(metrics.loop_lag_seconds, "main"),
+        "memory": {
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "traced_peak_kb": round(traced_peak / 1024) if traced_peak is not None else None,
+        },
+        "firestore": {"reads": db.reads, "writes": db.writes, "orders": len(db.collections["orders"])},
+        "api_calls": dict(request.calls),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Return a list of regressions of `result` against `baseline`."""
+    problems = []
+    old_tp = baseline["throughput"]["orders_per_s"]
+    new_tp = result["throughput"]["orders_per_s"]
+    if old_tp and new_tp < old_tp * (1 - tolerance):
+        problems.append(f"throughput {new_tp}/s vs baseline {old_tp}/s")
+    for name, stats in result["handlers"].items():
+        old = baseline["handlers"].get(name)
+        if old and old["p95_ms"] and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name} p95 {stats['p95_ms']}ms vs baseline {old['p95_ms']}ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--api-latency", type=float, default=0.02, help="simulated Bot API round-trip in seconds (Telegram is ~20-100ms)")
+    parser.add_argument("--firestore-latency", type=float, default=0.0, help="simulated Firestore round-trip in seconds")
+    parser.add_argument("--rate-limit", action="store_true", help="send through the outbound scheduler")
+    parser.add_argument("--digest-window", type=float, default=60, help="admin digest window in seconds (0 sends every order)")
+    parser.add_argument("--slot-capacity", type=int, default=0, help="orders per delivery slot (0: no limit, every customer takes the first slot)")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report Python heap peak (slower)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{result['customers']} in {result['elapsed_s']}s -> {result['throughput']['orders_per_s']} orders/s")
+    print(f"{'handler':<16}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["handlers"].items():
+        print(f"{name:<16}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"event loop lag p99 {result['event_loop_lag']['p99_ms']} ms, peak RSS {result['memory']['peak_rss_kb']} KB")
+    print(f"wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Check that order_stats counts every order once, after a crash and in the report cache.
+
+    python benchmarks/order_log_replay_check.py --orders 50 --unsaved 10
+
+Logs and replays `--orders` orders into an in-memory Firestore, then fakes a
+crash between the batch commit and the ack: the acks are cut from the log and
+`--unsaved` more orders are logged behind them without reaching Firestore. A
+fresh OrderLog on that file replays everything again. The `order_stats`
+totals must then match the orders in Firestore exactly.
+
+Then a /stats read is made to land between a batch's commit and the moment
+its increments are folded into the cache; the cached day must still match
+Firestore. Exits with code 1 on any mismatch.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import FakeFirestore
+from firestore_queue import FirestoreWriter
+from order_log import OrderLog
+from reporting import OrderReports, add_order, empty_totals, local_day
+
+ITEMS = {"Jol Puchka (12 pcs)": 50, "Alu Kabli (Full)": 40, "Papdi Chaat (Half)": 40}
+
+
+def make_order(rng, user_id):
+    name = rng.choice(list(ITEMS))
+    quantity = rng.randint(1, 3)
+    return {
+        "user_id": user_id,
+        "items": [{"item_name": name, "quantity": quantity, "price": ITEMS[name]}],
+        "total_price": ITEMS[name] * quantity + 20,
+        "delivery_time": rng.choice(["20:00", "20:15", "20:30"]),
+    }
+
+
+async def open_log(path, db):
+    writer = FirestoreWriter(db)
+    await writer.start()
+    log = OrderLog(path, writer=writer, reports=OrderReports(writer=writer), replay_interval=3600)
+    await log.start()
+    return writer, log
+
+
+async def close_log(writer, log):
+    await log.stop()
+    await writer.stop()
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "orders.wal")
+    db = FakeFirestore()
+
+    writer, log = await open_log(path, db)
+    for i in range(args.orders):
+        await log.submit(f"{1000 + i}-1", make_order(rng, 1000 + i))
+    await log.drain()
+    await close_log(writer, log)
+
+    # The crash: every ack lost, and orders logged after the last commit
+    with open(path) as f:
+        lines = [line for line in f if json.loads(line)["op"] == "order"]
+    with open(path, "w") as f:
+        f.writelines(lines)
+    writer, log = await open_log(path, db)
+    for i in range(args.unsaved):
+        await log.submit(f"{5000 + i}-1", make_order(rng, 5000 + i))
+    await log.drain()
+    await close_log(writer, log)
+    replayed = log.replayed
+
+    expected = {}
+    for order in db.collections["orders"].values():
+        add_order(expected.setdefault(local_day(order["timestamp"]), {**empty_totals(), "slots": {}}), order)
+    problems = []
+    if len(db.collections["orders"]) != args.orders + args.unsaved:
+        problems.append(f"{len(db.collections['orders'])} orders in Firestore, expected {args.orders + args.unsaved}")
+    for day, totals in expected.items():
+        stored = db.collections["order_stats"].get(day) or {}
+        for key in ("orders", "revenue", "items"):
+            if stored.get(key) != totals[key]:
+                problems.append(f"order_stats/{day} {key}: {stored.get(key)}, orders say {totals[key]}")
+
+    # A read landing after the commit but before applied() already holds the increments
+    writer, log = await open_log(path, db)
+    reports = log.reports
+    today = datetime.now().date()
+    await reports.day(today)
+    records = [{"op": "order", "id": f"{9000 + i}-1", "placed_at": datetime.now(timezone.utc).isoformat(), "order": make_order(rng, 9000 + i)} for i in range(5)]
+    token = reports.begin_commit()
+    totals = await writer.run(log._write_batch, records)
+    reports.invalidate()  # as if the TTL ran out just now
+    await reports.day(today)
+    reports.applied(totals, token)
+    cached = await reports.day(today)
+    stored = db.collections["order_stats"][today.isoformat()]
+    if (cached["orders"], cached["revenue"]) != (stored["orders"], stored["revenue"]):
+        problems.append(f"report cache says {cached['orders']} orders / {cached['revenue']} revenue, order_stats has {stored['orders']} / {stored['revenue']}")
+    await close_log(writer, log)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    counted = sum((db.collections["order_stats"].get(day) or {}).get("orders", 0) for day in expected)
+    return {"orders": len(db.collections["orders"]), "counted": counted, "replayed": replayed}, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--orders", type=int, default=50, help="orders saved and counted before the crash")
+    parser.add_argument("--unsaved", type=int, default=10, help="orders logged but not saved before the crash")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    result, problems = asyncio.run(run(args))
+    print(result)
+    for problem in problems:
+        print(f"PROBLEM: {problem}")
+    if problems:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
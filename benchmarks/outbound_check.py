@@ -0,0 +1,158 @@
+"""Behaviour check for the OutboundScheduler, driven through a Bot with the fake transport.
+
+    python benchmarks/outbound_check.py
+
+Three checks, exits with code 1 on any violation:
+
+1. Priority: with the global bucket drained, a customer reply queued after a
+   pile of broadcast sends and an admin copy goes out first, then the admin
+   copy, then the broadcasts in order.
+2. RetryAfter: a chat answering 429 twice is retried twice, waiting
+   retry_after plus the backoff each time; with retries exhausted the error
+   reaches the caller and counts as a drop.
+3. Dropping: broadcast sends that wait longer than max_wait are dropped with
+   OutboundDropped and counted, customer sends never are.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from fakes import FakeBotRequest
+from outbound import PRIORITY_BROADCAST, OutboundDropped, OutboundScheduler
+
+ADMIN = 42
+CUSTOMER = 1001
+
+
+class OrderedRequest(FakeBotRequest):
+    """Also remembers the order in which chats were sent to."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.order = []
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        code, body = await super().do_request(url, method, request_data, *args, **kwargs)
+        if code == 200 and url.endswith("/sendMessage"):
+            self.order.append(request_data.parameters["chat_id"])
+        return code, body
+
+
+async def make_bot(request, **limits):
+    scheduler = OutboundScheduler(chat_rate=1e9, chat_burst=1000, low_priority_chats={ADMIN}, **limits)
+    bot = ExtBot("123456:OUTBOUND", request=request, rate_limiter=scheduler)
+    await bot.initialize()
+    return bot, scheduler
+
+
+async def check_priority(args, problems):
+    request = OrderedRequest()
+    bot, scheduler = await make_bot(request, global_rate=args.rate)
+    broadcast = [5000 + i for i in range(args.broadcasts)]
+    tasks = [asyncio.create_task(bot.send_message(chat_id, "news", rate_limit_args=PRIORITY_BROADCAST)) for chat_id in broadcast]
+    await asyncio.sleep(0.01)  # the initial burst goes out at once, the rest queue
+    tasks.append(asyncio.create_task(bot.send_message(ADMIN, "admin copy")))
+    await asyncio.sleep(0.01)
+    tasks.append(asyncio.create_task(bot.send_message(CUSTOMER, "your order")))
+    await asyncio.gather(*tasks)
+    await bot.shutdown()
+
+    # Whatever the initial burst allowed (getMe took one token too) went out first
+    burst = request.order.index(CUSTOMER) if CUSTOMER in request.order else 0
+    if not 0 < burst < len(broadcast):
+        problems.append(f"priority: customer reply sent at position {burst}")
+    expected = broadcast[:burst] + [CUSTOMER, ADMIN] + broadcast[burst:]
+    if request.order != expected:
+        problems.append(f"priority: sent {request.order[burst - 1:burst + 3]}..., expected {expected[burst - 1:burst + 3]}...")
+    return {"sent": len(request.order), "customer_position": request.order.index(CUSTOMER)}
+
+
+async def check_retry_after(args, problems):
+    request = FakeBotRequest(flood={CUSTOMER: 2}, retry_after=1)
+    bot, scheduler = await make_bot(request, global_rate=1000)
+    started = time.perf_counter()
+    await bot.send_message(CUSTOMER, "your order")
+    elapsed = time.perf_counter() - started
+    # retry_after + 0.5 * 2 ** attempt, for attempts 0 and 1
+    expected = (1 + 0.5) + (1 + 1.0)
+    if scheduler.retries != 2:
+        problems.append(f"retry_after: {scheduler.retries} retries, expected 2")
+    if not expected <= elapsed < expected + 0.5:
+        problems.append(f"retry_after: delivered after {elapsed:.2f}s, expected {expected:.1f}s")
+    if len(request.messages[CUSTOMER]) != 1:
+        problems.append("retry_after: message not delivered exactly once")
+    await bot.shutdown()
+
+    request = FakeBotRequest(flood={CUSTOMER: 5}, retry_after=1)
+    bot, scheduler = await make_bot(request, global_rate=1000, max_retries=1)
+    try:
+        await bot.send_message(CUSTOMER, "your order")
+        problems.append("retry_after: no error after the retries ran out")
+    except RetryAfter:
+        pass
+    if scheduler.drops != 1 or request.calls["429"] != 2:
+        problems.append(f"retry_after: {scheduler.drops} drops and {request.calls['429']} attempts after giving up, expected 1 and 2")
+    await bot.shutdown()
+    return {"delay_s": round(elapsed, 2), "expected_s": expected}
+
+
+async def check_drops(args, problems):
+    request = FakeBotRequest(keep=1)
+    bot, scheduler = await make_bot(request, global_rate=args.rate, max_wait=args.max_wait)
+    broadcast = [6000 + i for i in range(args.broadcasts)]
+    customers = [7000 + i for i in range(5)]
+    tasks = [bot.send_message(chat_id, "news", rate_limit_args=PRIORITY_BROADCAST) for chat_id in broadcast]
+    tasks += [bot.send_message(chat_id, "your order") for chat_id in customers]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.shutdown()
+
+    dropped = [chat_id for chat_id, r in zip(broadcast + customers, results) if isinstance(r, OutboundDropped)]
+    others = [r for r in results if isinstance(r, Exception) and not isinstance(r, OutboundDropped)]
+    if not dropped:
+        problems.append("drops: nothing was dropped")
+    if scheduler.drops != len(dropped):
+        problems.append(f"drops: counter says {scheduler.drops}, callers saw {len(dropped)}")
+    if set(dropped) & set(customers):
+        problems.append("drops: a customer send was dropped")
+    if others:
+        problems.append(f"drops: unexpected errors {others[:3]}")
+    return {"dropped": len(dropped), "delivered": len(results) - len(dropped)}
+
+
+async def run(args):
+    problems = []
+    result = {
+        "priority": await check_priority(args, problems),
+        "retry_after": await check_retry_after(args, problems),
+        "drops": await check_drops(args, problems),
+    }
+    return result, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rate", type=float, default=20, help="global send rate for the priority and drop checks")
+    parser.add_argument("--broadcasts", type=int, default=60)
+    parser.add_argument("--max-wait", type=float, default=0.5)
+    args = parser.parse_args()
+
+    result, problems = asyncio.run(run(args))
+    for name, values in result.items():
+        print(f"{name}: {values}")
+    for problem in problems:
+        print(f"PROBLEM: {problem}")
+    if problems:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
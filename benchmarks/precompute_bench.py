@@ -0,0 +1,103 @@
+"""Micro-benchmark: per-tap keyboard and slot building vs. the precomputed tables.
+
+    python benchmarks/precompute_bench.py
+
+The "before" functions are the code that used to live in the handlers, copied
+here verbatim so the comparison keeps working after the handlers changed.
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from precompute import menu_keyboards, slot_table
+
+MENU_ITEMS = {
+    "Jol Puchka (12 pcs)": 50,
+    "Jol Puchka (6 pcs)": 25,
+    "Doi Puchka (12 pcs)": 60,
+    "Doi Puchka (6 pcs)": 40,
+    "Alu Kabli (Full)": 40,
+    "Alu Kabli (Half)": 25,
+    "Papdi Chaat (Full)": 60,
+    "Papdi Chaat (Half)": 40,
+    "Chana Masala (Full)": 50,
+    "Chana Masala (Half)": 30,
+}
+
+# A weekday afternoon, before opening, so every slot of the evening is offered
+NOW = datetime(2026, 10, 14, 15, 7)
+
+
+def old_menu_keyboard():
+    keyboard = [[InlineKeyboardButton(it, callback_data=it)] for it in MENU_ITEMS.keys()]
+    keyboard.append([InlineKeyboardButton("✅ Done", callback_data="DONE")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def new_menu_keyboard():
+    return menu_keyboards(tuple(MENU_ITEMS))[1]
+
+
+def old_slot_keyboard(now=NOW):
+    weekday = now.weekday()
+    today = now.date()
+    start_hour = 19 if weekday < 5 else 16
+    end_hour = 23
+    start_time = datetime.combine(today, datetime.min.time()) + timedelta(hours=start_hour)
+    end_time = datetime.combine(today, datetime.min.time()) + timedelta(hours=end_hour, minutes=0)
+    minutes = (now.minute // 15 + 1) * 15
+    if minutes >= 60:
+        start_slot = now + timedelta(hours=1)
+        start_slot = start_slot.replace(minute=0, second=0, microsecond=0)
+    else:
+        start_slot = now.replace(minute=minutes, second=0, microsecond=0)
+    slot = max(start_slot, start_time)
+    available_slots = []
+    while slot <= end_time:
+        label = slot.strftime("%I:%M %p").lstrip("0")
+        value = slot.strftime("%H:%M")
+        available_slots.append((label, value))
+        slot += timedelta(minutes=15)
+    keyboard = []
+    for i in range(0, len(available_slots), 3):
+        row = [InlineKeyboardButton(label, callback_data=f"TIME_{value}") for label, value in available_slots[i:i+3]]
+        keyboard.append(row)
+    return InlineKeyboardMarkup(keyboard), available_slots
+
+
+def new_slot_keyboard(now=NOW):
+    return slot_table(now).keyboard(now)
+
+
+def check_equivalent():
+    assert old_menu_keyboard() == new_menu_keyboard()
+    day = datetime(2026, 10, 17)  # a Saturday
+    for offset in range(0, 24 * 60, 7):
+        for base in (NOW.replace(hour=0, minute=0), day):
+            now = base + timedelta(minutes=offset)
+            old_markup, old_slots = old_slot_keyboard(now)
+            assert slot_table(now).remaining(now) == old_slots, now
+            if old_slots:
+                assert new_slot_keyboard(now) == old_markup, now
+
+
+def main(number=20000):
+    check_equivalent()
+    cases = [
+        ("menu keyboard", old_menu_keyboard, new_menu_keyboard),
+        ("slot keyboard", old_slot_keyboard, new_slot_keyboard),
+    ]
+    print(f"{'case':<16}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name, before, after in cases:
+        old_t = min(timeit.repeat(before, number=number, repeat=3)) / number * 1e6
+        new_t = min(timeit.repeat(after, number=number, repeat=3)) / number * 1e6
+        print(f"{name:<16}{old_t:>14.2f}{new_t:>14.2f}{old_t / new_t:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
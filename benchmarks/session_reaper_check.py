@@ -0,0 +1,182 @@
+"""Idle-session reclamation check: abandoned carts must not pile up.
+
+    python benchmarks/session_reaper_check.py --customers 300 --rounds 5
+
+Each round, --customers new users start an order through the real
+conversation (fake Bot API, in-memory Firestore) and stop at a random step:
+some finish the order, most leave a cart behind, some after holding a
+delivery slot. The session reaper's clock is then moved past the timeouts and
+one sweep runs. Exits with code 1 if a conversation or user_data survives its
+timeout, a held slot is not released, an abandoned customer gets no expiry
+notice, or memory after a sweep grows from round to round. It also fails
+first, with a clear message, if the installed python-telegram-bot lacks the
+ConversationHandler internals the reaper uses.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram import Update
+from telegram.ext import ConversationHandler
+
+import food_order_bot as bot
+from config import Config
+from fakes import FakeBotRequest, FakeFirestore, UpdateFactory
+from sessions import check_conversation_internals
+from slot_capacity_stress import FrozenDatetime, offered_slots
+
+TIMEOUT = 900
+IDLE_TTL = 3600
+
+
+async def customer(app, request, user_id, stop_after):
+    """Walk the order conversation for `stop_after` steps (9 places the order)."""
+    factory = UpdateFactory(user_id, username=f"idle{user_id}")
+
+    async def send(data):
+        await app.process_update(Update.de_json(data, app.bot))
+
+    steps = [
+        lambda: factory.message("/start"),
+        lambda: factory.callback(bot.catalog.current.available[0]),
+        lambda: factory.message("2"),
+        lambda: factory.callback("DONE"),
+        lambda: factory.message("9876543210"),
+        lambda: factory.message(f"{user_id} Test Street"),
+        lambda: factory.callback("SCHEDULE"),
+        lambda: factory.callback(offered_slots(request, user_id)[-1]),
+        lambda: factory.message("skip"),
+        lambda: factory.message("yes"),
+    ]
+    for step in steps[:stop_after + 1]:
+        await send(step())
+
+
+def check_internals():
+    """Problems with the ConversationHandler internals, and with the guard that checks them."""
+    problems = []
+    try:
+        check_conversation_internals(ConversationHandler(entry_points=[], states={}, fallbacks=[]))
+    except RuntimeError as e:
+        problems.append(str(e))
+
+    class Changed(ConversationHandler):
+        def _update_state(self, key, new_state):
+            pass
+
+    try:
+        check_conversation_internals(Changed(entry_points=[], states={}, fallbacks=[]))
+        problems.append("internals: a changed _update_state signature went unnoticed")
+    except RuntimeError:
+        pass
+    return problems
+
+
+async def run(args):
+    bot.datetime = FrozenDatetime
+    db = FakeFirestore()
+    request = FakeBotRequest(keep=2)
+    config = Config(
+        token="123456:SESSIONS",
+        persistence="none",
+        webhook_url="http://localhost",
+        menu_source=os.path.join(ROOT, "menu.json"),
+        order_log_path=os.path.join(tempfile.mkdtemp(), "orders.wal"),
+        admin_digest_window=0,
+        send_rate_global=1e9,
+        send_rate_per_chat=1e9,
+        slot_capacity=args.customers * args.rounds,
+        conversation_timeout=TIMEOUT,
+        conversation_timeouts="CONFIRM=300",
+        session_idle_ttl=IDLE_TTL,
+        session_sweep_interval=0,  # swept by hand below
+    )
+    app = bot.create_app(config, db=db, request=request)
+    bot.media_cache.store_path = os.path.join(tempfile.mkdtemp(), "media_cache.json")
+    now = [0.0]
+    bot.sessions.clock = lambda: now[0]
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+
+    rng = random.Random(args.seed)
+    problems, rounds = [], []
+    for n in range(args.rounds):
+        users = [7000000 + n * args.customers + i for i in range(args.customers)]
+        stops = {user_id: rng.randint(0, 9) for user_id in users}
+        await asyncio.gather(*(customer(app, request, user_id, stops[user_id]) for user_id in users))
+        abandoned = {user_id for user_id, stop in stops.items() if stop < 9}
+        await bot.sessions.sweep()  # nothing is idle yet
+        before = dict(bot.sessions.stats())
+        holds_before = bot.slot_capacity.stats()["holds"]
+
+        now[0] += TIMEOUT
+        started = time.perf_counter()
+        expired, _ = await bot.sessions.sweep()
+        sweep_ms = (time.perf_counter() - started) * 1000
+        now[0] += IDLE_TTL
+        _, dropped = await bot.sessions.sweep()
+        after = bot.sessions.stats()
+
+        notified = {u for u in abandoned if "cart expired" in (request.messages[u][-1][1].get("text", "") if request.messages.get(u) else "")}
+        if expired != len(abandoned):
+            problems.append(f"round {n}: {expired} conversations expired, {len(abandoned)} abandoned")
+        if notified != abandoned:
+            problems.append(f"round {n}: {len(abandoned - notified)} abandoned customers got no expiry notice")
+        if after["conversations"] or after["sessions"]:
+            problems.append(f"round {n}: {after['conversations']} conversations and {after['sessions']} sessions left")
+        if bot.slot_capacity.stats()["holds"]:
+            problems.append(f"round {n}: {bot.slot_capacity.stats()['holds']} slot holds left")
+        rounds.append({
+            "abandoned": len(abandoned),
+            "live_before": before["sessions"],
+            "bytes_before": before["session_bytes"],
+            "bytes_per_session": before["bytes_per_session"],
+            "holds_before": holds_before,
+            "expired": expired,
+            "dropped": dropped,
+            "bytes_after": after["session_bytes"],
+            "sweep_ms": round(sweep_ms, 2),
+        })
+
+    if len({r["bytes_after"] for r in rounds}) > 1:
+        problems.append(f"memory after sweeps changed between rounds: {[r['bytes_after'] for r in rounds]}")
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+    return {"rounds": rounds, "sessions": bot.sessions.stats(), "problems": problems}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--customers", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    problems = check_internals()
+    if problems:
+        for problem in problems:
+            print(f"PROBLEM: {problem}")
+        sys.exit(1)
+    result = asyncio.run(run(args))
+    for n, r in enumerate(result["rounds"]):
+        print(f"round {n}: {r}")
+    print(f"sessions {result['sessions']}")
+    for problem in result["problems"]:
+        print(f"PROBLEM: {problem}")
+    if result["problems"]:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
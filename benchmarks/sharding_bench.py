@@ -0,0 +1,121 @@
+"""Throughput of the sharded worker mode for 1..N worker processes.
+
+    python benchmarks/sharding_bench.py --workers 1 2 4 --customers 1000
+
+Each run starts the ingress's worker processes with a fake Bot API and an
+in-memory Firestore, pushes every simulated customer's full order flow through
+`ShardedRunner.dispatch`, and times until every worker has drained its queue.
+Extra workers only add throughput when there are cores for them: on a 1-CPU
+host two workers came out at x0.83-0.92 of one.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from functools import partial
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config
+from fakes import UpdateFactory
+from sharding import ShardedRunner
+
+ITEMS = ["Alu Kabli (Full)", "Doi Puchka (6 pcs)", "Papdi Chaat (Half)"]
+
+
+def bench_app_factory(config, api_latency=0.0, firestore_latency=0.0):
+    # Runs inside each worker process
+    import tempfile
+    import food_order_bot
+    from fakes import FakeBotRequest, FakeFirestore
+    app = food_order_bot.create_app(
+        config,
+        db=FakeFirestore(latency=firestore_latency),
+        request=FakeBotRequest(latency=api_latency),
+    )
+    food_order_bot.media_cache.store_path = os.path.join(tempfile.mkdtemp(), "media_cache.json")
+    return app
+
+
+def customer_updates(user_id):
+    f = UpdateFactory(user_id, username=f"customer{user_id}")
+    return [
+        f.message("/start"),
+        f.callback(ITEMS[user_id % len(ITEMS)]),
+        f.message("2"),
+        f.callback("DONE"),
+        f.message("9876543210"),
+        f.message(f"{user_id} Test Street"),
+        f.callback("SCHEDULE"),
+        f.callback("TIME_23:00"),  # always inside the delivery window
+        f.message("skip"),
+        f.message("yes"),
+    ]
+
+
+async def run_once(workers, args):
+    config = Config(
+        token="123456:BENCHMARK",
+        persistence="none",
+        menu_source=os.path.join(ROOT, "menu.json"),
+        slot_capacity=0,  # every customer books the same slot
+        order_log_path=os.path.join(tempfile.mkdtemp(), "orders.wal"),
+        send_rate_global=1e9,
+        send_rate_per_chat=1e9,
+    )
+    factory = partial(bench_app_factory, api_latency=args.api_latency, firestore_latency=args.firestore_latency)
+    runner = ShardedRunner(config, workers, app_factory=factory)
+    await runner.start()
+    # What the ingress's /stats and /metrics ask of every worker
+    missing = [shard for shard, payload in (await runner.collect()).items() if "error" in payload]
+    if missing:
+        raise RuntimeError(f"Workers {missing} did not answer the stats request")
+
+    flows = [customer_updates(2000000 + i) for i in range(args.customers)]
+    started = time.perf_counter()
+    # Interleave customers step by step, as live traffic would arrive
+    for step in range(len(flows[0])):
+        for flow in flows:
+            await runner.dispatch(flow[step])
+    results = await runner.drain()
+    elapsed = time.perf_counter() - started
+
+    updates = sum(r["processed"] for r in results.values())
+    return {
+        "workers": workers,
+        "elapsed_s": round(elapsed, 3),
+        "updates": updates,
+        "updates_per_s": round(updates / elapsed, 1),
+        "orders_per_s": round(args.customers / elapsed, 1),
+        "per_worker": {i: r["processed"] for i, r in sorted(results.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--firestore-latency", type=float, default=0.0)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "sharding.json"))
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        result = asyncio.run(run_once(workers, args))
+        results.append(result)
+        base = results[0]["updates_per_s"]
+        print(f"{workers:>2} workers: {result['updates_per_s']:>9} updates/s  {result['orders_per_s']:>7} orders/s  x{result['updates_per_s'] / base:.2f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"params": vars(args), "runs": results}, f, indent=2)
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
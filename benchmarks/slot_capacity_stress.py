@@ -0,0 +1,219 @@
+"""Concurrency stress test for delivery-slot capacity.
+
+    python benchmarks/slot_capacity_stress.py --customers 400 --capacity 5
+
+Two checks, both exit with code 1 on a violation:
+
+1. Thousands of interleaved reserve / release / commit calls on one
+   SlotCapacity, asserting after every step that no slot ever has more
+   committed orders plus holds than its capacity.
+2. Many customers racing through the real conversation (fake Bot API with
+   latency, in-memory Firestore) for the same few slots. Customers told that a
+   slot just filled up pick again. Afterwards no slot may hold more orders than
+   its capacity, and the counts saved to `slot_counts` must match the orders.
+
+The bot's clock is pinned to 15:07 today so every slot of the evening is open.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from datetime import time as dt_time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram import Update
+
+import food_order_bot as bot
+from config import Config
+from fakes import FakeBotRequest, FakeFirestore, UpdateFactory
+from slot_capacity import SlotCapacity
+
+FROZEN_NOW = datetime.combine(date.today(), dt_time(15, 7))
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return FROZEN_NOW
+
+
+# ------------------------ Direct ------------------------
+
+async def stress_reservations(args, rng):
+    capacity = SlotCapacity(args.capacity, hold_ttl=3600)
+    slots = [f"20:{m:02d}" for m in (0, 15, 30)]
+    confirmed = Counter()
+    violations = []
+
+    def check(step):
+        for slot in slots:
+            if capacity.used(slot) > args.capacity:
+                violations.append(f"{slot} at {capacity.used(slot)}/{args.capacity} after {step}")
+
+    async def customer(user_id):
+        for _ in range(rng.randint(1, 4)):
+            slot = rng.choice(slots)
+            held = capacity.reserve(user_id, slot)
+            check(f"reserve {user_id} {slot}")
+            await asyncio.sleep(0)
+            if not held:
+                continue
+            action = rng.random()
+            if action < 0.4:
+                capacity.commit(user_id, slot)
+                confirmed[slot] += 1
+                check(f"commit {user_id} {slot}")
+                return
+            if action < 0.7:
+                capacity.release(user_id)
+                check(f"release {user_id} {slot}")
+            await asyncio.sleep(0)
+        capacity.release(user_id)
+
+    await asyncio.gather(*(customer(i) for i in range(args.customers * 5)))
+    for slot in slots:
+        committed = capacity.used(slot)  # every hold was released or committed
+        if committed != confirmed[slot]:
+            violations.append(f"{slot}: {committed} committed but {confirmed[slot]} confirmations")
+    return {"operations": capacity.stats(), "confirmed": dict(confirmed), "violations": violations}
+
+
+# ------------------------ End to end ------------------------
+
+def offered_slots(request, user_id):
+    markup = request.last_markup(user_id) or {}
+    return [
+        b["callback_data"] for row in markup.get("inline_keyboard", []) for b in row
+        if b.get("callback_data", "").startswith("TIME_")
+    ]
+
+
+def last_text(request, user_id):
+    log = request.messages[user_id]
+    return log[-1][1].get("text", "") if log else ""
+
+
+async def run_customer(app, request, user_id, contested, outcome):
+    factory = UpdateFactory(user_id, username=f"customer{user_id}")
+
+    async def send(data):
+        await app.process_update(Update.de_json(data, app.bot))
+
+    await send(factory.message("/start"))
+    await send(factory.callback(bot.catalog.current.available[0]))
+    await send(factory.message("1"))
+    await send(factory.callback("DONE"))
+    await send(factory.message("9876543210"))
+    await send(factory.message(f"{user_id} Test Street"))
+    await send(factory.callback("SCHEDULE"))
+
+    # Everyone wants one of the contested slots; re-pick when told it filled up
+    for _ in range(len(contested) + 1):
+        offered = [s for s in offered_slots(request, user_id) if s in contested]
+        if not offered:
+            outcome["fully_booked"] += 1
+            return
+        await send(factory.callback(offered[0]))
+        if "filled up" not in last_text(request, user_id):
+            break
+        outcome["repicks"] += 1
+    else:
+        outcome["gave_up"] += 1
+        return
+    await send(factory.message("skip"))
+    await send(factory.message("yes"))
+    outcome["confirmed"] += 1
+
+
+async def stress_conversation(args):
+    bot.datetime = FrozenDatetime
+    db = FakeFirestore(latency=args.firestore_latency)
+    request = FakeBotRequest(latency=args.api_latency)
+    config = Config(
+        token="123456:STRESS",
+        persistence="none",
+        webhook_url="http://localhost",
+        menu_source=os.path.join(ROOT, "menu.json"),
+        slot_capacity=args.capacity,
+        order_log_path=os.path.join(tempfile.mkdtemp(), "orders.wal"),
+        admin_digest_window=0,
+        send_rate_global=1e9,
+        send_rate_per_chat=1e9,
+    )
+    app = bot.create_app(config, db=db, request=request)
+    bot.media_cache.store_path = os.path.join(tempfile.mkdtemp(), "media_cache.json")
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+
+    table = bot.slot_table(FROZEN_NOW)
+    contested = {f"TIME_{value}" for value in table.values[table.first_index(FROZEN_NOW):][:args.slots]}
+    outcome = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def customer(user_id):
+        async with semaphore:
+            await run_customer(app, request, user_id, contested, outcome)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(3000000 + i) for i in range(args.customers)))
+    elapsed = time.perf_counter() - started
+    await bot.order_log.drain()
+    await bot.writer.flush()
+
+    per_slot = Counter(order["delivery_time"] for order in db.collections["orders"].values())
+    saved = db.collections["slot_counts"].get(date.today().isoformat(), {})
+    violations = [f"{slot}: {n} orders > capacity {args.capacity}" for slot, n in per_slot.items() if n > args.capacity]
+    violations += [f"{slot}: {n} orders but slot_counts says {saved.get(slot)}" for slot, n in per_slot.items() if saved.get(slot) != n]
+    if outcome["confirmed"] != sum(per_slot.values()):
+        violations.append(f"{outcome['confirmed']} confirmations but {sum(per_slot.values())} orders saved")
+    expected = min(args.customers, args.capacity * len(contested))
+    if outcome["confirmed"] != expected:
+        violations.append(f"{outcome['confirmed']} orders placed, expected {expected}")
+
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "outcome": dict(outcome),
+        "orders_per_slot": dict(sorted(per_slot.items())),
+        "slots": bot.slot_capacity.stats(),
+        "violations": violations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--customers", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--capacity", type=int, default=5)
+    parser.add_argument("--slots", type=int, default=3, help="how many of the earliest slots customers compete for")
+    parser.add_argument("--api-latency", type=float, default=0.002)
+    parser.add_argument("--firestore-latency", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    direct = asyncio.run(stress_reservations(args, random.Random(args.seed)))
+    print(f"direct: {direct['operations']} confirmed {direct['confirmed']}")
+    conversation = asyncio.run(stress_conversation(args))
+    print(f"conversation: {conversation['outcome']} in {conversation['elapsed_s']}s, per slot {conversation['orders_per_slot']}")
+
+    violations = direct["violations"] + conversation["violations"]
+    for violation in violations:
+        print(f"VIOLATION: {violation}")
+    if violations:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+import metrics
+from firestore_queue import SERVER_TIMESTAMP
+from outbound import PRIORITY_BROADCAST, OutboundDropped
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "broadcasts"
+USERS = "users"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+
+class Broadcaster:
+    """Sends one message to every user in the `users` collection.
+
+    Users are streamed in `page_size` pages ordered by document id, so memory
+    stays flat however many users there are. `concurrency` workers send from a
+    bounded queue through the outbound scheduler at broadcast priority, which
+    keeps the global send rate and lets customer replies go first. The job's
+    counters, cursor (the last user of the last fully sent page) and the ids
+    already handled on the pages after it are checkpointed to
+    `broadcasts/<id>`, so an interrupted broadcast resumes where it stopped
+    without messaging anyone twice. A graceful stop checkpoints everything; a
+    crash loses at most the last `progress_interval` seconds of ids. Users who
+    blocked the bot get `blocked_at` and are skipped until they write again.
+    One broadcast runs at a time; progress is edited into a status message
+    for `chat_id` every `progress_interval` seconds.
+    """
+
+    def __init__(self, writer, chat_id, concurrency=20, page_size=500, progress_interval=10, clock=time.monotonic):
+        self.writer = writer
+        self.chat_id = chat_id
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.clock = clock
+
+        self.bot = None
+        self.job = None
+        self._task = None
+        self._stopping = None  # None, "cancelled" or "interrupted"
+        self._pages = deque()  # [users left to send, last user id, ids handled] per page in flight
+        self._resumed = set()  # ids handled by an earlier run and not reached again yet
+        self._status_message_id = None
+        self._run_started = 0.0
+        self._done_at_start = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot):
+        self.bot = bot
+
+    async def stop(self):
+        """Finish the sends in flight and checkpoint the job so /broadcast resume can pick it up."""
+        if self.running:
+            self._stopping = "interrupted"
+            await self._task
+
+    # ------------------------ Jobs ------------------------
+
+    async def begin(self, text):
+        if self.running:
+            raise RuntimeError("A broadcast is already running")
+        job_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.job = {
+            "id": job_id, "text": text, "status": "running", "cursor": None, "handled": [],
+            "sent": 0, "blocked": 0, "skipped": 0, "failed": 0,
+            "total": await self._count_users(),
+        }
+        await self._launch()
+        return self.job
+
+    async def resume(self):
+        """Continue the latest broadcast that was interrupted or crashed. None if there is none."""
+        if self.running:
+            raise RuntimeError("A broadcast is already running")
+        query = self.writer.db.collection(COLLECTION).where("status", "in", ["running", "interrupted"])
+        snapshots = await self.writer.run(lambda: list(query.stream()))
+        metrics.count_firestore("read", COLLECTION, max(1, len(snapshots)))
+        if not snapshots:
+            return None
+        latest = max(snapshots, key=lambda s: s.id)
+        self.job = {k: v for k, v in latest.to_dict().items() if k != "updated_at"}
+        self.job.update(id=latest.id, status="running")
+        await self._launch()
+        return self.job
+
+    def cancel(self):
+        if self.running:
+            self._stopping = "cancelled"
+        return self.running
+
+    async def _launch(self):
+        self._stopping = None
+        self._pages.clear()
+        self._resumed = set(self.job.get("handled") or ())
+        self._run_started = self.clock()
+        self._done_at_start = self.processed
+        self._checkpoint()
+        message = await self.bot.send_message(chat_id=self.chat_id, text=self.status_text())
+        self._status_message_id = message.message_id
+        self._task = asyncio.create_task(self._run())
+
+    async def _count_users(self):
+        try:
+            result = await self.writer.run(lambda: self.writer.db.collection(USERS).count().get())
+            metrics.count_firestore("read", USERS)
+            return int(result[0][0].value)
+        except Exception:
+            logger.warning("Could not count users; the broadcast runs without an ETA", exc_info=True)
+            return None
+
+    def _checkpoint(self):
+        job = self.job
+        # Users reached on pages past the cursor, so a resume doesn't message them again
+        job["handled"] = [*self._resumed, *(user_id for entry in self._pages for user_id in entry[2])]
+        self.writer.upsert(COLLECTION, job["id"], {
+            **{k: v for k, v in job.items() if k != "id"},
+            "updated_at": SERVER_TIMESTAMP,
+        })
+
+    # ------------------------ Sending ------------------------
+
+    def _fetch_page(self, cursor):
+        query = self.writer.db.collection(USERS).order_by("__name__").limit(self.page_size)
+        if cursor:
+            query = query.start_after([cursor])
+        return list(query.stream())
+
+    @staticmethod
+    def _blocked(user):
+        blocked_at = user.get("blocked_at")
+        if not blocked_at:
+            return False
+        # Writing to the bot after blocking it means they unblocked it
+        updated_at = user.get("updated_at")
+        return not updated_at or updated_at <= blocked_at
+
+    async def _run(self):
+        job = self.job
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        progress = asyncio.create_task(self._report_progress())
+        cursor = job["cursor"]
+        try:
+            while not self._stopping:
+                page = await self.writer.run(self._fetch_page, cursor)
+                metrics.count_firestore("read", USERS, len(page))
+                if not page:
+                    break
+                cursor = page[-1].id
+                entry = [len(page), cursor, []]
+                self._pages.append(entry)
+                for snapshot in page:
+                    if self._stopping:
+                        break
+                    if snapshot.id in self._resumed:
+                        # Counted by the run that handled it
+                        self._resumed.discard(snapshot.id)
+                        self._sent_one(entry, snapshot.id)
+                        continue
+                    if not snapshot.id.lstrip("-").isdigit() or self._blocked(snapshot.to_dict()):
+                        job["skipped"] += 1
+                        self._sent_one(entry, snapshot.id)
+                        continue
+                    await queue.put((int(snapshot.id), entry))
+                if len(page) < self.page_size:
+                    break
+            await queue.join()
+        except Exception:
+            logger.exception("Broadcast %s stopped by an error", job["id"])
+            self._stopping = self._stopping or "interrupted"
+            await queue.join()
+        finally:
+            for _ in workers:
+                queue.put_nowait(None)
+            await asyncio.gather(*workers)
+            progress.cancel()
+            await asyncio.gather(progress, return_exceptions=True)
+
+        job["status"] = self._stopping or "done"
+        self._checkpoint()
+        logger.info("Broadcast %s %s: %s", job["id"], job["status"], self.stats())
+        try:
+            await self._edit_status()
+            await self.bot.send_message(chat_id=self.chat_id, text=f"📣 Broadcast {job['status']}. Sent {job['sent']}, blocked {job['blocked']}, failed {job['failed']}.")
+        except TelegramError:
+            logger.warning("Could not report the end of broadcast %s", job["id"], exc_info=True)
+
+    async def _worker(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                chat_id, entry = item
+                # Once stopping, queued users are left for the resumed run
+                if not self._stopping:
+                    await self._send(chat_id)
+                    self._sent_one(entry, str(chat_id))
+            finally:
+                queue.task_done()
+
+    async def _send(self, chat_id):
+        job = self.job
+        for attempt in range(2):
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=job["text"], rate_limit_args=PRIORITY_BROADCAST)
+                job["sent"] += 1
+                return
+            except Forbidden:
+                job["blocked"] += 1
+                self.writer.upsert_user(chat_id, {"blocked_at": SERVER_TIMESTAMP})
+                return
+            except OutboundDropped:
+                # Shed by the scheduler while customer traffic went first
+                if attempt:
+                    break
+                await asyncio.sleep(1)
+            except BadRequest as e:
+                logger.info("Broadcast to %s rejected: %s", chat_id, e)
+                break
+            except TelegramError as e:
+                logger.warning("Broadcast to %s failed: %s", chat_id, e)
+                break
+        job["failed"] += 1
+
+    def _sent_one(self, entry, user_id):
+        entry[0] -= 1
+        entry[2].append(user_id)
+        advanced = False
+        while self._pages and self._pages[0][0] == 0:
+            self.job["cursor"] = self._pages.popleft()[1]
+            advanced = True
+        if advanced:
+            self._checkpoint()
+
+    # ------------------------ Progress ------------------------
+
+    @property
+    def processed(self):
+        job = self.job or {}
+        return sum(job.get(k, 0) for k in ("sent", "blocked", "skipped", "failed"))
+
+    def rate(self):
+        elapsed = self.clock() - self._run_started
+        return (self.processed - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def status_text(self):
+        if not self.job:
+            return "📣 No broadcast yet. Usage: /broadcast <message>"
+        job = self.job
+        total = job.get("total")
+        lines = [
+            f"📣 Broadcast {job['id']}: {job['status']}",
+            f"Sent {job['sent']}{f' of ~{total}' if total else ''} · blocked {job['blocked']} · skipped {job['skipped']} · failed {job['failed']}",
+        ]
+        rate = self.rate()
+        if job["status"] == "running":
+            eta = ""
+            if total and rate > 0:
+                eta = f" · ETA {format_duration(max(0, total - self.processed) / rate)}"
+            lines.append(f"{rate:.1f} msg/s{eta}")
+        return "\n".join(lines)
+
+    async def _edit_status(self):
+        try:
+            await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self._status_message_id, text=self.status_text())
+        except BadRequest:
+            pass  # unchanged text
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self._checkpoint()
+            try:
+                await self._edit_status()
+            except TelegramError:
+                logger.warning("Could not update the broadcast status", exc_info=True)
+
+    def stats(self):
+        job = self.job or {}
+        return {
+            "running": self.running,
+            "id": job.get("id"),
+            "sent": job.get("sent", 0),
+            "blocked": job.get("blocked", 0),
+            "skipped": job.get("skipped", 0),
+            "failed": job.get("failed", 0),
+            "total": job.get("total"),
+            "rate_per_s": round(self.rate(), 1) if self.running else 0.0,
+        }
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from types import MappingProxyType
+
+import metrics
+from precompute import menu_keyboards
+
+logger = logging.getLogger(__name__)
+
+MENU_COLLECTION = "menu"
+MENU_DOCUMENT = "current"
+# Shipped with the bot; used when the configured source has no menu
+DEFAULT_MENU = os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu.json")
+
+
+class MenuSnapshot:
+    """One immutable version of the menu: prices, sold-out items and keyboards."""
+
+    __slots__ = ("version", "prices", "sold_out", "available", "digest")
+
+    def __init__(self, version, prices, sold_out=()):
+        self.version = version
+        self.prices = MappingProxyType(dict(prices))
+        self.sold_out = frozenset(name for name in sold_out if name in self.prices)
+        self.available = tuple(name for name in self.prices if name not in self.sold_out)
+        self.digest = menu_digest(self.prices, self.sold_out)
+
+    def price(self, name):
+        return self.prices.get(name)
+
+    def is_available(self, name):
+        return name in self.prices and name not in self.sold_out
+
+    def keyboards(self):
+        """(without Done, with Done) item pickers, built once per set of available items."""
+        return menu_keyboards(self.available)
+
+
+def menu_digest(prices, sold_out):
+    return hashlib.sha1(json.dumps([list(prices.items()), sorted(sold_out)]).encode()).hexdigest()
+
+
+def parse_menu(data):
+    """Validate a menu document: {"version"?, "items": {name: price}, "sold_out"?: [names]}."""
+    items = data.get("items")
+    if not isinstance(items, dict) or not items:
+        raise ValueError("Menu has no items")
+    prices = {}
+    for name, price in items.items():
+        if not isinstance(price, (int, float)) or price < 0:
+            raise ValueError(f"Invalid price for {name!r}: {price!r}")
+        # Item names double as callback_data, which Telegram caps at 64 bytes
+        if len(name.encode()) > 64:
+            raise ValueError(f"Item name too long for a button: {name!r}")
+        prices[name] = price
+    return data.get("version"), prices, set(data.get("sold_out") or ())
+
+
+def read_menu_file(path):
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml  # optional, only needed for YAML menus
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def write_menu_file(path, data):
+    """Replace the menu file in one rename, so a poller never reads half of it."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            yaml.safe_dump(data, f, sort_keys=False, allow_unicode=True)
+        else:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+    os.replace(tmp, path)
+
+
+class MenuCatalog:
+    """Holds the current menu snapshot and reloads it in the background.
+
+    `source` is a JSON/YAML file (polled by mtime every `poll_interval` seconds)
+    or "firestore" for the `menu/current` document (snapshot listener, with
+    polling as a fallback). Handlers only ever read `current`, which is replaced
+    in one assignment, so a reload never blocks or half-updates a lookup. The
+    last `history` versions are kept so carts can be priced against the version
+    they started with; only price changes make a new version, sold-out flags
+    update the current one. `set_sold_out` writes the flag back to the source
+    (the Firestore document or the menu file), so every process watching it,
+    each shard in sharded mode included, picks it up on its next reload. If the
+    file can't be written the flag only holds in this process until it restarts.
+    """
+
+    def __init__(self, source="menu.json", writer=None, poll_interval=30, history=8, fallback_path=DEFAULT_MENU):
+        self.source = source
+        self.writer = writer
+        self.poll_interval = poll_interval
+        self.history = history
+        self.fallback_path = fallback_path
+
+        self.current = None
+        self._versions = OrderedDict()
+        self._overrides = {}  # item name -> sold out, for flags the menu file couldn't take
+        self._mtime = None
+        self._task = None
+        self._watch = None
+        self._stopping = False
+        self.reloads = 0
+        self.errors = 0
+
+    @property
+    def from_firestore(self):
+        return self.source == "firestore"
+
+    # ------------------------ Snapshots ------------------------
+
+    def get(self, version=None):
+        """The snapshot for `version` if it is still kept, otherwise the current one."""
+        return self._versions.get(version) or self.current
+
+    def price_for(self, name, version=None):
+        """Price of `name` in `version`, else in the current menu; None if neither has the item."""
+        price = self.get(version).price(name)
+        return self.current.price(name) if price is None else price
+
+    def _apply(self, data):
+        """Install `data` as a new version unless it matches the current one. Returns True if it did."""
+        version, prices, sold_out = parse_menu(data)
+        for name, flag in self._overrides.items():
+            (sold_out.add if flag else sold_out.discard)(name)
+        if self.current and self.current.digest == menu_digest(prices, sold_out & prices.keys()):
+            return False
+        latest = self.current.version if self.current else 0
+        if not (isinstance(version, int) and version > latest):
+            # Carts keep pricing against the same version when only availability changed;
+            # a file edited without bumping "version" still gets a new, higher version
+            version = latest if self.current and dict(self.current.prices) == prices else latest + 1
+        self._install(MenuSnapshot(version, prices, sold_out))
+        return True
+
+    def _install(self, snapshot):
+        self._versions[snapshot.version] = snapshot
+        while len(self._versions) > self.history:
+            self._versions.popitem(last=False)
+        self.current = snapshot
+        self.reloads += 1
+        logger.info("Menu version %s: %d items, %d sold out", snapshot.version, len(snapshot.prices), len(snapshot.sold_out))
+
+    async def set_sold_out(self, name, sold_out=True):
+        """Flag an item as sold out (or back in stock) right away. Returns False for unknown items."""
+        if name not in self.current.prices:
+            return False
+        flags = (self.current.sold_out - {name}) | ({name} if sold_out else set())
+        # Same prices, same version, so toggling doesn't push carts' versions out of `history`
+        self._install(MenuSnapshot(self.current.version, self.current.prices, flags))
+        if self.from_firestore:
+            # The listener echoes this back as an unchanged menu
+            self.writer.upsert(MENU_COLLECTION, MENU_DOCUMENT, {
+                "version": self.current.version,
+                "items": dict(self.current.prices),
+                "sold_out": sorted(flags),
+            })
+            return True
+        try:
+            await asyncio.to_thread(self._write_flags, flags)
+            self._overrides.pop(name, None)
+        except Exception:
+            self.errors += 1
+            logger.exception("Writing the sold-out flag to %s failed, keeping it in this process only", self.source)
+            self._overrides[name] = sold_out
+        return True
+
+    def _write_flags(self, flags):
+        # Keep whatever else the file holds, version included; the next poll sees an unchanged menu
+        data = read_menu_file(self.source) if os.path.exists(self.source) else {"version": self.current.version, "items": dict(self.current.prices)}
+        data["sold_out"] = sorted(flags)
+        write_menu_file(self.source, data)
+
+    # ------------------------ Loading ------------------------
+
+    def _read_source(self):
+        if self.from_firestore:
+            snapshot = self.writer.db.collection(MENU_COLLECTION).document(MENU_DOCUMENT).get()
+            metrics.count_firestore("read", MENU_COLLECTION)
+            return snapshot.to_dict() if snapshot.exists else None
+        mtime = os.stat(self.source).st_mtime_ns
+        if mtime == self._mtime:
+            return None
+        data = read_menu_file(self.source)
+        self._mtime = mtime
+        return data
+
+    async def reload(self):
+        """Re-read the source off the event loop. Returns True if the menu changed."""
+        try:
+            data = await asyncio.to_thread(self._read_source)
+            return data is not None and self._apply(data)
+        except Exception:
+            self.errors += 1
+            logger.exception("Reloading the menu from %s failed, keeping version %s", self.source, self.current and self.current.version)
+            return False
+
+    async def start(self):
+        await self.reload()
+        if self.current is None:
+            logger.warning("No menu in %s, falling back to %s", self.source, self.fallback_path)
+            self._apply(await asyncio.to_thread(read_menu_file, self.fallback_path))
+        if self.from_firestore and await self._listen():
+            return
+        if self.poll_interval > 0:
+            self._task = asyncio.create_task(self._poll())
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+
+        def on_snapshot(docs, changes, read_time):
+            for doc in docs:
+                if doc.exists:
+                    loop.call_soon_threadsafe(self._apply_safely, doc.to_dict())
+
+        def subscribe():
+            ref = self.writer.db.collection(MENU_COLLECTION).document(MENU_DOCUMENT)
+            return ref.on_snapshot(on_snapshot) if hasattr(ref, "on_snapshot") else None
+
+        try:
+            self._watch = await asyncio.to_thread(subscribe)
+        except Exception:
+            logger.exception("Menu snapshot listener failed, polling instead")
+        return self._watch is not None
+
+    def _apply_safely(self, data):
+        try:
+            self._apply(data)
+        except ValueError:
+            self.errors += 1
+            logger.exception("Ignoring invalid menu update")
+
+    async def _poll(self):
+        while not self._stopping:
+            await asyncio.sleep(self.poll_interval)
+            await self.reload()
+
+    async def stop(self):
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._watch:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def stats(self):
+        return {
+            "version": self.current.version if self.current else None,
+            "items": len(self.current.prices) if self.current else 0,
+            "sold_out": sorted(self.current.sold_out) if self.current else [],
+            "reloads": self.reloads,
+            "errors": self.errors,
+        }
@@ -0,0 +1,75 @@
+import os
+from dataclasses import dataclass
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+@dataclass
+class Config:
+    """Runtime settings, read from the environment by `from_env()`."""
+
+    token: str
+    firebase_json: str = None
+    admin_id: int = 5483332703
+    support_id: str = "Its_Hungry_cloud"
+    port: int = 8080
+    webhook_url: str = None  # e.g. https://hungry-cloud-bot.onrender.com
+    webhook_secret: str = None
+    menu_photo: str = "menu.jpeg"
+    menu_source: str = "menu.json"  # JSON/YAML file, or "firestore" for the menu/current document
+    menu_poll_interval: float = 30
+    persistence: str = "sqlite"  # "sqlite", "firestore" or "none"
+    persistence_path: str = "bot_state.sqlite3"
+    persistence_interval: float = 5
+    order_log_path: str = "orders.wal"  # confirmed orders are logged here before Firestore
+    admin_digest_window: float = 60
+    admin_digest_max_events: int = 25
+    send_rate_global: float = 30  # Bot API messages per second, all chats
+    send_rate_per_chat: float = 1
+    broadcast_concurrency: int = 20  # /broadcast sends in flight at once
+    activity_interval: float = 60  # seconds between last_message writes for one user
+    slot_capacity: int = 10  # orders per 15-minute delivery slot, 0 for no limit; split between sharded workers
+    slot_hold_ttl: float = 600  # seconds a picked slot is held before the order is confirmed
+    conversation_timeout: float = 900  # seconds an unfinished order may sit idle before its cart expires
+    conversation_timeouts: str = ""  # per-state overrides, e.g. "ENTER_ADDRESS=1800,CONFIRM=600"
+    session_idle_ttl: float = 3600  # seconds before a finished user's user_data is dropped
+    session_sweep_interval: float = 60
+    workers: int = 1  # >1 runs one ingress process and this many sharded workers (needs as many CPU cores to help)
+    shard: int = None  # set by the sharded runner for each worker
+
+    @classmethod
+    def from_env(cls):
+        token = os.getenv("BOT_TOKEN")
+        if not token:
+            raise RuntimeError("BOT_TOKEN is not set")
+        return cls(
+            token=token,
+            firebase_json=os.getenv("FIREBASE_JSON"),
+            admin_id=int(os.getenv("ADMIN_ID", cls.admin_id)),
+            support_id=os.getenv("SUPPORT_ID", cls.support_id),
+            port=int(os.getenv("PORT", cls.port)),
+            webhook_url=os.getenv("WEBHOOK_URL"),
+            webhook_secret=os.getenv("WEBHOOK_SECRET"),
+            menu_photo=os.getenv("MENU_PHOTO", cls.menu_photo),
+            menu_source=os.getenv("MENU_SOURCE", cls.menu_source),
+            menu_poll_interval=_env_float("MENU_POLL_INTERVAL", cls.menu_poll_interval),
+            persistence=os.getenv("PERSISTENCE", cls.persistence),
+            persistence_path=os.getenv("PERSISTENCE_PATH", cls.persistence_path),
+            persistence_interval=_env_float("PERSISTENCE_INTERVAL", cls.persistence_interval),
+            order_log_path=os.getenv("ORDER_LOG_PATH", cls.order_log_path),
+            admin_digest_window=_env_float("ADMIN_DIGEST_WINDOW", cls.admin_digest_window),
+            admin_digest_max_events=int(os.getenv("ADMIN_DIGEST_MAX_EVENTS", cls.admin_digest_max_events)),
+            send_rate_global=_env_float("SEND_RATE_GLOBAL", cls.send_rate_global),
+            send_rate_per_chat=_env_float("SEND_RATE_PER_CHAT", cls.send_rate_per_chat),
+            broadcast_concurrency=int(os.getenv("BROADCAST_CONCURRENCY", cls.broadcast_concurrency)),
+            activity_interval=_env_float("ACTIVITY_INTERVAL", cls.activity_interval),
+            slot_capacity=int(os.getenv("SLOT_CAPACITY", cls.slot_capacity)),
+            slot_hold_ttl=_env_float("SLOT_HOLD_TTL", cls.slot_hold_ttl),
+            conversation_timeout=_env_float("CONVERSATION_TIMEOUT", cls.conversation_timeout),
+            conversation_timeouts=os.getenv("CONVERSATION_TIMEOUTS", cls.conversation_timeouts),
+            session_idle_ttl=_env_float("SESSION_IDLE_TTL", cls.session_idle_ttl),
+            session_sweep_interval=_env_float("SESSION_SWEEP_INTERVAL", cls.session_sweep_interval),
+            workers=int(os.getenv("WORKERS", cls.workers)),
+        )
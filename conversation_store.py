@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import pickle
+import sqlite3
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteBackend:
+    """Stores pickled state rows in a local SQLite file."""
+
+    def __init__(self, path="bot_state.sqlite3"):
+        self.path = path
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS state (kind TEXT, key TEXT, value BLOB, PRIMARY KEY (kind, key))")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self):
+        conn = self._connect()
+        try:
+            return {(kind, key): value for kind, key, value in conn.execute("SELECT kind, key, value FROM state")}
+        finally:
+            conn.close()
+
+    def save(self, changes):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("DELETE FROM state WHERE kind = ? AND key = ?", [k for k, v in changes.items() if v is None])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO state (kind, key, value) VALUES (?, ?, ?)",
+                    [(kind, key, value) for (kind, key), value in changes.items() if value is not None],
+                )
+        finally:
+            conn.close()
+
+
+class FirestoreBackend:
+    """Stores pickled state in one Firestore collection, one document per row."""
+
+    def __init__(self, db, collection="bot_state"):
+        self.db = db
+        self.collection = collection
+
+    def load(self):
+        rows = {(doc.get("kind"), doc.get("key")): doc.get("value") for doc in self.db.collection(self.collection).stream()}
+        metrics.count_firestore("read", self.collection, len(rows))
+        return rows
+
+    def save(self, changes):
+        items = list(changes.items())
+        for i in range(0, len(items), 400):
+            batch = self.db.batch()
+            for (kind, key), value in items[i:i + 400]:
+                ref = self.db.collection(self.collection).document(f"{kind}:{key}")
+                if value is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, {"kind": kind, "key": key, "value": value})
+            batch.commit()
+            metrics.count_firestore("write", self.collection, len(items[i:i + 400]))
+
+
+class ConversationStore(BasePersistence):
+    """Persists ConversationHandler states and user_data through a pluggable backend.
+
+    PTB calls the update_* methods every `update_interval` seconds with whatever
+    changed; those calls only snapshot the data into a pending map, and a single
+    background task writes the coalesced changes to the backend on a worker thread.
+    A failed save keeps the rows pending and is retried with exponential backoff
+    (`retry_delay` up to `max_retry_delay`); `flush()` at shutdown makes
+    `flush_attempts` more tries. Everything is read back in one query when the
+    application starts.
+    """
+
+    def __init__(self, backend, update_interval=5, retry_delay=1.0, max_retry_delay=60.0, flush_attempts=3):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.backend = backend
+        self._loaded = None
+        self._pending = {}
+        self._write_task = None
+        self._wakeup = None
+        self._stopping = False
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.flush_attempts = flush_attempts
+        self.writes = 0
+        self.failures = 0
+        self.restore_ms = 0.0
+
+    # ------------------------ Loading ------------------------
+
+    def _load(self):
+        if self._loaded is None:
+            started = time.perf_counter()
+            rows = self.backend.load()
+            self._loaded = {"user": {}, "conversation": {}}
+            for (kind, key), value in rows.items():
+                if kind == "user":
+                    self._loaded["user"][int(key)] = pickle.loads(value)
+                elif kind.startswith("conversation:"):
+                    name = kind.split(":", 1)[1]
+                    conv_key = tuple(int(part) for part in key.split(","))
+                    self._loaded["conversation"].setdefault(name, {})[conv_key] = pickle.loads(value)
+            self.restore_ms = (time.perf_counter() - started) * 1000
+            logger.info(
+                "Restored %d users and %d conversations in %.1f ms",
+                len(self._loaded["user"]),
+                sum(len(c) for c in self._loaded["conversation"].values()),
+                self.restore_ms,
+            )
+        return self._loaded
+
+    async def get_user_data(self):
+        return await asyncio.to_thread(lambda: self._load()["user"])
+
+    async def get_conversations(self, name):
+        return (await asyncio.to_thread(self._load))["conversation"].get(name, {})
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # ------------------------ Staging ------------------------
+
+    def _stage(self, kind, key, value):
+        self._pending[(kind, key)] = value
+        if self._stopping:
+            return  # flush() writes whatever is staged from here on
+        if self._write_task is None or self._write_task.done():
+            self._wakeup = asyncio.Event()
+            self._write_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self, attempts=None):
+        """Save staged rows until none are left, backing off after failures.
+
+        Retries forever in the background unless stopping; with `attempts`
+        gives up after that many failures in a row. Returns True when
+        everything was saved.
+        """
+        delay, failed = self.retry_delay, 0
+        while self._pending:
+            changes, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self.backend.save, changes)
+                self.writes += 1
+                delay, failed = self.retry_delay, 0
+                continue
+            except Exception as e:
+                # Rows staged meanwhile are newer than the ones that failed
+                self._pending = {**changes, **self._pending}
+                self.failures += 1
+                failed += 1
+                if (attempts is not None and failed >= attempts) or (attempts is None and self._stopping):
+                    logger.exception("Saving %d conversation rows failed", len(self._pending))
+                    return False
+                logger.warning("Saving %d conversation rows failed (%s), retrying in %.0fs", len(self._pending), e, delay)
+            if attempts is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+        return True
+
+    async def update_user_data(self, user_id, data):
+        self._stage("user", str(user_id), pickle.dumps(data) if data else None)
+
+    async def drop_user_data(self, user_id):
+        self._stage("user", str(user_id), None)
+
+    async def update_conversation(self, name, key, new_state):
+        row_key = ",".join(str(part) for part in key)
+        self._stage(f"conversation:{name}", row_key, None if new_state is None else pickle.dumps(new_state))
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Called by PTB on shutdown: stop the background retries and write what is left."""
+        self._stopping = True
+        if self._write_task and not self._write_task.done():
+            # Wakes a save that is waiting out its backoff; it gives up once it fails again
+            self._wakeup.set()
+            await self._write_task
+        if self._pending and not await self._write_pending(attempts=self.flush_attempts):
+            logger.error("%d conversation rows could not be saved before shutdown", len(self._pending))
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "writes": self.writes,
+            "failures": self.failures,
+            "restore_ms": round(self.restore_ms, 2),
+        }
+
+
+def build_persistence(kind, db=None, path="bot_state.sqlite3", update_interval=5):
+    """Return a ConversationStore for "sqlite" or "firestore", or None when disabled."""
+    if kind == "sqlite":
+        return ConversationStore(SQLiteBackend(path), update_interval)
+    if kind == "firestore":
+        return ConversationStore(FirestoreBackend(db), update_interval)
+    return None
@@ -0,0 +1,372 @@
+"""In-memory stand-ins for Firestore and the Telegram Bot API.
+
+Used by the benchmarks and replay tools to drive the real handlers without a
+bot token or a Firebase project. Only the parts of each API this bot calls are
+implemented.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+from telegram.request import BaseRequest
+
+# ------------------------ Firestore ------------------------
+
+
+def _resolve(data, now, base=None):
+    """Apply sentinels and increments; with `base` (a merge) nested maps are merged into it."""
+    base = base or {}
+    out = dict(base)
+    for k, v in data.items():
+        if v is firestore.SERVER_TIMESTAMP:
+            v = now
+        elif isinstance(v, firestore.Increment):
+            v = (base.get(k) or 0) + v.value
+        elif isinstance(v, dict):
+            v = _resolve(v, now, base.get(k) if isinstance(base.get(k), dict) else None)
+        out[k] = v
+    return out
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentRef:
+    def __init__(self, store, collection, doc_id):
+        self._store = store
+        self.collection_name = collection
+        self.id = doc_id
+
+    def _docs(self):
+        return self._store.collections[self.collection_name]
+
+    def set(self, data, merge=False):
+        self._store._write(lambda now: self._set(data, merge, now))
+
+    def _set(self, data, merge, now):
+        docs = self._docs()
+        docs[self.id] = _resolve(data, now, docs.get(self.id) if merge else None)
+
+    def update(self, data):
+        self._store._write(lambda now: self._docs()[self.id].update(_resolve(data, now)))
+
+    def delete(self):
+        self._store._write(lambda now: self._docs().pop(self.id, None))
+
+    def get(self, transaction=None):
+        self._store._read()
+        with self._store.lock:
+            data = self._docs().get(self.id)
+            return FakeSnapshot(self, dict(data) if data is not None else None)
+
+
+class FakeQuery:
+    def __init__(self, store, collection, filters=(), order=None, limit=None, after=None):
+        self._store = store
+        self._collection = collection
+        self._filters = filters
+        self._order = order
+        self._limit = limit
+        self._after = after
+
+    def _copy(self, **changes):
+        args = dict(filters=self._filters, order=self._order, limit=self._limit, after=self._after)
+        args.update(changes)
+        return FakeQuery(self._store, self._collection, **args)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(order=(field, direction))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot_or_values):
+        return self._copy(after=snapshot_or_values)
+
+    def stream(self):
+        self._store._read()
+        ops = {
+            "==": lambda a, b: a == b,
+            ">": lambda a, b: a is not None and a > b,
+            ">=": lambda a, b: a is not None and a >= b,
+            "<": lambda a, b: a is not None and a < b,
+            "<=": lambda a, b: a is not None and a <= b,
+            "in": lambda a, b: a in b,
+        }
+
+        def value(row, field):
+            return row[0] if field == "__name__" else row[1].get(field)
+
+        with self._store.lock:
+            rows = [(doc_id, dict(data)) for doc_id, data in self._store.collections[self._collection].items()]
+        rows = [r for r in rows if all(ops[op](value(r, f), v) for f, op, v in self._filters)]
+        if self._order:
+            field, direction = self._order
+            rows = [r for r in rows if value(r, field) is not None]
+            rows.sort(key=lambda r: (value(r, field), r[0]), reverse=direction == firestore.Query.DESCENDING)
+        else:
+            rows.sort(key=lambda r: r[0])
+        if self._after is not None:
+            if isinstance(self._after, FakeSnapshot):
+                marker = self._after.id
+                ids = [r[0] for r in rows]
+                rows = rows[ids.index(marker) + 1:] if marker in ids else rows
+            else:
+                after = self._after[0] if isinstance(self._after, (list, tuple)) else self._after
+                field, direction = self._order
+                descending = direction == firestore.Query.DESCENDING
+                rows = [r for r in rows if (value(r, field) < after if descending else value(r, field) > after)]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for doc_id, data in rows:
+            yield FakeSnapshot(FakeDocumentRef(self._store, self._collection, doc_id), data)
+
+    def get(self):
+        return list(self.stream())
+
+    def count(self):
+        return FakeCount(self)
+
+
+class FakeCount:
+    """`query.count()`: `get()` returns [[result]] with the count in `result.value`."""
+
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        rows = list(self._query.stream())
+        return [[type("AggregationResult", (), {"alias": "count", "value": len(rows)})()]]
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, store, name):
+        super().__init__(store, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentRef(self._store, self._collection, str(doc_id) if doc_id is not None else uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+
+class FakeBatch:
+    def __init__(self, store):
+        self._store = store
+        self._ops = []
+        self._creates = []
+
+    def create(self, ref, data):
+        self._creates.append(ref)
+        self._ops.append(lambda now: ref._set(data, False, now))
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(lambda now: ref._set(data, merge, now))
+
+    def update(self, ref, data):
+        self._ops.append(lambda now: ref._docs()[ref.id].update(_resolve(data, now)))
+
+    def delete(self, ref):
+        self._ops.append(lambda now: ref._docs().pop(ref.id, None))
+
+    def commit(self):
+        ops, self._ops = self._ops, []
+        creates, self._creates = self._creates, []
+
+        def apply(now):
+            # Like Firestore, a create() of an existing document fails the whole batch
+            for ref in creates:
+                if ref.id in ref._docs():
+                    raise AlreadyExists(f"Document already exists: {ref.collection_name}/{ref.id}")
+            for op in ops:
+                op(now)
+
+        self._store._write(apply, count=len(ops))
+
+
+class FakeFirestore:
+    """Thread-safe dict-of-dicts Firestore client with optional simulated latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.collections = defaultdict(dict)
+        self.reads = 0
+        self.writes = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references):
+        for ref in references:
+            yield ref.get()
+
+    def _read(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.reads += 1
+
+    def _write(self, apply, count=1):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            apply(datetime.now(timezone.utc))
+            self.writes += count
+
+
+# ------------------------ Bot API ------------------------
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "Test Bot", "username": "test_food_bot"}
+
+
+class FakeBotRequest(BaseRequest):
+    """Answers Bot API calls locally, as if Telegram accepted every request.
+
+    Pass it to `ApplicationBuilder().request(...)`. Sent messages are kept per
+    chat (up to `keep` each) so callers can inspect replies and keyboards.
+    Sends to chats in `blocked` fail like they do for users who blocked the bot.
+    `flood` maps a chat id to how many of its next sends are answered with a
+    429 "retry after `retry_after` seconds", like Telegram's flood control.
+    """
+
+    def __init__(self, latency=0.0, keep=20, blocked=(), flood=None, retry_after=1):
+        self.latency = latency
+        self.keep = keep
+        self.blocked = set(blocked)
+        self.flood = dict(flood or {})
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.messages = defaultdict(list)  # chat_id -> [(endpoint, params)]
+        self._ids = itertools.count(1)
+        self._photos = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def last_markup(self, chat_id):
+        for endpoint, params in reversed(self.messages[chat_id]):
+            if "reply_markup" in params:
+                return params["reply_markup"]
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint != "getMe" and params.get("chat_id") in self.blocked:
+            return 403, json.dumps({"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}).encode()
+        if endpoint != "getMe" and self.flood.get(params.get("chat_id"), 0) > 0:
+            self.flood[params.get("chat_id")] -= 1
+            self.calls["429"] += 1
+            return 429, json.dumps({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }).encode()
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in ("sendMessage", "sendPhoto", "sendDocument", "editMessageText"):
+            chat_id = params.get("chat_id")
+            log = self.messages[chat_id]
+            log.append((endpoint, params))
+            if len(log) > self.keep:
+                del log[0]
+            result = {
+                "message_id": params.get("message_id") or next(self._ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+            if endpoint == "sendPhoto":
+                n = next(self._photos)
+                result["photo"] = [{"file_id": f"fake-photo-{n}", "file_unique_id": f"u{n}", "width": 800, "height": 600}]
+                result["caption"] = params.get("caption", "")
+            elif endpoint == "sendDocument":
+                result["document"] = {"file_id": f"fake-document-{result['message_id']}", "file_unique_id": f"d{result['message_id']}"}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# ------------------------ Updates ------------------------
+
+
+class UpdateFactory:
+    """Builds raw Update dicts for a simulated private chat with one customer."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, user_id, username=None):
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+        if username:
+            self.user["username"] = username
+        self.chat = {"id": user_id, "type": "private", "first_name": self.user["first_name"]}
+        self._message_ids = itertools.count(1)
+
+    def message(self, text):
+        data = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self.chat,
+            "from": self.user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": next(self._update_ids), "message": data}
+
+    def callback(self, data, message_id=1):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": uuid.uuid4().hex,
+                "from": self.user,
+                "chat_instance": str(self.chat["id"]),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": self.chat,
+                    "from": BOT_USER,
+                    "text": "",
+                },
+            },
+        }
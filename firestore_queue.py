@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 operations
+MAX_BATCH_SIZE = 500
+
+
+class _ServerTimestamp:
+    def __repr__(self):
+        return "SERVER_TIMESTAMP"
+
+
+# Stand-in for firestore.SERVER_TIMESTAMP that doesn't need the Firestore SDK
+# imported; the writer swaps in the real sentinel on its worker thread.
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+def _prepare(data):
+    if not any(v is SERVER_TIMESTAMP for v in data.values()):
+        return data
+    from firebase_admin import firestore
+    return {k: (firestore.SERVER_TIMESTAMP if v is SERVER_TIMESTAMP else v) for k, v in data.items()}
+
+
+class LazyFirestore:
+    """Firestore client that imports the SDK and authenticates on first use.
+
+    The first attribute access happens on a FirestoreWriter worker thread, so
+    neither the ~0.4s SDK import nor the credential exchange delays startup.
+    """
+
+    def __init__(self, credentials_json):
+        self._credentials_json = credentials_json
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    import firebase_admin
+                    from firebase_admin import credentials, firestore
+                    if not self._credentials_json:
+                        raise RuntimeError("FIREBASE_JSON is not set")
+                    cred = credentials.Certificate(json.loads(self._credentials_json))
+                    firebase_admin.initialize_app(cred)
+                    self._client = firestore.client()
+                    metrics.startup["firebase_init_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+
+class FirestoreWriter:
+    """Write-behind queue that keeps Firestore round-trips off the event loop.
+
+    `users` upserts are coalesced per document and committed as batched writes
+    by a background flush loop. Orders are written immediately on a worker
+    thread so the caller can await the insert before acknowledging the customer.
+    """
+
+    def __init__(self, db, flush_interval=1.0, batch_size=400, max_workers=4):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="firestore")
+        self._pending = {}  # (collection, doc_id) -> merged fields
+        self._wakeup = None
+        self._task = None
+        self._flush_lock = None
+        self._stopping = False
+
+        self.flushes = 0
+        self.docs_written = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    # ------------------------ Lifecycle ------------------------
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            # A flag rather than cancel(): wait_for can swallow a cancellation
+            # that lands just as the wakeup event is set
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # ------------------------ Writes ------------------------
+
+    def upsert(self, collection, doc_id, data):
+        """Queue a merge write. Later fields for the same document overwrite earlier ones."""
+        key = (collection, str(doc_id))
+        self._pending.setdefault(key, {}).update(data)
+        if len(self._pending) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+
+    def upsert_user(self, user_id, data):
+        self.upsert("users", user_id, data)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking Firestore call on the worker pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        # Taken even when nothing is pending, so the caller also waits for a flush already committing
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            items = list(pending.items())
+            started = time.perf_counter()
+            for i in range(0, len(items), self.batch_size):
+                chunk = items[i:i + self.batch_size]
+                try:
+                    await self.run(self._commit, chunk)
+                    self.docs_written += len(chunk)
+                except Exception:
+                    self.errors += 1
+                    logger.exception("Firestore batch of %d writes failed, requeueing", len(chunk))
+                    for key, data in chunk:
+                        # Keep anything newer that arrived while we were committing
+                        self._pending[key] = {**data, **self._pending.get(key, {})}
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+
+    def _commit(self, chunk):
+        batch = self.db.batch()
+        for (collection, doc_id), data in chunk:
+            batch.set(self.db.collection(collection).document(doc_id), _prepare(data), merge=True)
+        batch.commit()
+        for (collection, doc_id), data in chunk:
+            metrics.count_firestore("write", collection)
+
+    # ------------------------ Reporting ------------------------
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "flushes": self.flushes,
+            "docs_written": self.docs_written,
+            "errors": self.errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
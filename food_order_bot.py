@@ -1,29 +1,31 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes, ConversationHandler,
-    CallbackQueryHandler, MessageHandler, filters
+    CallbackQueryHandler, MessageHandler, TypeHandler, filters
 )
-import requests
-from datetime import datetime
+from telegram.error import TelegramError
+import asyncio
+import logging
 from datetime import datetime, timedelta
 
-
-
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-# Initialize Firebase app
 import json
 import os
-from firebase_admin import credentials
+import tempfile
 
-firebase_key = os.getenv("FIREBASE_JSON")
-firebase_dict = json.loads(firebase_key)
-cred = credentials.Certificate(firebase_dict)
-firebase_admin.initialize_app(cred)
+# Firestore is imported and authenticated lazily on first use (see LazyFirestore)
+from config import Config
+from firestore_queue import FirestoreWriter, LazyFirestore
+from media_cache import MediaCache
+from order_log import OrderLog, order_id
+from outbound import PRIORITY_CUSTOMER, OutboundScheduler
+from reporting import OrderReports, empty_totals, merge_stats, top_items
+from user_directory import UserDirectory
+import metrics
 
-# Get Firestore client
-db = firestore.client()
+logger = logging.getLogger(__name__)
 
 
 # API_URL = "http://127.0.0.1:8000/api/orders/"
@@ -31,59 +33,107 @@ db = firestore.client()
 import threading
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
+# Created by create_app(); None until then so importing this module has no side effects
+config = None
+writer = None
+media_cache = None
+outbound = None
+admin_digest = None
+catalog = None
+slot_capacity = None
+order_log = None
+reports = None
+broadcaster = None
+activity = None
+sessions = None
+user_directory = None
+persistence = None
+conv_handler = None
+built_at = None
+
+def bot_stats():
+    return {
+        "mode": "webhook" if config.webhook_url else "polling",
+        "startup": metrics.startup,
+        "reply_latency": metrics.reply_latency.snapshot(),
+        "firestore": writer.stats(),
+        "media": media_cache.stats(),
+        "outbound": outbound.stats(),
+        "admin_digest": admin_digest.stats(),
+        "menu": catalog.stats(),
+        "slots": slot_capacity.stats(),
+        "order_log": order_log.stats(),
+        "reports": reports.stats(),
+        "broadcast": broadcaster.stats(),
+        "users": user_directory.stats(),
+        "activity": activity.stats(),
+        "sessions": sessions.stats(),
+        "persistence": persistence.stats() if persistence else None,
+    }
+
 class KeepAliveHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        if self.path in ("/stats", "/metrics", "/profile"):
+            if self.path == "/stats":
+                body, content_type = json.dumps(bot_stats()).encode(), "application/json"
+            elif self.path == "/metrics":
+                body, content_type = metrics.render_prometheus().encode(), "text/plain; charset=utf-8"
+            else:
+                body, content_type = metrics.profiler.collapsed().encode(), "text/plain; charset=utf-8"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            self.wfile.write(body)
+            return
         self.send_response(200)
         self.end_headers()
         self.wfile.write(b'Bot is alive.')
 
-def run_keepalive():
-    server = HTTPServer(('0.0.0.0', 8080), KeepAliveHandler)
+def run_keepalive(port):
+    server = HTTPServer(('0.0.0.0', port), KeepAliveHandler)
     server.serve_forever()
 
-threading.Thread(target=run_keepalive).start()
-
 
-ADMIN_ID = 5483332703  # Your Telegram ID as int
-SUPPORT_ID = "Its_Hungry_cloud"  # Customer support Telegram ID as int
-
-MENU_ITEMS = {
-    "Jol Puchka (12 pcs)": 50,
-    "Jol Puchka (6 pcs)": 25,
-    "Doi Puchka (12 pcs)": 60,
-    "Doi Puchka (6 pcs)": 40,
-    "Alu Kabli (Full)": 40,
-    "Alu Kabli (Half)": 25,
-    "Papdi Chaat (Full)": 60,
-    "Papdi Chaat (Half)": 40,
-    "Chana Masala (Full)": 50,
-    "Chana Masala (Half)": 30,
-}
+ADMIN_ID = Config.admin_id  # Your Telegram ID as int (ADMIN_ID env)
+SUPPORT_ID = Config.support_id  # Customer support Telegram ID as int
 
 CHOOSING_ITEM, ENTER_QUANTITY, ENTER_MOBILE, ENTER_ADDRESS, ORDER_TYPE, ENTER_TIME, ENTER_NOTE, CONFIRM = range(8)
 
-# In-memory store for manual reply
-user_sessions = {}
+# Keyboards and delivery slot grids are built once and reused
+from precompute import format_label, slot_table
 
 # ------------------------ Utility Handlers ------------------------
 
 async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Group 1 handler: runs after the reply for every update from a user."""
+    if update.effective_user is None:
+        return
     user_id = update.effective_user.id
     username = update.effective_user.username or str(user_id).lower()
     last_message = ""
     if update.message:
-        last_message = update.message.text
+        last_message = update.message.text or ""
     elif update.callback_query:
-        last_message = update.callback_query.data
-    user_sessions[user_id] = {
-        "username": username,
-        "last_message": last_message
-    }
-    db.collection("users").document(str(user_id)).set({
-        "username": username,
-        "last_message": last_message,
-        "updated_at": firestore.SERVER_TIMESTAMP
-    }, merge=True)
+        last_message = update.callback_query.data or ""
+    user_directory.touch(user_id, username, last_message)
+    # Only writes to Firestore when something changed, at most once per interval per user
+    activity.touch(user_id, username, last_message)
+
+async def touch_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Group -2 handler: marks the user active before any handler runs, so a slow reply can't be swept."""
+    if update.effective_user is not None:
+        sessions.touch(update.effective_user.id)
+
+async def expire_session(chat_id, user_id, state):
+    """Called by the session reaper once an idle order conversation and its cart were dropped."""
+    slot_capacity.release(user_id)
+    minutes = round(sessions.timeout_for(state) / 60)
+    await sessions.application.bot.send_message(
+        chat_id=chat_id,
+        text=f"🛒 Your cart expired after {minutes} minutes without activity. Send /start to order again.",
+        # A reply to the customer's own order; broadcast priority could drop it after max_wait
+        rate_limit_args=PRIORITY_CUSTOMER,
+    )
 
 async def forward_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -91,8 +141,10 @@ async def forward_all_messages(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # 1. Send to your inbox (copy the message)
     if message.text:
-        text = f"📩 Message from @{user.username or user.id}:\n{message.text}"
-        await context.bot.send_message(chat_id=ADMIN_ID, text=text)
+        try:
+            await admin_digest.add_message(user.username or user.id, message.text)
+        except TelegramError as e:
+            logger.warning("Could not forward message to admin: %s", e)
 
         text = update.message.text.lower()
     if text in ["ok", "thanks", "thank you", "hello", "hi"]:
@@ -146,48 +198,38 @@ async def send_text(update: Update, text: str, reply_markup=None):
 
 def is_order_time(delivery_time=None):
     now = datetime.now()
-    weekday = now.weekday()  # 0 = Monday, 6 = Sunday
-
-    start_hour = 19 if weekday < 5 else 16
-    end_hour = 23  # until 11 PM
-
-    today = now.date()
-    
-    start_time = datetime.combine(today, datetime.min.time()) + timedelta(hours=start_hour)
-    end_time = datetime.combine(today, datetime.min.time()) + timedelta(hours=end_hour)
-
     if delivery_time:
         try:
             hours, minutes = map(int, delivery_time.split(":"))
-            delivery_dt = datetime.combine(today, datetime.min.time()) + timedelta(hours=hours, minutes=minutes)
         except ValueError:
             return False
     else:
-        delivery_dt = now
+        hours, minutes = now.hour, now.minute
 
-    return start_time <= delivery_dt <= end_time
+    return slot_table(now).contains(hours, minutes)
 
 
 # ------------------------ Bot Handlers ------------------------
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await track_user(update, context)
     text = "🍽️ Welcome to our food bot!\n\nCommands:\n/start - Show menu\n/support - Contact support\n/cancel - Cancel order (contact support)"
     await send_text(update, text)
 
     try:
-        with open("menu.jpeg", "rb") as menu_img:
-            if update.message:
-                await update.message.reply_photo(menu_img, caption="📜 Here’s our menu!")
-            elif update.callback_query:
-                await update.callback_query.message.reply_photo(menu_img, caption="📜 Here’s our menu!")
+        message = update.message or update.callback_query.message
+        await media_cache.send_photo(message, config.menu_photo, caption="📜 Here’s our menu!")
     except:
         await send_text(update, "📜 Here’s our menu:")
 
-    keyboard = [[InlineKeyboardButton(item, callback_data=item)] for item in MENU_ITEMS.keys()]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # The cart is priced against the menu version it started with
+    menu = catalog.current
+    reply_markup, _ = menu.keyboards()
     await send_text(update, "Select an item to add to your cart:", reply_markup)
     context.user_data['cart'] = []
+    context.user_data['menu_version'] = menu.version
+    # Starting over gives back the slot an unfinished order was holding
+    slot_capacity.release(update.effective_user.id)
+    context.user_data['conversation_id'] = update.effective_message.message_id
     return CHOOSING_ITEM
 
 async def choose_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -202,6 +244,13 @@ async def choose_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.edit_text("📱 Enter your mobile number for delivery:")
         return ENTER_MOBILE
 
+    menu = catalog.current
+    if not menu.is_available(item):
+        without_done, with_done = menu.keyboards()
+        await query.message.edit_text(f"😔 {item} is not available right now. Pick something else:",
+                                      reply_markup=with_done if context.user_data.get('cart') else without_done)
+        return CHOOSING_ITEM
+
     context.user_data['current_item'] = item
     await query.message.edit_text(f"📦 Enter quantity for {item}:")
     return ENTER_QUANTITY
@@ -214,16 +263,19 @@ async def enter_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ENTER_QUANTITY
 
     item = context.user_data['current_item']
+    price = catalog.price_for(item, context.user_data.get('menu_version'))
+    if price is None:
+        # Removed from the menu after it was picked, and the cart's version is gone too
+        await update.message.reply_text(f"😔 {item} is no longer on the menu. Your order starts over with the current menu.")
+        return await start(update, context)
     context.user_data['cart'].append({
         "item_name": item,
         "quantity": quantity,
-        "price": MENU_ITEMS[item]
+        "price": price
     })
 
     # Show menu again with DONE button
-    keyboard = [[InlineKeyboardButton(it, callback_data=it)] for it in MENU_ITEMS.keys()]
-    keyboard.append([InlineKeyboardButton("✅ Done", callback_data="DONE")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    _, reply_markup = catalog.current.keyboards()
     await update.message.reply_text("✅ Item added! Select another item or Done:", reply_markup=reply_markup)
     return CHOOSING_ITEM
 
@@ -260,16 +312,24 @@ async def enter_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #     else:
 #         await query.message.edit_text("🕒 Enter delivery time (HH:MM):")
 #         return ENTER_TIME
-from datetime import datetime, timedelta
+
+def slot_keyboard():
+    """Today's remaining slots without the fully booked ones, and whether any were hidden."""
+    now = datetime.now()
+    table = slot_table(now)
+    full = slot_capacity.full_slots(table.values[table.first_index(now):])
+    return table.keyboard(now, full), bool(full)
 
 async def order_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     if query.data == "NOW":
-        now_time = datetime.now().strftime("%H:%M")
+        now = datetime.now()
+        now_time = now.strftime("%H:%M")
         context.user_data['delivery_time'] = now_time
-        context.user_data['delivery_time_display'] = datetime.now().strftime("%I:%M %p").lstrip("0")
+        context.user_data['delivery_time_display'] = format_label(now.hour, now.minute)
+        context.user_data['order_now'] = True
 
         if not is_order_time(now_time):  # ✅ Pass current full time
             await send_text(update, "⚠️ Orders can only be placed between 7–11 PM on weekdays and 4–11 PM on weekends.")
@@ -278,46 +338,14 @@ async def order_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.edit_text("Optional: Add a note for your order (like spice level) or type 'skip':")
         return ENTER_NOTE
 
-    now = datetime.now()
-    weekday = now.weekday()
-    today = now.date()
-
-    start_hour = 19 if weekday < 5 else 16
-    end_hour = 23
-    from datetime import timedelta
-    # Correctly limit to 11:00 PM
-    start_time = datetime.combine(today, datetime.min.time()) + timedelta(hours=start_hour)
-    end_time = datetime.combine(today, datetime.min.time()) + timedelta(hours=end_hour, minutes=0)
-
-    # Round current time to next 15-min slot
-    from datetime import timedelta
-
-    minutes = (now.minute // 15 + 1) * 15
-    if minutes >= 60:
-        start_slot = now + timedelta(hours=1)
-        start_slot = start_slot.replace(minute=0, second=0, microsecond=0)
-    else:
-        start_slot = now.replace(minute=minutes, second=0, microsecond=0)
-
-    slot = max(start_slot, start_time)
-
-    available_slots = []
-    while slot <= end_time:
-        label = slot.strftime("%I:%M %p").lstrip("0")
-        value = slot.strftime("%H:%M")
-        available_slots.append((label, value))
-        slot += timedelta(minutes=15)
-
-    if not available_slots:
-        await query.message.edit_text("⚠️ No delivery slots available at this time for today, Orders can only be scheduled for 7–11 PM on weekdays and 4–11 PM on weekends .")
+    reply_markup, any_full = slot_keyboard()
+    if reply_markup is None:
+        if any_full:
+            await query.message.edit_text("⚠️ All remaining delivery slots for today are fully booked. Use /start to order for now, or try again tomorrow.")
+        else:
+            await query.message.edit_text("⚠️ No delivery slots available at this time for today, Orders can only be scheduled for 7–11 PM on weekdays and 4–11 PM on weekends .")
         return ConversationHandler.END
 
-    keyboard = []
-    for i in range(0, len(available_slots), 3):
-        row = [InlineKeyboardButton(label, callback_data=f"TIME_{value}") for label, value in available_slots[i:i+3]]
-        keyboard.append(row)
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await query.message.edit_text("🕒 Select your delivery time:", reply_markup=reply_markup)
     return ENTER_TIME
 
@@ -349,17 +377,26 @@ async def enter_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.message.edit_text("⚠️ Invalid delivery time. Please choose within valid hours.")
             return ConversationHandler.END
 
+        # Hold a place in the slot until the order is confirmed or cancelled
+        if not slot_capacity.reserve(update.effective_user.id, selected_time):
+            reply_markup, _ = slot_keyboard()
+            if reply_markup is None:
+                await query.message.edit_text("⚠️ All remaining delivery slots for today are fully booked.")
+                return ConversationHandler.END
+            await query.message.edit_text("⚠️ That slot just filled up. Please pick another time:", reply_markup=reply_markup)
+            return ENTER_TIME
+
         # Store delivery time (machine format)
         context.user_data['delivery_time'] = selected_time
 
         # Store human-readable display time
         try:
-            dt_obj = datetime.strptime(selected_time, "%H:%M")
-            display_time = dt_obj.strftime("%-I:%M %p")  # Use "%I:%M %p" on Windows
-        except:
+            display_time = slot_table().label(selected_time)
+        except ValueError:
             display_time = selected_time
 
         context.user_data['delivery_time_display'] = display_time
+        context.user_data['order_now'] = False
 
         await query.message.edit_text("Optional: Add a note for your order (like spice level) or type 'skip':")
         return ENTER_NOTE
@@ -393,6 +430,7 @@ async def show_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text.lower() != "yes":
+        slot_capacity.release(update.effective_user.id)
         await send_text(update, "❌ Order canceled. For cancellation, contact /support.")
         return ConversationHandler.END
 
@@ -406,44 +444,66 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     "delivery_time": context.user_data['delivery_time'],  # e.g., "20:15"
     "delivery_time_display": context.user_data['delivery_time_display'],  # e.g., "8:15 PM"
     "note": context.user_data.get('note', ""),
-    "timestamp": firestore.SERVER_TIMESTAMP
+    "menu_version": context.user_data.get('menu_version'),
+    # "timestamp" (confirmation time) is added when the order log writes it to Firestore
     }
+    # Same id for the same conversation, so a redelivered "yes" can't create a second order
+    oid = order_id(update.effective_user.id, context.user_data.get('conversation_id') or update.message.message_id)
+    order_data["order_id"] = oid
 
-    try:
-        # Add document to Firestore under "orders" collection
-        db.collection("orders").add(order_data)
+    # Count the order against its slot before the await, so the place can't be given away meanwhile
+    scheduled = not context.user_data.get('order_now', False)
+    if scheduled:
+        slot_capacity.commit(update.effective_user.id, order_data['delivery_time'])
 
-        await send_text(update, "✅ Order placed successfully! 🎉")
+    try:
+        # Written to the local order log and fsynced; Firestore gets it in the background
+        logged = await order_log.submit(oid, order_data)
+    except Exception as e:
+        if scheduled:
+            slot_capacity.uncommit(order_data['delivery_time'])
+        await send_text(update, f"⚠️ Failed to save order: {e}")
+        return ConversationHandler.END
 
-        # Prepare admin summary
-        order_summary = "\n".join([
-            f"{i['item_name']} x {i['quantity']} (₹{i['price']})"
-            for i in context.user_data['cart']
-        ])
-        if context.user_data['delivery_charge'] > 0:
-            order_summary += f"\n🚚 Delivery charge: ₹{context.user_data['delivery_charge']}"
+    if not logged:
+        if scheduled:
+            slot_capacity.uncommit(order_data['delivery_time'])
+        await send_text(update, "✅ This order was already placed.")
+        return ConversationHandler.END
 
-        admin_msg = (
-            f"🛎 New Order from @{update.effective_user.username}:\n"
-            f"📱 {context.user_data['mobile']}\n"
-            f"🏠 {context.user_data['address']}\n"
-            f"🕒 Delivery Time: {context.user_data['delivery_time_display']}\n"
-            f"📝 Note: {context.user_data.get('note', 'None')}\n\n"
-            f"{order_summary}\n"
-            f"💰 Total: ₹{context.user_data['total_price']}"
-        )
+    await send_text(update, "✅ Order placed successfully! 🎉")
 
+    # Prepare admin summary
+    order_summary = "\n".join([
+        f"{i['item_name']} x {i['quantity']} (₹{i['price']})"
+        for i in context.user_data['cart']
+    ])
+    if context.user_data['delivery_charge'] > 0:
+        order_summary += f"\n🚚 Delivery charge: ₹{context.user_data['delivery_charge']}"
 
-        await context.bot.send_message(chat_id=ADMIN_ID, text=admin_msg)
+    admin_msg = (
+        f"🛎 New Order from @{update.effective_user.username}:\n"
+        f"📱 {context.user_data['mobile']}\n"
+        f"🏠 {context.user_data['address']}\n"
+        f"🕒 Delivery Time: {context.user_data['delivery_time_display']}\n"
+        f"📝 Note: {context.user_data.get('note', 'None')}\n\n"
+        f"{order_summary}\n"
+        f"💰 Total: ₹{context.user_data['total_price']}"
+    )
 
-    except Exception as e:
-        await send_text(update, f"⚠️ Failed to save order: {e}")
+    # The order is saved; a lost admin copy must not be reported to the customer as a failure.
+    # "Place Now" orders skip the digest so the kitchen can start right away.
+    try:
+        await admin_digest.add_order(order_data, admin_msg, urgent=context.user_data.get('order_now', False))
+    except TelegramError as e:
+        logger.error("Admin notification for order from %s failed: %s", update.effective_user.id, e)
 
     return ConversationHandler.END
 
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    slot_capacity.release(update.effective_user.id)
     await send_text(update, "❌ To cancel an order, please contact /support.")
     return ConversationHandler.END
 
@@ -486,21 +546,9 @@ async def manual_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             target_user_id = int(target)
         except ValueError:
-            # Lookup by username in user_sessions
-            found = False
-            target_user_id = None
-            for uid, info in user_sessions.items():
-                if info["username"] == target:
-                    target_user_id = uid
-                    found = True
-                    break
-            if not target_user_id:
-                users = db.collection("users").where("username", "==", target).stream()
-                for user_doc in users:
-                    target_user_id = int(user_doc.id)
-                    found = True
-                    break
-            if not found:
+            # Lookup by username in the user directory (Firestore only on a miss)
+            target_user_id = await user_directory.resolve_username(target, writer)
+            if target_user_id is None:
                 await update.message.reply_text(f"❌ User @{target} not found in sessions.")
                 return
 
@@ -510,31 +558,395 @@ async def manual_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text(f"⚠️ Error: {e}")
 
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    action = context.args[0].lower() if context.args else "status"
+    if action == "on":
+        metrics.profiler.start()
+        await update.message.reply_text("🔬 Profiler started. Use /profile off to see the hottest frames.")
+    elif action == "off":
+        metrics.profiler.stop()
+        top = "\n".join(f"{count} {frame}" for frame, count in metrics.profiler.top()) or "No samples."
+        await update.message.reply_text(f"🔬 Profiler stopped. Top frames:\n{top}\n\nFull stacks are served at /profile on the health port.")
+    else:
+        state = "running" if metrics.profiler.running else "stopped"
+        await update.message.reply_text(f"🔬 Profiler is {state}. Usage: /profile on|off")
+
+async def sold_out(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    flag = update.message.text.split()[0].lstrip("/").split("@")[0].lower() == "soldout"
+    wanted = " ".join(context.args).lower()
+    name = next((n for n in catalog.current.prices if n.lower() == wanted), None)
+    if name is None:
+        items = "\n".join(catalog.current.prices)
+        await update.message.reply_text(f"⚠️ Usage: /soldout <item> or /restock <item>\n\n{items}")
+        return
+
+    await catalog.set_sold_out(name, flag)
+    state = "sold out" if flag else "back in stock"
+    await update.message.reply_text(f"✅ {name} is {state} (menu version {catalog.current.version}).")
+
+def format_items(items, n=None):
+    return "\n".join(f"{name} x {qty}" for name, qty in top_items(items, n)) or "No items."
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    period = context.args[0].lower() if context.args else "today"
+    today = datetime.now().date()
+    if period not in ("today", "week"):
+        await update.message.reply_text("⚠️ Usage: /stats today|week")
+        return
+
+    # Read from the running order_stats totals; no scan of the orders collection
+    first = today if period == "today" else today - timedelta(days=6)
+    days = await reports.days(first, today)
+    total = empty_totals()
+    for _, day_stats in days:
+        merge_stats(total, {k: v for k, v in day_stats.items() if k != "slots"})
+
+    average = total["revenue"] / total["orders"] if total["orders"] else 0
+    lines = [f"📊 {'Today' if period == 'today' else 'Last 7 days'} ({first.isoformat()}{'' if period == 'today' else ' – ' + today.isoformat()})"]
+    if period == "week":
+        lines += [f"{day}: {s['orders']} orders, ₹{s['revenue']}" for day, s in days]
+        lines.append("")
+    lines += [
+        f"🧾 Orders: {total['orders']}",
+        f"💰 Revenue: ₹{total['revenue']}",
+        f"📈 Average order: ₹{average:.0f}",
+        "",
+        "🍽 Top items:",
+        format_items(total["items"], 5),
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+async def kitchen(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    slot = None
+    if context.args:
+        try:
+            hours, minutes = map(int, context.args[0].split(":"))
+            slot = f"{hours:02d}:{minutes:02d}"
+        except ValueError:
+            await update.message.reply_text("⚠️ Usage: /kitchen [HH:MM]")
+            return
+
+    slots = (await reports.day()).get("slots", {})
+    if slot is not None:
+        wanted = {slot: slots.get(slot, empty_totals())}
+    else:
+        # Everything still to cook: slots from the current quarter hour on
+        now = datetime.now()
+        cutoff = f"{now.hour:02d}:{now.minute // 15 * 15:02d}"
+        wanted = {s: t for s, t in sorted(slots.items()) if s >= cutoff}
+        if not wanted:
+            await update.message.reply_text("👩‍🍳 No orders for the remaining slots today.")
+            return
+
+    blocks = [f"🕒 {s} — {t['orders']} orders\n{format_items(t['items'])}" for s, t in wanted.items()]
+    await update.message.reply_text("👩‍🍳 Kitchen\n\n" + "\n\n".join(blocks))
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    # Everything after the command, with the admin's line breaks kept
+    parts = update.message.text.split(None, 1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    action = text.lower()
+    if not text or action == "status":
+        await update.message.reply_text(broadcaster.status_text())
+    elif action == "cancel":
+        if broadcaster.cancel():
+            await update.message.reply_text("🛑 Stopping the broadcast after the messages in flight.")
+        else:
+            await update.message.reply_text("⚠️ No broadcast is running.")
+    elif broadcaster.running:
+        await update.message.reply_text("⚠️ A broadcast is already running. Use /broadcast status or /broadcast cancel.")
+    elif action == "resume":
+        # The status message with progress and ETA is sent by the broadcaster
+        if await broadcaster.resume() is None:
+            await update.message.reply_text("⚠️ No interrupted broadcast to resume.")
+    else:
+        await broadcaster.begin(text)
+
+# Telegram refuses bot uploads above this size
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    args = [a.lower() for a in context.args]
+    if any(a not in ("csv", "parquet", "all") for a in args):
+        await update.message.reply_text("⚠️ Usage: /export [csv|parquet] [all]\nWithout 'all' only orders since the last /export are included.")
+        return
+    fmt = "parquet" if "parquet" in args else "csv"
+    full = "all" in args
+
+    import order_export
+    path = os.path.join(tempfile.mkdtemp(), f"orders-{datetime.now():%Y%m%d-%H%M}.{fmt}")
+    await update.message.reply_text("⏳ Exporting orders…")
+    try:
+        # Streams the orders collection into the file on a writer thread
+        result = await writer.run(order_export.export_orders, writer.db, path, fmt, checkpoint="admin", full=full, commit=False)
+        if not result["orders"]:
+            await update.message.reply_text("📭 No new orders since the last export.")
+            return
+        size = os.path.getsize(path)
+        if size > MAX_UPLOAD_BYTES:
+            await update.message.reply_text(f"⚠️ The export is {size // (1024 * 1024)} MB, too large for Telegram. Use order_export.py instead.")
+            return
+        since = f" since {result['since']:%Y-%m-%d %H:%M}" if result["since"] else ""
+        with open(path, "rb") as f:
+            await update.message.reply_document(f, filename=os.path.basename(path), caption=f"📦 {result['orders']} orders{since}, {result['rows']} rows")
+        # Only move the checkpoint once the admin has the file
+        await writer.run(order_export.save_checkpoint, writer.db, "admin", result["checkpoint"], result["orders"])
+    except RuntimeError as e:
+        # e.g. Parquet without pyarrow installed
+        await update.message.reply_text(f"⚠️ Export failed: {e}")
+    except Exception as e:
+        logger.exception("Order export failed")
+        await update.message.reply_text(f"⚠️ Export failed: {e}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(os.path.dirname(path))
 
 # ------------------------ Application Setup ------------------------
 
-app = ApplicationBuilder().token("7557939515:AAE-ZoHEK1cQr6dvC2pRUYhaMQtIUkvEie4").build()
-
-conv_handler = ConversationHandler(
-    entry_points=[CommandHandler('start', start)],
-    states={
-        CHOOSING_ITEM: [CallbackQueryHandler(choose_item)],
-        ENTER_QUANTITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_quantity)],
-        ENTER_MOBILE: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_mobile)],
-        ENTER_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_address)],
-        ORDER_TYPE: [CallbackQueryHandler(order_type)],
-        # ENTER_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_time)],
-        ENTER_TIME: [CallbackQueryHandler(enter_time)],
-        ENTER_NOTE: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_note)],
-        CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm)],
-    },
-    fallbacks=[CommandHandler('cancel', cancel)]
-)
+async def warm_caches():
+    await media_cache.load_remote(*{config.menu_photo, MediaCache.pick_variant(config.menu_photo)})
+    await user_directory.warm(writer)
+    # Users loaded from Firestore don't need writing again until something changes
+    activity.seed((user_id, r["username"], r["last_message"]) for user_id, r in user_directory.items())
+
+async def on_startup(application):
+    # Application.initialize() (getMe and restoring persisted conversations) just finished
+    metrics.startup["initialize_ms"] = round((time.perf_counter() - built_at) * 1000, 1)
+    await writer.start()
+    await activity.start()
+    # Replays orders a previous run logged but could not write to Firestore
+    await order_log.start()
+    # Handlers read the menu from the first update on, so load it before the bot starts
+    await catalog.start()
+    await slot_capacity.load()
+    # post_init runs before the application starts, so schedule the warm-up on the loop directly
+    application.bot_data["warm_task"] = asyncio.create_task(warm_caches())
+    await admin_digest.start(application.bot)
+    await broadcaster.start(application.bot)
+    await sessions.start(application)
+    application.bot_data["lag_task"] = asyncio.create_task(metrics.monitor_loop_lag())
+    logger.info("Startup timings: %s", metrics.startup)
+
+async def on_stop(application):
+    # Runs while the bot can still send, so the last digest goes out
+    # and an unfinished broadcast is checkpointed for /broadcast resume
+    await sessions.stop()
+    await broadcaster.stop()
+    await admin_digest.stop()
+
+async def on_shutdown(application):
+    # Pending activity goes to the writer, which flushes it when it stops
+    await activity.stop()
+    await catalog.stop()
+    await order_log.stop()
+    await writer.stop()
+
+
+def build_conversation(persistent=False):
+    return ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            CHOOSING_ITEM: [CallbackQueryHandler(choose_item)],
+            ENTER_QUANTITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_quantity)],
+            ENTER_MOBILE: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_mobile)],
+            ENTER_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_address)],
+            ORDER_TYPE: [CallbackQueryHandler(order_type)],
+            # ENTER_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_time)],
+            ENTER_TIME: [CallbackQueryHandler(enter_time)],
+            ENTER_NOTE: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_note)],
+            CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="order_conversation",
+        persistent=persistent,
+    )
+
+
+def create_app(app_config=None, db=None, request=None):
+    """Build the Application and the components the handlers use.
+
+    Nothing touches the network here: Firestore connects on first use and the
+    Bot API is first called by `Application.initialize()`. `db` and `request`
+    replace the Firestore client and the Bot API transport (benchmarks, replays).
+    """
+    global config, built_at, ADMIN_ID, SUPPORT_ID, writer, media_cache, outbound, admin_digest, catalog, slot_capacity, order_log, reports, broadcaster, activity, sessions, user_directory, persistence, conv_handler
+    started = time.perf_counter()
+    config = app_config or Config.from_env()
+    ADMIN_ID = config.admin_id
+    SUPPORT_ID = config.support_id
+
+    # Background writer so Firestore round-trips never block the event loop
+    writer = FirestoreWriter(db if db is not None else LazyFirestore(config.firebase_json))
+
+    # Daily/per-slot totals for /stats and /kitchen, kept up to date by the order log
+    reports = OrderReports(writer=writer)
+
+    # Confirmed orders are acknowledged once they are in the local log
+    order_log = OrderLog(config.order_log_path, writer=writer, reports=reports)
+
+    # In-memory directory of known users for manual reply (bounded, indexed by username)
+    user_directory = UserDirectory()
+
+    # users/<id> writes, skipped when nothing changed and coalesced per user
+    from activity import ActivityTracker
+    activity = ActivityTracker(writer, interval=config.activity_interval)
+
+    # Upload menu.jpeg once and resend it by Telegram file_id afterwards
+    media_cache = MediaCache(writer=writer)
+
+    # Prices and sold-out flags, reloaded in the background when the source changes
+    from catalog import MenuCatalog
+    catalog = MenuCatalog(config.menu_source, writer=writer, poll_interval=config.menu_poll_interval)
+
+    # Orders per delivery slot; full slots are hidden from the time picker
+    from slot_capacity import SlotCapacity
+    slot_capacity = SlotCapacity(config.slot_capacity, hold_ttl=config.slot_hold_ttl, writer=writer, shard=config.shard)
+
+    # Every Bot API call goes through per-chat and global token buckets;
+    # customer replies are sent before admin copies
+    outbound = OutboundScheduler(
+        global_rate=config.send_rate_global,
+        chat_rate=config.send_rate_per_chat,
+        low_priority_chats={ADMIN_ID},
+    )
+
+    # Admin notifications are batched into one digest per window (ADMIN_DIGEST_WINDOW=0 disables)
+    from admin_digest import AdminDigest
+    admin_digest = AdminDigest(ADMIN_ID, window=config.admin_digest_window, max_events=config.admin_digest_max_events)
+
+    # /broadcast streams the users collection and sends at the lowest priority
+    from broadcast import Broadcaster
+    broadcaster = Broadcaster(writer, ADMIN_ID, concurrency=config.broadcast_concurrency)
+
+    # Keeps carts and conversation states across restarts ("sqlite", "firestore" or "none")
+    from conversation_store import build_persistence
+    persistence = build_persistence(
+        config.persistence, db=writer.db,
+        path=config.persistence_path,
+        update_interval=config.persistence_interval,
+    )
+
+    builder = (
+        ApplicationBuilder()
+        .token(config.token)
+        .rate_limiter(outbound)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    if persistence:
+        builder = builder.persistence(persistence)
+    # Webhook mode serves Telegram and the health checks from one aiohttp server;
+    # without a webhook URL the bot polls and keeps the old keep-alive thread.
+    if config.webhook_url:
+        builder = builder.updater(None)
+    app = builder.build()
+    # The sharded ingress asks each worker for these on /stats
+    app.bot_data["stats"] = bot_stats
+
+    conv_handler = build_conversation(persistent=persistence is not None)
+
+    # Idle order conversations end after their state's timeout; idle user_data is dropped
+    from sessions import SessionReaper, parse_timeouts
+    states = {
+        "CHOOSING_ITEM": CHOOSING_ITEM, "ENTER_QUANTITY": ENTER_QUANTITY, "ENTER_MOBILE": ENTER_MOBILE,
+        "ENTER_ADDRESS": ENTER_ADDRESS, "ORDER_TYPE": ORDER_TYPE, "ENTER_TIME": ENTER_TIME,
+        "ENTER_NOTE": ENTER_NOTE, "CONFIRM": CONFIRM,
+    }
+    sessions = SessionReaper(
+        conv_handler,
+        timeouts=parse_timeouts(config.conversation_timeouts, states),
+        default_timeout=config.conversation_timeout,
+        idle_ttl=config.session_idle_ttl,
+        interval=config.session_sweep_interval,
+        on_expire=expire_session,
+        sweepers=[user_directory.sweep],
+    )
+
+    app.add_handler(TypeHandler(Update, touch_session), group=-2)
+    app.add_handler(TypeHandler(Update, metrics.stamp_update), group=-1)
+    app.add_handler(conv_handler)
+    app.add_handler(CommandHandler('support', support))
+    app.add_handler(CommandHandler('reply', manual_reply))
+    # app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, auto_reply))
+    app.add_handler(CommandHandler('profile', profile))
+    app.add_handler(CommandHandler(['soldout', 'restock'], sold_out))
+    app.add_handler(CommandHandler('stats', stats))
+    app.add_handler(CommandHandler('kitchen', kitchen))
+    app.add_handler(CommandHandler('broadcast', broadcast))
+    app.add_handler(CommandHandler('export', export))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, forward_all_messages))
+    # Its own group so it sees every update, after the handler above replied
+    app.add_handler(TypeHandler(Update, track_user), group=1)
+
+    # Time every handler registered above, including the conversation states
+    metrics.instrument_application(app)
+    metrics.gauges.update({
+        "bot_firestore_queue_depth": lambda: writer.queue_depth,
+        "bot_order_log_pending": lambda: order_log.pending,
+        "bot_outbound_queue_depth": lambda: outbound.stats()["queue_depth"],
+        "bot_outbound_drops": lambda: outbound.drops,
+        "bot_admin_digest_pending": lambda: admin_digest.pending,
+        "bot_broadcast_sent": lambda: broadcaster.stats()["sent"],
+        "bot_user_directory_entries": lambda: len(user_directory),
+        "bot_activity_write_reduction": lambda: activity.write_reduction,
+        "bot_sessions_live": lambda: sessions.stats()["sessions"],
+        "bot_session_bytes": lambda: sessions.stats()["session_bytes"],
+        "bot_sessions_expired": lambda: sessions.expired,
+        "bot_slot_rejections": lambda: slot_capacity.rejected,
+        "bot_menu_version": lambda: catalog.current.version if catalog.current else 0,
+    })
+
+    metrics.startup["create_app_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    built_at = time.perf_counter()
+    return app
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO)
+    app_config = Config.from_env()
+    if app_config.workers > 1:
+        from sharding import run_sharded
+        run_sharded(app_config, app_config.workers)
+        return
+    app = create_app(app_config)
+    if config.webhook_url:
+        from webhook import serve_webhook
+        asyncio.run(serve_webhook(app, config.webhook_url, config.port, secret_token=config.webhook_secret, stats=bot_stats))
+    else:
+        threading.Thread(target=run_keepalive, args=(config.port,), daemon=True).start()
+        app.run_polling()
+
 
-app.add_handler(conv_handler)
-app.add_handler(CommandHandler('support', support))
-app.add_handler(CommandHandler('reply', manual_reply))
-# app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, auto_reply))
-app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, forward_all_messages))
+metrics.startup_began = IMPORT_STARTED
+metrics.startup["imports_ms"] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
 
-app.run_polling()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+
+from telegram.error import BadRequest
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """Remembers Telegram file_ids so static photos are uploaded only once.
+
+    Entries are keyed by file path and validated against the file's SHA-256, so
+    replacing the image on disk triggers a fresh upload. The id map is saved to a
+    local JSON file and, when a FirestoreWriter is given, to the `media_cache`
+    collection so restarts on an empty disk can reuse it too. Sharded workers
+    share the local file: each writes through its own temporary file and merges
+    what the others saved before replacing it.
+    """
+
+    def __init__(self, store_path=".media_cache.json", writer=None):
+        self.store_path = store_path
+        self.writer = writer
+        self._entries = {}  # path -> {"sha256", "file_id", "size"}
+        self._hashes = {}  # path -> (mtime, size, sha256)
+
+        self.uploads = 0
+        self.hits = 0
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+
+        self._load_local()
+
+    # ------------------------ Persistence ------------------------
+
+    def _read_local(self):
+        try:
+            with open(self.store_path) as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _load_local(self):
+        self._entries = self._read_local()
+
+    def _save_local(self):
+        tmp = f"{self.store_path}.{os.getpid()}.tmp"
+        try:
+            # Keep entries other processes saved meanwhile; ours are at least as new
+            self._entries = {**self._read_local(), **self._entries}
+            with open(tmp, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self.store_path)
+        except OSError:
+            logger.warning("Could not write media cache to %s", self.store_path)
+
+    @staticmethod
+    def _doc_id(path):
+        return hashlib.sha1(path.encode()).hexdigest()
+
+    async def load_remote(self, *paths):
+        """Fill in entries missing locally from Firestore (called once at startup)."""
+        if not self.writer:
+            return
+        for path in paths:
+            if path in self._entries:
+                continue
+            ref = self.writer.db.collection("media_cache").document(self._doc_id(path))
+            try:
+                snapshot = await self.writer.run(ref.get)
+                metrics.count_firestore("read", "media_cache")
+            except Exception:
+                logger.exception("Could not load media cache entry for %s", path)
+                continue
+            if snapshot.exists:
+                self._entries[path] = snapshot.to_dict()
+
+    def _store(self, path, entry):
+        self._entries[path] = entry
+        self._save_local()
+        if self.writer:
+            self.writer.upsert("media_cache", self._doc_id(path), {"path": path, **entry})
+
+    # ------------------------ Lookup ------------------------
+
+    def file_hash(self, path):
+        """SHA-256 of the file, recomputed only when its mtime or size changes."""
+        st = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2], st.st_size
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._hashes[path] = (st.st_mtime, st.st_size, digest)
+        return digest, st.st_size
+
+    @staticmethod
+    def pick_variant(path, variant=None):
+        """Prefer a pre-generated compressed/thumbnail variant when one exists on disk."""
+        if variant is None:
+            stem, ext = os.path.splitext(path)
+            variant = f"{stem}.min{ext}"
+        return variant if os.path.exists(variant) else path
+
+    async def send_photo(self, message, path, caption=None, variant=None):
+        """Reply to `message` with the photo at `path`, reusing a cached file_id when valid."""
+        path = self.pick_variant(path, variant)
+        digest, size = self.file_hash(path)
+
+        entry = self._entries.get(path)
+        if entry and entry.get("sha256") == digest:
+            try:
+                sent = await message.reply_photo(entry["file_id"], caption=caption)
+                self.hits += 1
+                self.bytes_saved += size
+                return sent
+            except BadRequest:
+                logger.warning("Cached file_id for %s was rejected, re-uploading", path)
+                self._entries.pop(path, None)
+
+        with open(path, "rb") as f:
+            sent = await message.reply_photo(f, caption=caption)
+        self.uploads += 1
+        self.bytes_uploaded += size
+        # The largest PhotoSize is the original resolution
+        self._store(path, {"sha256": digest, "file_id": sent.photo[-1].file_id, "size": size})
+        return sent
+
+    def stats(self):
+        return {
+            "uploads": self.uploads,
+            "hits": self.hits,
+            "bytes_uploaded": self.bytes_uploaded,
+            "bytes_saved": self.bytes_saved,
+        }
@@ -0,0 +1,297 @@
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+from collections import deque
+
+# Bot API methods that put something in front of the customer
+REPLY_ENDPOINTS = {"sendMessage", "editMessageText", "sendPhoto"}
+
+# (update_id, start time) for the update being handled in the current task
+_current_update = contextvars.ContextVar("current_update", default=None)
+
+
+class LatencyRecorder:
+    """Keeps the most recent samples and answers percentile queries over them."""
+
+    def __init__(self, max_samples=10000):
+        self._samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, p):
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+        }
+
+
+# Cold-start phases in milliseconds (imports, create_app, initialize, firebase_init, first_update)
+startup = {}
+startup_began = time.perf_counter()
+
+# Time from an update reaching the bot to the first message sent back for it
+reply_latency = LatencyRecorder()
+
+# Arrival times stamped by the webhook server before the update is queued
+_received_at = {}
+
+
+def mark_received(update_id):
+    _received_at[update_id] = time.perf_counter()
+
+
+async def stamp_update(update, context):
+    """Group -1 handler: remember when this update started so the first reply can be timed.
+
+    In webhook mode the clock starts when the HTTP request arrived; in polling mode
+    it starts when the update is taken off the queue.
+    """
+    started = _received_at.pop(update.update_id, None) or time.perf_counter()
+    if "first_update_ms" not in startup:
+        startup["first_update_ms"] = round((started - startup_began) * 1000, 1)
+    _current_update.set((update.update_id, started))
+
+
+def mark_reply():
+    current = _current_update.get()
+    if current is None:
+        return
+    reply_latency.record(time.perf_counter() - current[1])
+    _current_update.set(None)
+
+
+
+# ------------------------ Prometheus-style metrics ------------------------
+
+# Upper bounds in seconds, from a fast in-memory handler to a slow Firestore round-trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value."""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, label_value, seconds):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += seconds
+
+    def totals(self):
+        """{label value: (observations, total seconds)} so far."""
+        return {value: (sum(series[:-1]), series[-1]) for value, series in self._series.items()}
+
+    def quantile(self, label_value, q):
+        """Estimate of the `q` quantile (0-1) in seconds, interpolated within its bucket like PromQL's histogram_quantile."""
+        series = self._series.get(label_value)
+        if not series:
+            return 0.0
+        rank = q * sum(series[:-1])
+        cumulative, lower = 0, 0.0
+        for bound, count in zip(self.buckets, series):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]
+
+    def reset(self):
+        self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for value, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, values))
+            lines.append(f"{self.name}{{{labels}}} {total}")
+        return lines
+
+
+handler_seconds = Histogram("bot_handler_seconds", "Time spent in each update handler.", "handler")
+api_call_seconds = Histogram("bot_api_call_seconds", "Bot API call duration by method.", "method")
+loop_lag_seconds = Histogram("bot_event_loop_lag_seconds", "Event loop scheduling delay.", "loop")
+firestore_ops = Counter("bot_firestore_operations_total", "Firestore documents read or written.", ("op", "collection"))
+handler_errors = Counter("bot_handler_errors_total", "Exceptions raised by handlers.", ("handler",))
+
+# name -> zero-argument callable returning the current value
+gauges = {}
+
+
+def count_firestore(op, collection, amount=1):
+    firestore_ops.inc((op, collection), amount)
+
+
+def render_prometheus():
+    lines = []
+    for metric in (handler_seconds, api_call_seconds, loop_lag_seconds, firestore_ops, handler_errors):
+        lines.extend(metric.render())
+    lines.append("# TYPE bot_reply_latency_seconds summary")
+    for q in (50, 99):
+        lines.append(f'bot_reply_latency_seconds{{quantile="{q / 100}"}} {reply_latency.percentile(q):.6f}')
+    lines.append(f"bot_reply_latency_seconds_count {reply_latency.count}")
+    for name, value in sorted(startup.items()):
+        lines.append(f'bot_startup_milliseconds{{phase="{name[:-3] if name.endswith("_ms") else name}"}} {value}')
+    for name, read in sorted(gauges.items()):
+        try:
+            value = read()
+        except Exception:
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------ Handler instrumentation ------------------------
+
+def _wrap_callback(handler, name):
+    callback = handler.callback
+    if getattr(callback, "__instrumented__", False):
+        return
+
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc((name,))
+            raise
+        finally:
+            handler_seconds.observe(name, time.perf_counter() - started)
+
+    timed.__instrumented__ = True
+    timed.__wrapped__ = callback
+    timed.__name__ = callback.__name__
+    handler.callback = timed
+
+
+def instrument_handlers(handlers):
+    """Wrap the callbacks of `handlers` (recursing into ConversationHandlers) with timers."""
+    for handler in handlers:
+        nested = getattr(handler, "states", None)
+        if nested is not None:
+            inner = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in nested.values():
+                inner.extend(state_handlers)
+            instrument_handlers(inner)
+        elif getattr(handler, "callback", None) is not None:
+            _wrap_callback(handler, handler.callback.__name__)
+
+
+def instrument_application(app):
+    for group in app.handlers.values():
+        instrument_handlers(group)
+
+
+async def monitor_loop_lag(interval=0.5):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe("main", max(0.0, time.perf_counter() - started - interval))
+
+
+# ------------------------ Sampling profiler ------------------------
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack from a helper thread while enabled.
+
+    Output is in collapsed-stack format ("a;b;c count"), ready for flamegraph tools.
+    """
+
+    def __init__(self, interval=0.005, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id=None):
+        if self.running:
+            return
+        self._target = thread_id or threading.get_ident()
+        self.samples = {}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.samples.items(), key=lambda kv: -kv[1])) + "\n"
+
+    def top(self, n=10):
+        """Most frequently sampled innermost frames."""
+        leaves = {}
+        for stack, count in self.samples.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        return sorted(leaves.items(), key=lambda kv: -kv[1])[:n]
+
+
+profiler = SamplingProfiler()
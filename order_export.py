@@ -0,0 +1,207 @@
+"""Export orders to CSV or Parquet, one row per line item.
+
+    FIREBASE_JSON=... python order_export.py orders.csv
+    FIREBASE_JSON=... python order_export.py nightly.parquet --format parquet --checkpoint nightly
+
+Orders are read in pages and flow through generators into the output file,
+so memory use does not depend on how many orders there are. With
+--checkpoint NAME only orders saved since the last successful export under
+that name are read; the checkpoint (`export_checkpoints/<name>`) moves
+forward once the file is complete. Parquet needs pyarrow installed.
+"""
+import argparse
+import csv
+import logging
+import os
+from datetime import datetime, timezone
+
+import metrics
+
+ORDERS = "orders"
+CHECKPOINTS = "export_checkpoints"
+PAGE_SIZE = 500
+ROW_GROUP_SIZE = 10000
+
+COLUMNS = [
+    "order_id", "timestamp", "telegram_user_id", "username", "mobile", "address",
+    "delivery_time", "delivery_time_display", "note", "menu_version", "order_total",
+    "line", "item_name", "quantity", "price", "line_total",
+]
+
+
+# ------------------------ Reading ------------------------
+
+def stream_orders(db, field="timestamp", after=None, page_size=PAGE_SIZE):
+    """Yield (doc_id, order) for every order, ordered by `field`, optionally only those after `after`."""
+    query = db.collection(ORDERS)
+    if after is not None:
+        query = query.where(field, ">", after)
+    query = query.order_by(field).limit(page_size)
+    last = None
+    while True:
+        page = list((query.start_after(last) if last else query).stream())
+        metrics.count_firestore("read", ORDERS, len(page))
+        for snapshot in page:
+            yield snapshot.id, snapshot.to_dict()
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def order_rows(orders):
+    """Flatten (doc_id, order) pairs into one dict per line item (one empty line for item-less orders)."""
+    for doc_id, order in orders:
+        base = {
+            "order_id": order.get("order_id") or doc_id,
+            "timestamp": order.get("timestamp"),
+            "telegram_user_id": order.get("telegram_user_id"),
+            "username": order.get("username"),
+            "mobile": order.get("mobile"),
+            "address": order.get("address"),
+            "delivery_time": order.get("delivery_time"),
+            "delivery_time_display": order.get("delivery_time_display"),
+            "note": order.get("note"),
+            "menu_version": order.get("menu_version"),
+            "order_total": order.get("total_price"),
+        }
+        items = order.get("items") or [{}]
+        for n, item in enumerate(items, 1):
+            quantity, price = item.get("quantity"), item.get("price")
+            yield {
+                **base,
+                "line": n,
+                "item_name": item.get("item_name"),
+                "quantity": quantity,
+                "price": price,
+                "line_total": quantity * price if quantity is not None and price is not None else None,
+            }
+
+
+# ------------------------ Writing ------------------------
+
+def write_csv(rows, path):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        out = csv.DictWriter(f, fieldnames=COLUMNS)
+        out.writeheader()
+        for row in rows:
+            if isinstance(row["timestamp"], datetime):
+                row["timestamp"] = row["timestamp"].isoformat()
+            out.writerow(row)
+            count += 1
+    return count
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("order_id", pa.string()), ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("telegram_user_id", pa.string()), ("username", pa.string()), ("mobile", pa.string()),
+        ("address", pa.string()), ("delivery_time", pa.string()), ("delivery_time_display", pa.string()),
+        ("note", pa.string()), ("menu_version", pa.int64()), ("order_total", pa.float64()),
+        ("line", pa.int64()), ("item_name", pa.string()), ("quantity", pa.int64()),
+        ("price", pa.float64()), ("line_total", pa.float64()),
+    ])
+
+
+def write_parquet(rows, path, row_group_size=ROW_GROUP_SIZE):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+    schema = parquet_schema()
+    count, buffer = 0, []
+
+    def flush(out):
+        columns = {name: [row[name] for row in buffer] for name in COLUMNS}
+        out.write_table(pa.Table.from_pydict(columns, schema=schema))
+        buffer.clear()
+
+    # One row group per `row_group_size` rows keeps memory flat
+    with pq.ParquetWriter(path, schema) as out:
+        for row in rows:
+            buffer.append(row)
+            count += 1
+            if len(buffer) >= row_group_size:
+                flush(out)
+        if buffer or not count:
+            flush(out)
+    return count
+
+
+FORMATS = {"csv": write_csv, "parquet": write_parquet}
+
+
+# ------------------------ Checkpoints ------------------------
+
+def load_checkpoint(db, name):
+    snapshot = db.collection(CHECKPOINTS).document(name).get()
+    metrics.count_firestore("read", CHECKPOINTS)
+    return (snapshot.to_dict() or {}).get("saved_at") if snapshot.exists else None
+
+
+def save_checkpoint(db, name, saved_at, orders):
+    db.collection(CHECKPOINTS).document(name).set({
+        "saved_at": saved_at,
+        "orders": orders,
+        "exported_at": datetime.now(timezone.utc),
+    })
+    metrics.count_firestore("write", CHECKPOINTS)
+
+
+def export_orders(db, path, fmt="csv", checkpoint=None, full=False, page_size=PAGE_SIZE, commit=True):
+    """Write orders to `path`. Blocking; run it on a worker thread from the bot.
+
+    With `checkpoint`, only orders whose `saved_at` is after the stored one
+    are exported (all orders on the first run or with `full`), and the
+    checkpoint is advanced afterwards unless `commit` is False (the caller
+    then saves `result["checkpoint"]` once the file is delivered).
+    `saved_at` is when the order reached Firestore, not when it was placed,
+    so orders the order log replays late are still picked up by the next
+    run. Returns a summary dict.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    started = datetime.now(timezone.utc)
+    after = None if full or not checkpoint else load_checkpoint(db, checkpoint)
+    # Orders written before `saved_at` existed only have `timestamp`; a full export reads them all
+    field = "saved_at" if after is not None else "timestamp"
+
+    seen = {"orders": 0, "saved_at": after}
+
+    def tracked(orders):
+        for doc_id, order in orders:
+            seen["orders"] += 1
+            saved_at = order.get("saved_at")
+            if saved_at is not None and (seen["saved_at"] is None or saved_at > seen["saved_at"]):
+                seen["saved_at"] = saved_at
+            yield doc_id, order
+
+    rows = FORMATS[fmt](order_rows(tracked(stream_orders(db, field, after, page_size))), path)
+    result = {"path": path, "format": fmt, "orders": seen["orders"], "rows": rows, "since": after, "checkpoint": seen["saved_at"] or started}
+    if checkpoint and commit:
+        save_checkpoint(db, checkpoint, result["checkpoint"], seen["orders"])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export orders to CSV or Parquet, one row per line item.")
+    parser.add_argument("output")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="default: from the output file extension")
+    parser.add_argument("--checkpoint", help="only export orders saved since the last export under this name")
+    parser.add_argument("--full", action="store_true", help="export everything and reset the checkpoint")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO)
+
+    from firestore_queue import LazyFirestore
+    fmt = args.format or ("parquet" if args.output.endswith(".parquet") else "csv")
+    db = LazyFirestore(os.getenv("FIREBASE_JSON"))
+    result = export_orders(db, args.output, fmt, checkpoint=args.checkpoint, full=args.full, page_size=args.page_size)
+    since = f" saved after {result['since'].isoformat()}" if result["since"] else ""
+    print(f"Wrote {result['rows']} rows from {result['orders']} orders{since} to {result['path']}")
+
+
+if __name__ == "__main__":
+    main()
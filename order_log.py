@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import metrics
+from firestore_queue import SERVER_TIMESTAMP, _prepare
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "orders"
+BATCH_SIZE = 400
+
+
+def order_id(user_id, conversation_id):
+    """Document id for the order placed in one /start conversation of one user."""
+    return f"{user_id}-{conversation_id}"
+
+
+class OrderLog:
+    """Local write-ahead log in front of the Firestore `orders` collection.
+
+    `submit()` appends the order to an append-only file and returns once it is
+    fsynced; orders that arrive while a sync is running go out together in the
+    next one. A background task copies logged orders into Firestore with
+    `set()` on their deterministic ids, so replaying an order twice (after a
+    crash, or when Telegram redelivers the confirming message) writes the same
+    document. Failed replays are retried with backoff, and orders still in the
+    log at startup are replayed first. Once everything is in Firestore the file
+    is truncated. With `reports` set, the same batch adds the orders to the
+    daily `order_stats` totals; the orders then go in with `create()`, so a
+    batch replayed after it already committed (a crash before its ack) fails
+    as a whole instead of counting its orders twice, and only the orders that
+    aren't in Firestore yet are counted on the retry.
+    """
+
+    def __init__(self, path="orders.wal", writer=None, reports=None, replay_interval=1.0, max_backoff=60, compact_bytes=1024 * 1024, remember=10000):
+        self.path = path
+        self.writer = writer
+        self.reports = reports
+        self.replay_interval = replay_interval
+        self.max_backoff = max_backoff
+        self.compact_bytes = compact_bytes
+        self.remember = remember
+
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="order-log")
+        self._file = None
+        self._size = 0
+        self._buffer = []  # (order_id, record, line, future) waiting for the next fsync
+        self._in_flight = 0
+        self._pending = OrderedDict()  # order_id -> record, durable but not yet in Firestore
+        self._seen = OrderedDict()  # recently logged ids, for deduplication
+        self._has_data = None
+        self._replay_now = None
+        self._replay_lock = None
+        self._sync_task = None
+        self._replay_task = None
+        self._stopping = False
+
+        self.logged = 0
+        self.duplicates = 0
+        self.syncs = 0
+        self.replayed = 0
+        self.failures = 0
+
+    @property
+    def pending(self):
+        return len(self._pending) + len(self._buffer)
+
+    # ------------------------ File ------------------------
+
+    def _recover(self):
+        records, acked = OrderedDict(), set()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write; its order was never acknowledged
+                        logger.warning("Skipping unreadable line in %s", self.path)
+                        continue
+                    if entry.get("op") == "order":
+                        records[entry["id"]] = entry
+                    elif entry.get("op") == "ack":
+                        acked.add(entry["id"])
+        except FileNotFoundError:
+            pass
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        return records, acked
+
+    def _append(self, lines, sync):
+        data = "".join(lines)
+        self._file.write(data)
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+        self._size += len(data.encode())
+
+    def _truncate(self):
+        self._file.close()
+        self._file = open(self.path, "w", encoding="utf-8")
+        os.fsync(self._file.fileno())
+        self._size = 0
+
+    async def _io_call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    # ------------------------ Lifecycle ------------------------
+
+    async def start(self):
+        records, acked = await self._io_call(self._recover)
+        for oid, record in records.items():
+            self._remember(oid)
+            if oid not in acked:
+                self._pending[oid] = record
+        if self._pending:
+            logger.info("Replaying %d orders left in %s", len(self._pending), self.path)
+        self._has_data = asyncio.Event()
+        self._replay_now = asyncio.Event()
+        self._replay_lock = asyncio.Lock()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+        self._replay_task = asyncio.create_task(self._replay_loop())
+        if self._pending:
+            self._replay_now.set()
+
+    async def stop(self, timeout=10):
+        """Sync what is buffered, try one last replay, then close the file."""
+        if self._sync_task is None:
+            return
+        self._stopping = True
+        self._has_data.set()
+        self._replay_now.set()
+        await self._sync_task
+        await self._replay_task
+        self._sync_task = self._replay_task = None
+        if self._pending:
+            try:
+                await asyncio.wait_for(self.drain(), timeout)
+            except Exception:
+                logger.exception("Could not replay orders before shutdown")
+        if self._pending:
+            logger.warning("%d orders stay in %s until the next start", len(self._pending), self.path)
+        await self._io_call(self._file.close)
+        self._io.shutdown(wait=True)
+
+    # ------------------------ Submitting ------------------------
+
+    def _remember(self, oid):
+        self._seen[oid] = None
+        while len(self._seen) > self.remember:
+            self._seen.popitem(last=False)
+
+    async def submit(self, oid, order):
+        """Log `order` durably under `oid`. Returns False if that id was already logged."""
+        if oid in self._seen:
+            self.duplicates += 1
+            return False
+        record = {"op": "order", "id": oid, "placed_at": datetime.now(timezone.utc).isoformat(), "order": order}
+        line = json.dumps(record) + "\n"
+        self._remember(oid)
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((oid, record, line, future))
+        self._has_data.set()
+        try:
+            await future
+        except Exception:
+            self._seen.pop(oid, None)
+            raise
+        return True
+
+    async def _sync_loop(self):
+        while True:
+            await self._has_data.wait()
+            self._has_data.clear()
+            batch, self._buffer = self._buffer, []
+            if batch:
+                self._in_flight = len(batch)
+                try:
+                    await self._io_call(self._append, [line for _, _, line, _ in batch], True)
+                except Exception as exc:
+                    logger.exception("Writing %d orders to %s failed", len(batch), self.path)
+                    for _, _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(exc)
+                else:
+                    self.syncs += 1
+                    self.logged += len(batch)
+                    for oid, record, _, future in batch:
+                        self._pending[oid] = record
+                        if not future.done():
+                            future.set_result(None)
+                    self._replay_now.set()
+                finally:
+                    self._in_flight = 0
+            if self._stopping and not self._buffer:
+                return
+
+    # ------------------------ Replay ------------------------
+
+    def _write_batch(self, records):
+        if not self.reports:
+            self._commit_orders(records, new=())
+            return None
+        from google.api_core.exceptions import AlreadyExists
+        try:
+            return self._commit_orders(records, new=records)
+        except AlreadyExists:
+            pass
+        # Some of these were saved and counted by a commit whose ack never made it to the log
+        db = self.writer.db
+        saved = {snapshot.id for snapshot in db.get_all([db.collection(COLLECTION).document(r["id"]) for r in records]) if snapshot.exists}
+        metrics.count_firestore("read", COLLECTION, len(records))
+        logger.info("%d of %d replayed orders were already saved, not counting them again", len(saved), len(records))
+        return self._commit_orders(records, new=[r for r in records if r["id"] not in saved])
+
+    def _commit_orders(self, records, new):
+        """Write `records` in one batch, creating and counting the ones in `new`."""
+        db = self.writer.db
+        batch = db.batch()
+        new_ids = {record["id"] for record in new}
+        for record in records:
+            order = dict(record["order"])
+            order["timestamp"] = datetime.fromisoformat(record["placed_at"])
+            # When it reached Firestore; incremental exports read by this, as replays can be late
+            order["saved_at"] = SERVER_TIMESTAMP
+            ref = db.collection(COLLECTION).document(record["id"])
+            if record["id"] in new_ids:
+                batch.create(ref, _prepare(order))  # fails the batch if it was saved, and counted, before
+            else:
+                batch.set(ref, _prepare(order))
+        # Counted in the same commit, so the totals never include an order that isn't saved
+        totals = self.reports.add_to_batch(db, batch, new) if new else None
+        batch.commit()
+        return totals
+
+    async def replay(self):
+        """Copy one batch of logged orders to Firestore. Returns False if Firestore failed."""
+        # One replay at a time: a batch replayed twice would be counted twice in the stats
+        async with self._replay_lock:
+            return await self._replay()
+
+    async def _replay(self):
+        if not self._pending:
+            if self._size > self.compact_bytes and not self._buffer and not self._in_flight:
+                await self._io_call(self._truncate)
+            return True
+        records = list(self._pending.values())[:BATCH_SIZE]
+        token = self.reports.begin_commit() if self.reports else None
+        try:
+            totals = await self.writer.run(self._write_batch, records)
+        except Exception:
+            self.failures += 1
+            logger.warning("Replaying %d orders to Firestore failed, keeping them in %s", len(records), self.path, exc_info=True)
+            return False
+        for record in records:
+            self._pending.pop(record["id"], None)
+        self.replayed += len(records)
+        metrics.count_firestore("write", COLLECTION, len(records))
+        if totals:
+            self.reports.applied(totals, token)
+        # Acks only save work on the next start; losing one means the order is written again
+        # but, being in Firestore already, not counted again
+        await self._io_call(self._append, [json.dumps({"op": "ack", "id": r["id"]}) + "\n" for r in records], False)
+        return True
+
+    async def drain(self):
+        """Replay until nothing is pending (benchmarks, shutdown)."""
+        while self._pending:
+            if not await self.replay():
+                raise RuntimeError(f"{len(self._pending)} orders could not be written to Firestore")
+
+    async def _replay_loop(self):
+        delay = self.replay_interval
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._replay_now.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._replay_now.clear()
+            if self._stopping:
+                return
+            if await self.replay():
+                delay = self.replay_interval
+                if self._pending:
+                    self._replay_now.set()
+            else:
+                delay = min(delay * 2, self.max_backoff)
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "logged": self.logged,
+            "duplicates": self.duplicates,
+            "syncs": self.syncs,
+            "replayed": self.replayed,
+            "failures": self.failures,
+            "file_bytes": self._size,
+        }
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from bisect import insort
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lower number goes first
+PRIORITY_CUSTOMER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BROADCAST = 2
+
+
+class OutboundDropped(TelegramError):
+    """Raised to the caller when a send was dropped instead of being delivered."""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        """Seconds until one token is available (0 if one is available now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Rate limiter for every Bot API call, with token buckets per chat and globally.
+
+    Calls wait in a priority queue: customer-facing sends go before anything
+    addressed to `low_priority_chats` (the admin copies). A RetryAfter from
+    Telegram pauses the affected bucket and the call is retried with backoff.
+    Low-priority calls that waited longer than `max_wait` are dropped.
+
+    Because PTB hands every request to `process_request` as a coroutine
+    function, the scheduler can be driven directly with a fake callback in tests;
+    benchmarks/outbound_check.py drives it through a Bot with the fake transport.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, low_priority_chats=(), max_queue=2000, max_wait=60, max_retries=3, clock=time.monotonic):
+        if global_rate <= 0 or chat_rate <= 0:
+            raise ValueError(f"Send rates must be positive (SEND_RATE_GLOBAL={global_rate}, SEND_RATE_PER_CHAT={chat_rate})")
+        if chat_burst < 1:
+            raise ValueError(f"chat_burst must be at least 1, got {chat_burst}")
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.low_priority_chats = set(low_priority_chats)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.clock = clock
+
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._chats = {}
+        self._waiting = []  # sorted (priority, seq, chat_id, enqueued_at, future)
+        self._seq = 0
+        self._wake = None
+        self._dispatcher = None
+
+        self.sent = 0
+        self.retries = 0
+        self.drops = 0
+        self.wait_time = metrics.LatencyRecorder()
+
+    async def initialize(self):
+        self._wake = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for entry in self._waiting:
+            if not entry[-1].done():
+                entry[-1].set_exception(OutboundDropped("Scheduler shut down"))
+        self._waiting.clear()
+
+    # ------------------------ Buckets ------------------------
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _ready_in(self, chat_id, now):
+        wait = self._global.wait_time(now)
+        if chat_id is not None:
+            wait = max(wait, self._chat_bucket(chat_id, now).wait_time(now))
+        return wait
+
+    def _take(self, chat_id, now):
+        self._global.take()
+        if chat_id is not None:
+            self._chat_bucket(chat_id, now).take()
+        # Full buckets of idle chats carry no state worth keeping
+        if len(self._chats) > 10000:
+            self._chats = {k: b for k, b in self._chats.items() if b.tokens < b.capacity or b.blocked_until > now}
+
+    # ------------------------ Queue ------------------------
+
+    async def _acquire(self, chat_id, priority):
+        now = self.clock()
+        if not self._waiting and self._ready_in(chat_id, now) == 0:
+            self._take(chat_id, now)
+            self.wait_time.record(0.0)
+            return
+        if len(self._waiting) >= self.max_queue:
+            self.drops += 1
+            raise OutboundDropped("Outbound queue is full")
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        insort(self._waiting, (priority, self._seq, chat_id, now, future))
+        if self._wake:
+            self._wake.set()
+        await future
+        self.wait_time.record(self.clock() - now)
+
+    async def _dispatch(self):
+        while True:
+            now = self.clock()
+            next_wake = None
+            remaining = []
+            for entry in self._waiting:
+                priority, _, chat_id, enqueued_at, future = entry
+                if future.done():
+                    continue
+                if priority > PRIORITY_CUSTOMER and now - enqueued_at > self.max_wait:
+                    self.drops += 1
+                    future.set_exception(OutboundDropped(f"Dropped after waiting {now - enqueued_at:.0f}s"))
+                    continue
+                wait = self._ready_in(chat_id, now)
+                if wait == 0:
+                    self._take(chat_id, now)
+                    future.set_result(None)
+                    continue
+                remaining.append(entry)
+                next_wake = wait if next_wake is None else min(next_wake, wait)
+            self._waiting = remaining
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=next_wake)
+            except asyncio.TimeoutError:
+                pass
+
+    # ------------------------ Requests ------------------------
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if isinstance(rate_limit_args, int):
+            priority = rate_limit_args
+        elif chat_id in self.low_priority_chats:
+            priority = PRIORITY_ADMIN
+        else:
+            priority = PRIORITY_CUSTOMER
+
+        # Answering a button press is not flood-limited and the spinner should stop at once
+        limited = endpoint != "answerCallbackQuery"
+        for attempt in range(self.max_retries + 1):
+            if limited:
+                await self._acquire(chat_id, priority)
+            started = time.perf_counter()
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt >= self.max_retries:
+                    self.drops += 1
+                    logger.warning("Giving up on %s to %s after %d RetryAfter", endpoint, chat_id, attempt + 1)
+                    raise
+                self.retries += 1
+                delay = exc.retry_after + 0.5 * 2 ** attempt
+                bucket = self._chat_bucket(chat_id, self.clock()) if chat_id is not None else self._global
+                bucket.blocked_until = self.clock() + delay
+                logger.info("RetryAfter on %s to %s, retrying in %.1fs", endpoint, chat_id, delay)
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                metrics.api_call_seconds.observe(endpoint, time.perf_counter() - started)
+            self.sent += 1
+            if endpoint in metrics.REPLY_ENDPOINTS:
+                metrics.mark_reply()
+            return result
+
+    def stats(self):
+        wait = self.wait_time.snapshot()
+        return {
+            "queue_depth": len(self._waiting),
+            "sent": self.sent,
+            "retries": self.retries,
+            "drops": self.drops,
+            "wait_p50_ms": wait["p50_ms"],
+            "wait_p99_ms": wait["p99_ms"],
+        }
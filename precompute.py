@@ -0,0 +1,106 @@
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+SLOT_MINUTES = 15
+WEEKDAY_OPEN_HOUR = 19
+WEEKEND_OPEN_HOUR = 16
+CLOSE_HOUR = 23  # last slot is 11:00 PM
+SLOTS_PER_ROW = 3
+
+
+# ------------------------ Menu keyboards ------------------------
+
+@lru_cache(maxsize=8)
+def menu_keyboards(item_names):
+    """Build the item picker once per menu version: (without Done, with Done)."""
+    rows = [[InlineKeyboardButton(item, callback_data=item)] for item in item_names]
+    with_done = rows + [[InlineKeyboardButton("✅ Done", callback_data="DONE")]]
+    return InlineKeyboardMarkup(rows), InlineKeyboardMarkup(with_done)
+
+
+# ------------------------ Delivery slots ------------------------
+
+def format_label(hour, minute):
+    """"20:15" -> "8:15 PM" without going through datetime."""
+    return f"{hour % 12 or 12}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+
+
+@lru_cache(maxsize=2)
+def _grid(open_hour):
+    minutes, labels, values = [], [], []
+    for m in range(open_hour * 60, CLOSE_HOUR * 60 + 1, SLOT_MINUTES):
+        minutes.append(m)
+        values.append(f"{m // 60:02d}:{m % 60:02d}")
+        labels.append(format_label(m // 60, m % 60))
+    return tuple(minutes), tuple(labels), tuple(values)
+
+
+def open_hour_for(day):
+    return WEEKDAY_OPEN_HOUR if day.weekday() < 5 else WEEKEND_OPEN_HOUR
+
+
+class SlotTable:
+    """The day's delivery slot grid, built once per weekday/weekend window."""
+
+    def __init__(self, day):
+        self.day = day
+        self.open_hour = open_hour_for(day)
+        self.minutes, self.labels, self.values = _grid(self.open_hour)
+        self.open_minute = self.minutes[0]
+        self.close_minute = self.minutes[-1]
+        self._label_by_value = dict(zip(self.values, self.labels))
+        self._keyboards = {}
+
+    def first_index(self, now):
+        """Index of the first slot strictly after the current 15-minute boundary."""
+        return bisect_right(self.minutes, now.hour * 60 + now.minute)
+
+    def remaining(self, now):
+        """(label, value) pairs for every slot still available from `now`."""
+        i = self.first_index(now)
+        return list(zip(self.labels[i:], self.values[i:]))
+
+    def keyboard(self, now, hidden=frozenset()):
+        """Slot picker for the remaining slots minus `hidden` ones, three per row.
+
+        Cached by start index and hidden set; None when no slot is left.
+        """
+        i = self.first_index(now)
+        key = (i, hidden)
+        if key not in self._keyboards:
+            buttons = [
+                InlineKeyboardButton(label, callback_data=f"TIME_{value}")
+                for label, value in zip(self.labels[i:], self.values[i:])
+                if value not in hidden
+            ]
+            if len(self._keyboards) > 256:
+                self._keyboards.clear()
+            rows = [buttons[j:j + SLOTS_PER_ROW] for j in range(0, len(buttons), SLOTS_PER_ROW)]
+            self._keyboards[key] = InlineKeyboardMarkup(rows) if buttons else None
+        return self._keyboards[key]
+
+    def label(self, value):
+        """Display label for an "HH:MM" value, computed on the fly for off-grid times."""
+        label = self._label_by_value.get(value)
+        if label is None:
+            hours, minutes = map(int, value.split(":"))
+            label = format_label(hours, minutes)
+        return label
+
+    def contains(self, hours, minutes):
+        return self.open_minute <= hours * 60 + minutes <= self.close_minute
+
+
+_today = None
+
+
+def slot_table(now=None):
+    """SlotTable for today, rebuilt only when the date changes."""
+    global _today
+    day = (now or datetime.now()).date()
+    if _today is None or _today.day != day:
+        _today = SlotTable(day)
+    return _today
@@ -0,0 +1,369 @@
+"""Replay recorded Telegram updates through the real handlers and compare with golden outputs.
+
+    python replay.py                                # every replays/*.jsonl, one process per CPU
+    python replay.py replays/scheduled_order.jsonl --record
+    python replay.py --jobs 1 --timing-scale 3      # slower machine: triple the budgets
+
+A capture is a JSONL file of raw Telegram updates, as delivered to the
+webhook, one per line (`{"update": {...}}` wrappers are accepted too). It
+may also contain:
+
+    {"replay": {"clock": "2026-10-18T15:07:00", "tz": "Asia/Kolkata", "config": {"admin_id": 42}}}
+        first line only: start time (bot-local), timezone and Config overrides
+    {"clock": "2026-10-18T19:30:00"}  or  {"advance": 600}
+        move the frozen clock before the next update
+
+Message dates also move the clock forward, so real captures replay at the
+times they were recorded. Each capture runs in a fresh application (fake Bot
+API, in-memory Firestore, frozen clock) and background writes are settled
+after every update. The Bot API calls made for each update, handler errors
+and the final Firestore documents are compared with `<capture>.golden.json`;
+--record (re)writes it. Every handler's run time is collected and its p95
+over all captures is checked against its budget in `replays/budgets.json`
+(ms), set a few times above the p95 measured with one process per core;
+"default" covers handlers without a budget of their own. More jobs than cores
+share the CPU and need --timing-scale. Exits with code 1 on any difference
+or budget overrun.
+"""
+import argparse
+import asyncio
+import dataclasses
+import difflib
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPLAYS = os.path.join(ROOT, "replays")
+BUDGETS = os.path.join(REPLAYS, "budgets.json")
+
+
+# ------------------------ Frozen clock ------------------------
+
+class Clock:
+    """The replay's current instant (aware UTC), shared by the frozen classes below."""
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    @classmethod
+    def set_local(cls, value):
+        """Set from a naive bot-local ISO time ("2026-10-18T15:07:00")."""
+        cls.now = datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+class _Frozen(type):
+    # Real datetimes (from Firestore, fromisoformat, ...) still pass isinstance checks
+    def __instancecheck__(cls, obj):
+        return isinstance(obj, cls.__mro__[1])
+
+
+class FrozenDatetime(datetime, metaclass=_Frozen):
+    @classmethod
+    def now(cls, tz=None):
+        return Clock.now.astimezone(tz) if tz else Clock.now.astimezone().replace(tzinfo=None)
+
+    @classmethod
+    def utcnow(cls):
+        return Clock.now.replace(tzinfo=None)
+
+    @classmethod
+    def today(cls):
+        return cls.now()
+
+
+class FrozenDate(date, metaclass=_Frozen):
+    @classmethod
+    def today(cls):
+        return FrozenDatetime.now().date()
+
+
+def freeze_clock(tz):
+    """Point every module that reads the wall clock at `Clock`, in the timezone `tz`."""
+    os.environ["TZ"] = tz
+    time.tzset()
+    import fakes
+    import food_order_bot
+    import order_log
+    import precompute
+    import reporting
+    import slot_capacity
+    for module in (fakes, food_order_bot, order_log, precompute, reporting, slot_capacity):
+        if isinstance(getattr(module, "datetime", None), type):
+            module.datetime = FrozenDatetime
+        if isinstance(getattr(module, "date", None), type):
+            module.date = FrozenDate
+
+
+# ------------------------ Captures ------------------------
+
+def load_capture(path):
+    """(settings, steps) where steps are ("update", dict), ("clock", str) or ("advance", seconds)."""
+    settings, steps = {}, []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "replay" in entry:
+                if steps:
+                    raise ValueError(f"{path}:{n}: the replay header must come first")
+                settings = entry["replay"]
+            elif "clock" in entry:
+                steps.append(("clock", entry["clock"]))
+            elif "advance" in entry:
+                steps.append(("advance", float(entry["advance"])))
+            elif "update_id" in entry or "update" in entry:
+                steps.append(("update", entry.get("update", entry)))
+            else:
+                raise ValueError(f"{path}:{n}: expected an update, a clock line or the replay header")
+    return settings, steps
+
+
+def golden_path(path):
+    return os.path.splitext(path)[0] + ".golden.json"
+
+
+def plain(value):
+    """JSON-ready copy of Firestore documents and Bot API parameters."""
+    if isinstance(value, dict):
+        return {str(k): plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return type(value).__name__
+
+
+# ------------------------ Replaying ------------------------
+
+class ErrorLog(logging.Handler):
+    """Collects exceptions the handlers raised (PTB logs them) per update."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.step = None
+        self.errors = []
+
+    def emit(self, record):
+        if record.exc_info and record.exc_info[1] is not None:
+            error = f"{type(record.exc_info[1]).__name__}: {record.exc_info[1]}"
+        else:
+            error = record.getMessage()
+        self.errors.append({"update": self.step, "logger": record.name, "error": error})
+
+
+def message_time(update):
+    message = update.get("message") or update.get("edited_message")
+    return datetime.fromtimestamp(message["date"], timezone.utc) if message and "date" in message else None
+
+
+async def replay_capture(path):
+    """Run one capture in a fresh application. Returns its outputs and per-handler timings."""
+    from telegram import Update
+
+    import food_order_bot as bot
+    import metrics
+    from config import Config
+    from fakes import FakeBotRequest, FakeFirestore
+
+    settings, steps = load_capture(path)
+    freeze_clock(settings.get("tz", "UTC"))
+    if "clock" in settings:
+        Clock.set_local(settings["clock"])
+    else:
+        first = next((message_time(data) for kind, data in steps if kind == "update" and message_time(data)), None)
+        Clock.now = first or Clock.now
+
+    replies = []
+    step = [None]
+
+    class RecordingRequest(FakeBotRequest):
+        async def do_request(self, url, method, request_data=None, *args, **kwargs):
+            endpoint = url.rsplit("/", 1)[-1]
+            if endpoint != "getMe":
+                params = request_data.parameters if request_data else {}
+                replies.append({"update": step[0], "method": endpoint, **plain(params)})
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    config = Config(
+        token="123456:REPLAY",
+        persistence="none",
+        webhook_url="http://localhost",
+        menu_source=os.path.join(ROOT, "menu.json"),
+        order_log_path=os.path.join(workdir, "orders.wal"),
+        admin_digest_window=0,
+        send_rate_global=1e9,
+        send_rate_per_chat=1e9,
+        session_sweep_interval=0,
+    )
+    config = dataclasses.replace(config, **settings.get("config", {}))
+    db = FakeFirestore()
+    app = bot.create_app(config, db=db, request=RecordingRequest(keep=1))
+    bot.media_cache.store_path = os.path.join(workdir, "media_cache.json")
+    # Activity is written once at shutdown, with the final clock, instead of on a timer
+    bot.activity.tick = 1e9
+
+    errors = ErrorLog()
+    logging.getLogger().addHandler(errors)
+    timings = {}
+    try:
+        await app.initialize()
+        await app.post_init(app)
+        await app.start()
+        await app.bot_data["warm_task"]
+
+        for n, (kind, data) in enumerate(steps):
+            if kind == "clock":
+                Clock.set_local(data)
+                continue
+            if kind == "advance":
+                Clock.now += timedelta(seconds=data)
+                continue
+            sent_at = message_time(data)
+            if sent_at and sent_at > Clock.now:
+                Clock.now = sent_at
+            step[0] = errors.step = data.get("update_id", n)
+            before = metrics.handler_seconds.totals()
+            await app.process_update(Update.de_json(data, app.bot))
+            after = metrics.handler_seconds.totals()
+            for handler, (count, seconds) in after.items():
+                runs = count - before.get(handler, (0, 0.0))[0]
+                if runs:
+                    elapsed = (seconds - before.get(handler, (0, 0.0))[1]) / runs
+                    timings.setdefault(handler, []).extend([elapsed * 1000] * runs)
+            # Orders and cached writes land while the clock still reads this update's time
+            await bot.order_log.drain()
+            await bot.writer.flush()
+
+        step[0] = errors.step = "shutdown"
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+        await app.post_shutdown(app)
+    finally:
+        logging.getLogger().removeHandler(errors)
+
+    documents = {name: plain(docs) for name, docs in sorted(db.collections.items()) if docs}
+    return {
+        "path": path,
+        "outputs": {"replies": replies, "errors": errors.errors, "documents": documents},
+        "timings": timings,
+    }
+
+
+def run_capture(path):
+    """Process-pool entry point."""
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.WARNING)
+    try:
+        return asyncio.run(replay_capture(path))
+    except Exception as e:
+        logging.getLogger(__name__).exception("Replaying %s failed", path)
+        return {"path": path, "failed": f"{type(e).__name__}: {e}", "timings": {}}
+
+
+# ------------------------ Checking ------------------------
+
+def dump(outputs):
+    return json.dumps(outputs, indent=1, sort_keys=True, ensure_ascii=False) + "\n"
+
+
+def compare(path, outputs, context=3, max_lines=60):
+    """Unified diff against the golden file (empty if they match)."""
+    golden = golden_path(path)
+    if not os.path.exists(golden):
+        return [f"no golden file {os.path.relpath(golden)}; run with --record"]
+    with open(golden, encoding="utf-8") as f:
+        expected = f.read()
+    diff = list(difflib.unified_diff(
+        expected.splitlines(), dump(outputs).splitlines(),
+        os.path.relpath(golden), "replayed", n=context, lineterm="",
+    ))
+    return diff[:max_lines] + ([f"... {len(diff) - max_lines} more lines"] if len(diff) > max_lines else [])
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def check_budgets(timings, budgets, scale=1.0):
+    """Per-handler (count, p50, p95, budget, over) rows; a handler without a budget gets budgets["default"]."""
+    rows = []
+    for handler, samples in sorted(timings.items()):
+        budget = budgets.get(handler, budgets.get("default"))
+        budget = budget * scale if budget is not None else None
+        p95 = percentile(samples, 95)
+        rows.append((handler, len(samples), percentile(samples, 50), p95, budget, budget is not None and p95 > budget))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("captures", nargs="*", help=f"JSONL captures (default: {os.path.relpath(REPLAYS)}/*.jsonl)")
+    parser.add_argument("--record", action="store_true", help="write the golden files instead of comparing")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes (1: replay in this process)")
+    parser.add_argument("--budgets", default=BUDGETS, help="JSON of p95 budgets in ms per handler, plus \"default\"")
+    parser.add_argument("--timing-scale", type=float, default=1.0, help="multiply every budget (slow or shared machines)")
+    args = parser.parse_args()
+
+    paths = args.captures or sorted(glob.glob(os.path.join(REPLAYS, "*.jsonl")))
+    if not paths:
+        parser.error("no captures found")
+    budgets = {}
+    if args.budgets and os.path.exists(args.budgets):
+        with open(args.budgets, encoding="utf-8") as f:
+            budgets = json.load(f)
+
+    started = time.perf_counter()
+    jobs = max(1, min(args.jobs or 1, len(paths)))
+    if jobs == 1:
+        results = [run_capture(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(run_capture, paths))
+    elapsed = time.perf_counter() - started
+
+    failures = 0
+    timings = {}
+    for result in results:
+        name = os.path.relpath(result["path"])
+        for handler, samples in result["timings"].items():
+            timings.setdefault(handler, []).extend(samples)
+        if "failed" in result:
+            failures += 1
+            print(f"FAIL {name}: {result['failed']}")
+        elif args.record:
+            with open(golden_path(result["path"]), "w", encoding="utf-8") as f:
+                f.write(dump(result["outputs"]))
+            print(f"recorded {name}: {len(result['outputs']['replies'])} Bot API calls")
+        else:
+            diff = compare(result["path"], result["outputs"])
+            if diff:
+                failures += 1
+                print(f"FAIL {name}")
+                print("\n".join("    " + line for line in diff))
+            else:
+                print(f"ok   {name}")
+
+    print(f"\n{'handler':<24}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'budget':>10}")
+    for handler, count, p50, p95, budget, over in check_budgets(timings, budgets, args.timing_scale):
+        limit = f"{budget:.1f}" if budget is not None else "-"
+        print(f"{handler:<24}{count:>6}{p50:>10.2f}{p95:>10.2f}{limit:>10}{'  OVER' if over else ''}")
+        failures += over and not args.record
+    print(f"\n{len(paths)} captures in {elapsed:.2f}s with {jobs} process(es)")
+    if failures:
+        print(f"{failures} failure(s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
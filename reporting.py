@@ -0,0 +1,286 @@
+"""Order statistics for the admin reports.
+
+Every day has one `order_stats/<YYYY-MM-DD>` document with running totals:
+
+    {"day": "2026-10-18", "orders": 12, "revenue": 1480,
+     "items": {"Chicken Biryani": 9, ...},
+     "slots": {"20:15": {"orders": 3, "revenue": 410, "items": {...}}, ...}}
+
+The order log adds each batch of orders to these documents with server-side
+increments in the same Firestore batch that writes the orders, so `/stats`
+and `/kitchen` read one document per day instead of scanning `orders`. The
+backfill job rebuilds the documents from the orders collection:
+
+    FIREBASE_JSON=... python reporting.py backfill --since 2026-01-01
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "order_stats"
+ORDERS = "orders"
+
+
+def local_day(moment):
+    """The bot's local calendar day (what `date.today()` returns) for an aware datetime."""
+    return moment.astimezone().date().isoformat()
+
+
+def empty_totals():
+    return {"orders": 0, "revenue": 0, "items": {}}
+
+
+def _add(totals, revenue, items):
+    totals["orders"] += 1
+    totals["revenue"] += revenue
+    for name, quantity in items.items():
+        totals["items"][name] = totals["items"].get(name, 0) + quantity
+
+
+def add_order(stats, order):
+    """Count one order dict (as stored in `orders`) into a day's `stats`."""
+    items = {}
+    for line in order.get("items") or ():
+        items[line["item_name"]] = items.get(line["item_name"], 0) + line["quantity"]
+    revenue = order.get("total_price") or 0
+    _add(stats, revenue, items)
+    slot = order.get("delivery_time") or "unknown"
+    _add(stats.setdefault("slots", {}).setdefault(slot, empty_totals()), revenue, items)
+
+
+def aggregate(records):
+    """Per-day stats for order log records ({"placed_at", "order"})."""
+    days = {}
+    for record in records:
+        day = local_day(datetime.fromisoformat(record["placed_at"]))
+        add_order(days.setdefault(day, {**empty_totals(), "slots": {}}), record["order"])
+    return days
+
+
+def merge_stats(into, stats):
+    """Add the counters of `stats` to `into` in place."""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            merge_stats(into.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            into[key] = into.get(key, 0) + value
+
+
+def as_increments(stats):
+    from firebase_admin import firestore
+    return {
+        key: as_increments(value) if isinstance(value, dict) else firestore.Increment(value)
+        for key, value in stats.items()
+    }
+
+
+def top_items(items, n=None):
+    return sorted(items.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+
+class OrderReports:
+    """Cached reads of the `order_stats` documents and the write side used by the order log.
+
+    Today's document is re-read after `ttl` seconds because other workers add
+    to it too; earlier days only change on a backfill and are kept for
+    `history_ttl`. Orders this process writes are added to the cached copy as
+    soon as their batch commits.
+
+    An order is counted in the batch that creates its document. If the process
+    dies between that commit and the log's ack, the replay on the next start
+    finds the document and doesn't count the order again (see OrderLog).
+    """
+
+    def __init__(self, writer=None, ttl=30, history_ttl=3600, max_days=62, clock=time.monotonic):
+        self.writer = writer
+        self.ttl = ttl
+        self.history_ttl = history_ttl
+        self.max_days = max_days
+        self.clock = clock
+        self._cache = {}  # day -> (fetched_at, stats, commits started before the read)
+        self._commits = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ------------------------ Write path ------------------------
+
+    def add_to_batch(self, db, batch, records):
+        """Queue increments for `records` on a Firestore batch (called on a writer thread)."""
+        days = aggregate(records)
+        for day, stats in days.items():
+            batch.set(db.collection(COLLECTION).document(day), {"day": day, **as_increments(stats)}, merge=True)
+        return days
+
+    def begin_commit(self):
+        """Called on the event loop before a batch with increments is committed; returns its token for `applied`."""
+        self._commits += 1
+        return self._commits
+
+    def applied(self, days, token):
+        """Fold committed increments into the cached documents read before that commit started.
+
+        A document read after it started may already hold the increments, so
+        it is dropped and read again instead.
+        """
+        for day, stats in days.items():
+            cached = self._cache.get(day)
+            if not cached:
+                continue
+            if cached[2] < token:
+                merge_stats(cached[1], stats)
+            else:
+                del self._cache[day]
+        metrics.count_firestore("write", COLLECTION, len(days))
+
+    # ------------------------ Reads ------------------------
+
+    def _fresh(self, day, today):
+        cached = self._cache.get(day)
+        if not cached:
+            return None
+        ttl = self.ttl if day >= today else self.history_ttl
+        return cached[1] if self.clock() - cached[0] < ttl else None
+
+    def _store(self, day, stats):
+        self._cache[day] = (self.clock(), stats, self._commits)
+        if len(self._cache) > self.max_days:
+            for old in sorted(self._cache)[:len(self._cache) - self.max_days]:
+                del self._cache[old]
+
+    def _query(self, first, last):
+        query = self.writer.db.collection(COLLECTION)
+        if first == last:
+            snapshot = query.document(first).get()
+            return [snapshot] if snapshot.exists else []
+        return list(query.where("day", ">=", first).where("day", "<=", last).stream())
+
+    async def days(self, first, last=None):
+        """Stats for every day from `first` to `last` (date objects), oldest first.
+
+        Days without orders come back as empty totals. Cached days are not read;
+        the rest come from one document get or one range query.
+        """
+        last = last or first
+        wanted = [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+        today = date.today().isoformat()
+        found = {day: self._fresh(day, today) for day in wanted}
+        missing = [day for day, stats in found.items() if stats is None]
+        self.hits += len(wanted) - len(missing)
+        if missing:
+            self.misses += len(missing)
+            commits = self._commits
+            snapshots = await self.writer.run(self._query, missing[0], missing[-1])
+            # A commit that started during the read may or may not be in it; use it, don't cache it
+            cache = self._commits == commits
+            metrics.count_firestore("read", COLLECTION, max(1, len(snapshots)))
+            fetched = {snapshot.id: snapshot.to_dict() for snapshot in snapshots}
+            for day in missing:
+                stats = copy.deepcopy(fetched.get(day)) or {**empty_totals(), "slots": {}}
+                stats.pop("day", None)
+                if cache:
+                    self._store(day, stats)
+                found[day] = stats
+        # Callers get copies; the cache keeps absorbing increments
+        return [(day, copy.deepcopy(found[day])) for day in wanted]
+
+    async def day(self, day=None):
+        return (await self.days(day or date.today()))[0][1]
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def stats(self):
+        return {"cached_days": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+# ------------------------ Backfill ------------------------
+
+def _start_of(day):
+    return datetime.combine(day, datetime.min.time()).astimezone()
+
+
+async def backfill(writer, since=None, until=None, page_size=500):
+    """Rebuild `order_stats` from the orders collection.
+
+    Orders are streamed in `page_size` pages ordered by timestamp, and only the
+    per-day totals are kept in memory. Days from `since` up to but not
+    including `until` (dates; None for no bound) are overwritten. Running it
+    for today while orders come in can lose the increments that land between
+    the read and the overwrite, so the default stops at yesterday.
+    """
+    db = writer.db
+    query = db.collection(ORDERS)
+    if since:
+        query = query.where("timestamp", ">=", _start_of(since))
+    if until:
+        query = query.where("timestamp", "<", _start_of(until))
+    query = query.order_by("timestamp").limit(page_size)
+
+    days, last, scanned, skipped = {}, None, 0, 0
+    while True:
+        page_query = query.start_after(last) if last else query
+        page = await writer.run(lambda: list(page_query.stream()))
+        metrics.count_firestore("read", ORDERS, len(page))
+        for snapshot in page:
+            order = snapshot.to_dict()
+            moment = order.get("timestamp")
+            if not isinstance(moment, datetime):
+                skipped += 1
+                continue
+            add_order(days.setdefault(local_day(moment), {**empty_totals(), "slots": {}}), order)
+        scanned += len(page)
+        if len(page) < page_size:
+            break
+        last = page[-1]
+        logger.info("Backfill: %d orders read", scanned)
+
+    def write(chunk):
+        batch = db.batch()
+        for day, stats in chunk:
+            batch.set(db.collection(COLLECTION).document(day), {"day": day, **stats})
+        batch.commit()
+
+    items = sorted(days.items())
+    for i in range(0, len(items), 400):
+        await writer.run(write, items[i:i + 400])
+        metrics.count_firestore("write", COLLECTION, len(items[i:i + 400]))
+    return {"orders": scanned, "skipped": skipped, "days": len(days)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the order_stats documents from the orders collection.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("backfill")
+    rebuild.add_argument("--since", type=date.fromisoformat, help="first day to rebuild (default: all orders)")
+    rebuild.add_argument("--until", type=date.fromisoformat, default=date.today(),
+                         help="rebuild up to but not including this day (default: today)")
+    rebuild.add_argument("--include-today", action="store_true",
+                         help="also rebuild today; only safe while no orders come in")
+    rebuild.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO)
+
+    from firestore_queue import FirestoreWriter, LazyFirestore
+    until = None if args.include_today else args.until
+
+    async def run():
+        writer = FirestoreWriter(LazyFirestore(os.getenv("FIREBASE_JSON")))
+        try:
+            return await backfill(writer, since=args.since, until=until, page_size=args.page_size)
+        finally:
+            await writer.stop()
+
+    result = asyncio.run(run())
+    print(f"Rebuilt {result['days']} days from {result['orders']} orders ({result['skipped']} without a timestamp)")
+
+
+if __name__ == "__main__":
+    main()
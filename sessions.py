@@ -0,0 +1,199 @@
+import asyncio
+import inspect
+import logging
+import sys
+import time
+
+import telegram
+from telegram.ext import ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+
+def parse_timeouts(spec, states):
+    """Parse "ENTER_ADDRESS=1800,CONFIRM=600" into {state: seconds} using `states` ({name: state})."""
+    timeouts = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, seconds = part.partition("=")
+        if name.strip().upper() not in states:
+            raise ValueError(f"Unknown conversation state {name!r} in timeouts, expected one of {', '.join(states)}")
+        timeouts[states[name.strip().upper()]] = float(seconds)
+    return timeouts
+
+
+def check_conversation_internals(conversation):
+    """Raise if `conversation` lacks the private ConversationHandler API the reaper relies on.
+
+    PTB's own conversation_timeout needs the JobQueue extra; the reaper instead
+    reads `_conversations` and calls `_update_state(new_state, key)`, as in
+    python-telegram-bot 20.6 (pinned in requirements.txt). An upgrade that
+    changes either should stop the bot at startup, not leave carts unreaped.
+    """
+    problems = []
+    if not isinstance(getattr(conversation, "_conversations", None), dict):
+        problems.append("_conversations is not a dict")
+    update_state = getattr(conversation, "_update_state", None)
+    if not callable(update_state):
+        problems.append("_update_state is missing")
+    elif list(inspect.signature(update_state).parameters)[:2] != ["new_state", "key"]:
+        problems.append(f"_update_state{inspect.signature(update_state)} no longer takes (new_state, key)")
+    if problems:
+        raise RuntimeError(
+            f"SessionReaper can't run on python-telegram-bot {telegram.__version__}: {'; '.join(problems)}. "
+            "It was written against 20.6; see sessions.py"
+        )
+
+
+def deep_size(obj, _seen=None):
+    """Rough bytes held by a user_data value: sys.getsizeof over dicts, lists and their contents."""
+    _seen = _seen if _seen is not None else set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, _seen) + deep_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, _seen) for v in obj)
+    return size
+
+
+class SessionReaper:
+    """Ends idle order conversations and drops stale `user_data`.
+
+    `touch()` is called for every update. A periodic sweep (every `interval`
+    seconds) ends conversations idle for longer than their state's timeout
+    (`timeouts`, else `default_timeout`), drops that user's cart and awaits
+    `on_expire(chat_id, user_id, state)` so the bot can release held slots and tell
+    the customer. `user_data` of users outside a conversation is dropped after
+    `idle_ttl` seconds. Both changes go through the Application, so
+    persistence forgets them too. Users restored from persistence after a
+    restart get a full timeout from the first sweep. `sweepers` are extra
+    callables run on every sweep (e.g. other bounded caches).
+
+    This uses ConversationHandler internals, checked when the reaper is built
+    (see `check_conversation_internals`).
+    """
+
+    def __init__(self, conversation, timeouts=None, default_timeout=900, idle_ttl=3600, interval=60, on_expire=None, sweepers=(), clock=time.monotonic):
+        check_conversation_internals(conversation)
+        self.conversation = conversation
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.on_expire = on_expire
+        self.sweepers = list(sweepers)
+        self.clock = clock
+
+        self.application = None
+        self._seen = {}  # user_id -> last update (clock)
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+
+        self.expired = 0
+        self.dropped = 0
+        self.sweeps = 0
+        self.last_sweep_ms = 0.0
+        self._bytes = 0
+
+    def timeout_for(self, state):
+        return self.timeouts.get(state, self.default_timeout)
+
+    # ------------------------ Lifecycle ------------------------
+
+    async def start(self, application):
+        self.application = application
+        if self.interval > 0:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Session sweep failed")
+
+    # ------------------------ Sweeping ------------------------
+
+    def touch(self, user_id):
+        self._seen[user_id] = self.clock()
+
+    def _active(self):
+        # PTB keeps conversation states in a private dict keyed by (chat_id, user_id);
+        # its own conversation_timeout (which needs the JobQueue) reads it the same way
+        return {key[-1]: (key, state) for key, state in list(self.conversation._conversations.items())}
+
+    async def sweep(self):
+        """End idle conversations and drop idle user_data. Returns (expired, dropped)."""
+        started = time.perf_counter()
+        now = self.clock()
+        active = self._active()
+        user_data = self.application.user_data
+        expired, dropped = [], 0
+
+        for user_id in set(active) | set(user_data):
+            seen = self._seen.setdefault(user_id, now)
+            if user_id in active:
+                key, state = active[user_id]
+                if now - seen >= self.timeout_for(state):
+                    # What ConversationHandler does on conversation_timeout
+                    self.conversation._update_state(ConversationHandler.END, key)
+                    self.application.drop_user_data(user_id)
+                    self._seen.pop(user_id, None)
+                    expired.append((key[0], user_id, state))
+            elif now - seen >= self.idle_ttl:
+                self.application.drop_user_data(user_id)
+                self._seen.pop(user_id, None)
+                dropped += 1
+
+        # Users with no conversation and no data left need no timestamp
+        for user_id in [u for u in self._seen if u not in active and u not in user_data]:
+            del self._seen[user_id]
+        for sweeper in self.sweepers:
+            sweeper()
+
+        self.expired += len(expired)
+        self.dropped += dropped
+        self._bytes = sum(deep_size(data) for data in user_data.values())
+        self.sweeps += 1
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        if expired or dropped:
+            logger.info("Expired %d idle conversations, dropped %d idle sessions", len(expired), dropped)
+        if self.on_expire and expired:
+            results = await asyncio.gather(*(self.on_expire(*entry) for entry in expired), return_exceptions=True)
+            for (_, user_id, _), result in zip(expired, results):
+                if isinstance(result, Exception):
+                    logger.warning("Expiry notice for %s failed: %s", user_id, result)
+        return len(expired), dropped
+
+    # ------------------------ Reporting ------------------------
+
+    def stats(self):
+        sessions = len(self.application.user_data) if self.application else 0
+        return {
+            "conversations": len(self.conversation._conversations),
+            "sessions": sessions,
+            "session_bytes": self._bytes,
+            "bytes_per_session": round(self._bytes / sessions) if sessions else 0,
+            "expired": self.expired,
+            "dropped": self.dropped,
+            "sweeps": self.sweeps,
+            "last_sweep_ms": round(self.last_sweep_ms, 2),
+        }
@@ -0,0 +1,351 @@
+"""Scale-out mode: one ingress process, N worker processes sharded by user id.
+
+The ingress receives raw updates (long polling or webhook) and hands each one to
+worker `user_id % N` through a bounded multiprocessing queue, so a customer's
+ConversationHandler state always lives in the same process. Each worker runs
+the normal Application (built by `create_app`) with its own SQLite persistence
+file, an equal share of the global send rate and its share of each slot's
+capacity (see `ShardedRunner.slot_share`). On shutdown the ingress stops
+receiving, sends every worker a sentinel, and workers finish their queued
+updates before flushing and exiting.
+
+The ingress serves /stats (every worker's stats, per shard) and /metrics
+(every worker's Prometheus metrics with a `shard` label), collected from the
+workers on each request. /profile is not available in sharded mode.
+
+Sharding spreads the CPU work over processes, so it only pays off with more
+than one core: on a single-CPU host benchmarks/sharding_bench.py measures two
+workers at 0.83-0.92x the throughput of one.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import queue as queue_module
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+from telegram import Bot, Update
+
+logger = logging.getLogger(__name__)
+
+# Update fields that carry the user who caused the update
+_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request", "channel_post", "edited_channel_post",
+)
+
+
+def shard_key(data):
+    """User id of a raw update dict (chat id when there is no user, else 0)."""
+    for field in _UPDATE_FIELDS:
+        obj = data.get(field)
+        if obj:
+            user = obj.get("from") or obj.get("user")
+            if user:
+                return user["id"]
+            chat = obj.get("chat")
+            if chat:
+                return chat["id"]
+    return 0
+
+
+def default_app_factory(config):
+    from food_order_bot import create_app
+    return create_app(config)
+
+
+# ------------------------ Worker ------------------------
+
+def worker_main(index, config, queue, events, replies, app_factory):
+    logging.basicConfig(format=f"%(asctime)s worker-{index} %(name)s %(levelname)s %(message)s", level=logging.INFO)
+    # Ignore Ctrl+C here; the ingress decides when to drain
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, config, queue, events, replies, app_factory))
+
+
+def _worker_stats(app):
+    import metrics
+    stats = app.bot_data.get("stats")
+    return {"stats": stats() if stats else None, "metrics": metrics.render_prometheus()}
+
+
+async def _run_worker(index, config, queue, events, replies, app_factory):
+    app = app_factory(config)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    events.put(("ready", index, None))
+
+    loop = asyncio.get_running_loop()
+    processed = 0
+    started = None
+    while True:
+        data = await loop.run_in_executor(None, queue.get)
+        if data is None:
+            break
+        if isinstance(data, tuple):
+            # ("stats", token) from the ingress's /stats or /metrics
+            try:
+                replies.put((data[1], index, _worker_stats(app)))
+            except Exception as e:
+                logger.exception("Collecting worker stats failed")
+                replies.put((data[1], index, {"error": str(e)}))
+            continue
+        if started is None:
+            started = time.perf_counter()
+        await app.update_queue.put(Update.de_json(data, app.bot))
+        processed += 1
+
+    # stop() processes everything already queued before returning
+    await app.stop()
+    elapsed = time.perf_counter() - started if started else 0.0
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    events.put(("done", index, {"processed": processed, "elapsed_s": elapsed}))
+
+
+# ------------------------ Ingress ------------------------
+
+class ShardedRunner:
+    """Starts the worker processes and routes raw updates to them."""
+
+    def __init__(self, config, workers, app_factory=default_app_factory, queue_size=10000):
+        if 0 < config.slot_capacity < workers:
+            # A zero share would mean "no limit" for that worker
+            raise ValueError(f"SLOT_CAPACITY={config.slot_capacity} can't be split between {workers} workers")
+        self.config = config
+        self.workers = workers
+        self.app_factory = app_factory
+        ctx = multiprocessing.get_context("spawn")
+        self.queues = [ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.events = ctx.Queue()
+        self.replies = ctx.Queue()
+        self._tokens = itertools.count(1)
+        self._collect_lock = asyncio.Lock()
+        # One thread per shard keeps a user's updates in order when the queue is full
+        self._putters = [ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.processes = [
+            ctx.Process(
+                target=worker_main,
+                args=(i, self.worker_config(i), self.queues[i], self.events, self.replies, app_factory),
+                name=f"bot-worker-{i}",
+            )
+            for i in range(workers)
+        ]
+        self.dispatched = [0] * workers
+        self.results = {}
+
+    def slot_share(self, index):
+        """Places per slot that worker `index` may book.
+
+        Shards don't share counters, so SLOT_CAPACITY is split between them:
+        the remainder goes one place each to the lowest shards, and the shares
+        add up to exactly SLOT_CAPACITY. A slot counts as full for a customer
+        once their shard's share is booked, even if another shard has room.
+        """
+        capacity = self.config.slot_capacity
+        if capacity <= 0:
+            return 0
+        return capacity // self.workers + (index < capacity % self.workers)
+
+    def worker_config(self, index):
+        return replace(
+            self.config,
+            webhook_url=self.config.webhook_url or "sharded",  # workers never poll themselves
+            persistence_path=f"{self.config.persistence_path}.{index}",
+            order_log_path=f"{self.config.order_log_path}.{index}",
+            send_rate_global=self.config.send_rate_global / self.workers,
+            slot_capacity=self.slot_share(index),
+            shard=index,
+        )
+
+    async def _next_event(self, timeout, waiting_for):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self.events.get, True, timeout)
+        except queue_module.Empty:
+            raise RuntimeError(f"No worker reported {waiting_for} within {timeout}s") from None
+
+    async def start(self, timeout=60):
+        for process in self.processes:
+            process.start()
+        ready = 0
+        while ready < self.workers:
+            kind, index, _ = await self._next_event(timeout, "ready")
+            if kind == "ready":
+                ready += 1
+        logger.info("%d workers ready", self.workers)
+
+    async def dispatch(self, data):
+        shard = shard_key(data) % self.workers
+        self.dispatched[shard] += 1
+        queue = self.queues[shard]
+        try:
+            queue.put_nowait(data)
+        except Exception:
+            # Full: wait on the shard's own thread so ordering is preserved
+            await asyncio.get_running_loop().run_in_executor(self._putters[shard], queue.put, data)
+
+    async def collect(self, timeout=5):
+        """{shard: {"stats": ..., "metrics": ...}} from every worker; a worker that doesn't answer gets {"error": ...}."""
+        loop = asyncio.get_running_loop()
+        async with self._collect_lock:
+            token = next(self._tokens)
+            for shard, queue in enumerate(self.queues):
+                # Through the shard's own thread, behind any update it is still putting
+                await loop.run_in_executor(self._putters[shard], queue.put, ("stats", token))
+            collected = {}
+            deadline = loop.time() + timeout
+            while len(collected) < self.workers:
+                remaining = deadline - loop.time()
+                try:
+                    if remaining <= 0:
+                        raise queue_module.Empty
+                    reply_token, index, payload = await loop.run_in_executor(None, self.replies.get, True, remaining)
+                except queue_module.Empty:
+                    break
+                if reply_token == token:  # late answers to an earlier request are dropped
+                    collected[index] = payload
+        return {shard: collected.get(shard, {"error": f"no answer within {timeout}s"}) for shard in range(self.workers)}
+
+    async def drain(self, timeout=60):
+        """Tell every worker to finish its queue, then wait for them to exit."""
+        loop = asyncio.get_running_loop()
+        for shard, queue in enumerate(self.queues):
+            await loop.run_in_executor(self._putters[shard], queue.put, None)
+        while len(self.results) < self.workers:
+            kind, index, payload = await self._next_event(timeout, "done")
+            if kind == "done":
+                self.results[index] = payload
+        for process in self.processes:
+            process.join(timeout)
+        for putter in self._putters:
+            putter.shutdown()
+        return self.results
+
+
+async def _poll(bot, runner, stop):
+    offset = None
+    stopped = asyncio.create_task(stop.wait())
+    while not stop.is_set():
+        fetch = asyncio.create_task(bot.get_updates(offset=offset, timeout=25, allowed_updates=Update.ALL_TYPES))
+        await asyncio.wait({fetch, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if not fetch.done():
+            fetch.cancel()
+            break
+        try:
+            updates = fetch.result()
+        except Exception:
+            logger.exception("getUpdates failed, retrying")
+            await asyncio.sleep(2)
+            continue
+        for update in updates:
+            await runner.dispatch(update.to_dict())
+            offset = update.update_id + 1
+    stopped.cancel()
+    if offset is not None:
+        # Acknowledge what was dispatched so a restart doesn't replay it
+        await bot.get_updates(offset=offset, timeout=0)
+
+
+def merge_prometheus(texts):
+    """One exposition from {shard: Prometheus text}: every sample gets a `shard` label, families stay together."""
+    families = {}  # name -> (HELP/TYPE lines, samples), in first-seen order
+    for shard, text in sorted(texts.items()):
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = families.setdefault(line.split()[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+                continue
+            if not line or family is None:
+                continue
+            name, _, rest = line.partition(" ")
+            if "{" in name:
+                name = name.replace("{", f'{{shard="{shard}",', 1)
+            else:
+                name = f'{name}{{shard="{shard}"}}'
+            family[1].append(f"{name} {rest}")
+    return "".join(line + "\n" for header, samples in families.values() for line in header + samples)
+
+
+async def _serve_ingress(config, runner):
+    from aiohttp import web
+
+    async def handle_update(request):
+        if config.webhook_secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != config.webhook_secret:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400, text="Invalid JSON")
+        if not isinstance(data, dict) or "update_id" not in data:
+            return web.Response(status=400, text="Not an update")
+        await runner.dispatch(data)
+        return web.Response(text="ok")
+
+    async def health(request):
+        return web.Response(text="Bot is alive.")
+
+    async def show_stats(request):
+        shards = await runner.collect()
+        return web.json_response({
+            "mode": "sharded",
+            "workers": runner.workers,
+            "dispatched": runner.dispatched,
+            "shards": {str(shard): payload.get("stats", payload) for shard, payload in shards.items()},
+        })
+
+    async def show_metrics(request):
+        shards = await runner.collect()
+        text = merge_prometheus({shard: payload.get("metrics", "") for shard, payload in shards.items()})
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+    web_app = web.Application()
+    web_app.router.add_post("/telegram", handle_update)
+    web_app.router.add_get("/", health)
+    web_app.router.add_get("/health", health)
+    web_app.router.add_get("/stats", show_stats)
+    web_app.router.add_get("/metrics", show_metrics)
+    web_runner = web.AppRunner(web_app)
+    await web_runner.setup()
+    await web.TCPSite(web_runner, "0.0.0.0", config.port).start()
+    return web_runner
+
+
+async def run_ingress(config, workers, app_factory=default_app_factory):
+    runner = ShardedRunner(config, workers, app_factory)
+    await runner.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    bot = Bot(config.token)
+    async with bot:
+        web_runner = await _serve_ingress(config, runner)
+        if config.webhook_url:
+            await bot.set_webhook(config.webhook_url.rstrip("/") + "/telegram", secret_token=config.webhook_secret, allowed_updates=Update.ALL_TYPES)
+            await stop.wait()
+        else:
+            await bot.delete_webhook()
+            await _poll(bot, runner, stop)
+        await web_runner.cleanup()
+
+    logger.info("Draining %d workers", workers)
+    results = await runner.drain()
+    logger.info("Workers finished: %s", results)
+
+
+def run_sharded(config, workers):
+    asyncio.run(run_ingress(config, workers))
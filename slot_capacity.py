@@ -0,0 +1,154 @@
+import logging
+import time
+from datetime import date
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "slot_counts"
+
+
+class SlotCapacity:
+    """Per-slot order limits for scheduled deliveries.
+
+    Picking a slot places a hold on it for `hold_ttl` seconds; confirming the
+    order turns the hold into a committed order and cancelling drops it. A slot
+    is full once committed orders plus live holds reach `capacity`. Every check
+    and update is a dict lookup on the event loop with no await in between, so
+    concurrent customers cannot both take the last place. Committed counts are
+    written to `slot_counts/<day>` (one document per shard in sharded mode) and
+    read back at startup. `capacity=0` turns limits off.
+    """
+
+    def __init__(self, capacity=10, hold_ttl=600, writer=None, shard=None, clock=time.monotonic):
+        self.capacity = capacity
+        self.hold_ttl = hold_ttl
+        self.writer = writer
+        self.shard = shard
+        self.clock = clock
+
+        self._committed = {}  # (day, slot) -> confirmed orders
+        self._holds = {}  # (day, slot) -> {user_id: expiry}
+        self._held_by = {}  # user_id -> (day, slot)
+        self._today = ""
+        self.rejected = 0
+        self.expired = 0
+
+    def _key(self, slot, day=None):
+        day = (day or date.today()).isoformat()
+        if day > self._today:
+            self._today = day
+            self.sweep()
+        return day, slot
+
+    def _doc_id(self, day):
+        return day if self.shard is None else f"{day}.{self.shard}"
+
+    # ------------------------ Counting ------------------------
+
+    def _live_holds(self, key, now):
+        holds = self._holds.get(key)
+        if not holds:
+            return 0
+        # At most `capacity` holds per slot, so this stays bounded
+        for user_id in [u for u, expiry in holds.items() if expiry <= now]:
+            del holds[user_id]
+            self._held_by.pop(user_id, None)
+            self.expired += 1
+        return len(holds)
+
+    def used(self, slot, day=None):
+        key = self._key(slot, day)
+        return self._committed.get(key, 0) + self._live_holds(key, self.clock())
+
+    def is_full(self, slot, day=None):
+        return self.capacity > 0 and self.used(slot, day) >= self.capacity
+
+    def full_slots(self, slots, day=None):
+        """The subset of `slots` ("HH:MM" values) with no place left."""
+        if self.capacity <= 0:
+            return frozenset()
+        return frozenset(slot for slot in slots if self.is_full(slot, day))
+
+    # ------------------------ Reservations ------------------------
+
+    def reserve(self, user_id, slot, day=None):
+        """Hold a place in `slot` for `user_id`, replacing any other hold. False if the slot is full."""
+        if self.capacity <= 0:
+            return True
+        key = self._key(slot, day)
+        now = self.clock()
+        if self._held_by.get(user_id) == key and self._holds[key].get(user_id, 0) > now:
+            self._holds[key][user_id] = now + self.hold_ttl
+            return True
+        self.release(user_id)
+        if self._committed.get(key, 0) + self._live_holds(key, now) >= self.capacity:
+            self.rejected += 1
+            return False
+        self._holds.setdefault(key, {})[user_id] = now + self.hold_ttl
+        self._held_by[user_id] = key
+        return True
+
+    def release(self, user_id):
+        key = self._held_by.pop(user_id, None)
+        if key:
+            self._holds.get(key, {}).pop(user_id, None)
+
+    def commit(self, user_id, slot, day=None):
+        """Count a confirmed order for `slot`, consuming the user's hold if there is one.
+
+        A confirmed order is always counted, even if its hold expired or was
+        lost in a restart; the slot may then go over capacity by that order.
+        """
+        key = self._key(slot, day)
+        if self._held_by.get(user_id) == key:
+            self.release(user_id)
+        count = self._committed[key] = self._committed.get(key, 0) + 1
+        if self.writer:
+            self.writer.upsert(COLLECTION, self._doc_id(key[0]), {slot: count})
+        return count
+
+    def uncommit(self, slot, day=None):
+        """Give back a committed place, e.g. when saving the order failed."""
+        key = self._key(slot, day)
+        count = self._committed[key] = max(0, self._committed.get(key, 0) - 1)
+        if self.writer:
+            self.writer.upsert(COLLECTION, self._doc_id(key[0]), {slot: count})
+
+    # ------------------------ Lifecycle ------------------------
+
+    async def load(self, day=None):
+        """Read today's committed counts so a restart doesn't reopen full slots."""
+        if not self.writer:
+            return
+        day = (day or date.today()).isoformat()
+        doc_id = self._doc_id(day)
+        try:
+            snapshot = await self.writer.run(lambda: self.writer.db.collection(COLLECTION).document(doc_id).get())
+            metrics.count_firestore("read", COLLECTION)
+        except Exception:
+            logger.exception("Could not load slot counts for %s", day)
+            return
+        for slot, count in (snapshot.to_dict() or {}).items():
+            self._committed[(day, slot)] = max(count, self._committed.get((day, slot), 0))
+
+    def sweep(self):
+        """Drop counters and holds from days before the latest one seen."""
+        today = self._today
+        for table in (self._committed, self._holds):
+            for key in [k for k in table if k[0] < today]:
+                del table[key]
+        for user_id in [u for u, key in self._held_by.items() if key[0] < today]:
+            del self._held_by[user_id]
+
+    def stats(self):
+        # Served from the keep-alive thread: count unexpired holds, leave pruning to the loop
+        now = self.clock()
+        return {
+            "capacity": self.capacity,
+            "committed": sum(list(self._committed.values())),
+            "holds": sum(expiry > now for holds in list(self._holds.values()) for expiry in list(holds.values())),
+            "rejected": self.rejected,
+            "expired_holds": self.expired,
+        }
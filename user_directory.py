@@ -0,0 +1,164 @@
+import logging
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry overhead of the dicts and strings behind one record
+RECORD_OVERHEAD = 240
+
+
+class UserDirectory:
+    """Bounded in-memory map of Telegram users with an O(1) username index.
+
+    Records are kept in LRU order and evicted when they exceed `ttl` seconds of
+    inactivity, when there are more than `max_entries`, or when the estimated
+    memory use passes `max_bytes`. Usernames that could not be found are
+    remembered for `negative_ttl` seconds so repeated /reply typos don't query
+    Firestore again.
+    """
+
+    def __init__(self, max_entries=50000, max_bytes=16 * 1024 * 1024, ttl=7 * 24 * 3600, negative_ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+
+        self._records = OrderedDict()  # user_id -> {"username", "last_message", "seen"}
+        self._by_username = {}  # lowercased username -> user_id
+        self._missing = {}  # lowercased username -> expiry
+        self.bytes_used = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, user_id):
+        return user_id in self._records
+
+    @staticmethod
+    def _size(record):
+        return RECORD_OVERHEAD + len(record["username"]) + len(record.get("last_message") or "")
+
+    # ------------------------ Writes ------------------------
+
+    def touch(self, user_id, username, last_message=""):
+        now = self.clock()
+        old = self._records.pop(user_id, None)
+        if old:
+            self.bytes_used -= self._size(old)
+            if old["username"].lower() != username.lower():
+                self._by_username.pop(old["username"].lower(), None)
+        record = {"username": username, "last_message": last_message or "", "seen": now}
+        self._records[user_id] = record
+        self.bytes_used += self._size(record)
+        self._by_username[username.lower()] = user_id
+        self._missing.pop(username.lower(), None)
+        self._evict(now)
+        return record
+
+    def remove(self, user_id):
+        record = self._records.pop(user_id, None)
+        if record:
+            self.bytes_used -= self._size(record)
+            if self._by_username.get(record["username"].lower()) == user_id:
+                del self._by_username[record["username"].lower()]
+        return record
+
+    def _evict(self, now):
+        while self._records:
+            user_id, oldest = next(iter(self._records.items()))
+            expired = now - oldest["seen"] > self.ttl
+            if not (expired or len(self._records) > self.max_entries or self.bytes_used > self.max_bytes):
+                break
+            self.remove(user_id)
+            self.evictions += 1
+
+    def sweep(self):
+        """Drop expired users and negative entries without waiting for the next touch."""
+        now = self.clock()
+        self._evict(now)
+        for username in [u for u, expiry in self._missing.items() if expiry < now]:
+            del self._missing[username]
+
+    # ------------------------ Lookups ------------------------
+
+    def get(self, user_id):
+        return self._records.get(user_id)
+
+    def items(self):
+        """(user_id, record) pairs, least recently seen first."""
+        return list(self._records.items())
+
+    def find_username(self, username):
+        """Return the user id for `username` (case-insensitive), or None."""
+        return self._by_username.get(username.lstrip("@").lower())
+
+    def is_known_missing(self, username):
+        expiry = self._missing.get(username.lower())
+        if expiry is None:
+            return False
+        if expiry < self.clock():
+            del self._missing[username.lower()]
+            return False
+        return True
+
+    def mark_missing(self, username):
+        self._missing[username.lower()] = self.clock() + self.negative_ttl
+
+    async def resolve_username(self, username, writer=None):
+        """Look a username up in memory, then in Firestore on the writer's thread pool."""
+        username = username.lstrip("@")
+        user_id = self.find_username(username)
+        if user_id is not None or writer is None or self.is_known_missing(username):
+            return user_id
+
+        def query():
+            for doc in writer.db.collection("users").where("username", "==", username).limit(1).stream():
+                return int(doc.id), doc.to_dict()
+            return None
+
+        found = await writer.run(query)
+        metrics.count_firestore("read", "users", 1 if found else 0)
+        if found is None:
+            self.mark_missing(username)
+            return None
+        user_id, data = found
+        if user_id not in self._records:
+            self.touch(user_id, data.get("username", username), data.get("last_message", ""))
+        return user_id
+
+    # ------------------------ Warm-up ------------------------
+
+    async def warm(self, writer, limit=None):
+        """Load recently active users from Firestore without blocking the event loop."""
+        limit = limit or self.max_entries
+
+        def load():
+            from firebase_admin import firestore
+            query = writer.db.collection("users").order_by("updated_at", direction=firestore.Query.DESCENDING).limit(limit)
+            return [(int(doc.id), doc.to_dict()) for doc in query.stream()]
+
+        try:
+            rows = await writer.run(load)
+        except Exception:
+            logger.exception("User directory warm-up failed")
+            return 0
+        metrics.count_firestore("read", "users", len(rows))
+        # Oldest first so the most recent users end up at the fresh end of the LRU
+        for user_id, data in reversed(rows):
+            if user_id not in self._records and data.get("username"):
+                self.touch(user_id, data["username"], data.get("last_message", ""))
+        logger.info("User directory warmed with %d users", len(rows))
+        return len(rows)
+
+    def stats(self):
+        return {
+            "entries": len(self._records),
+            "bytes": self.bytes_used,
+            "evictions": self.evictions,
+            "negative_cached": len(self._missing),
+        }
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def build_web_app(application, webhook_path="/telegram", secret_token=None, stats=None):
+    """aiohttp app serving the Telegram webhook plus health and readiness checks.
+
+    Recorded Update JSON can be POSTed to `webhook_path` to exercise the bot locally.
+    `stats` is an optional callable whose dict is served on /stats; /metrics has
+    the Prometheus text format and /profile the sampling profiler's stacks.
+    """
+
+    async def handle_update(request):
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400, text="Invalid JSON")
+        update = Update.de_json(data, application.bot)
+        if update is None:
+            return web.Response(status=400, text="Not an update")
+        metrics.mark_received(update.update_id)
+        await application.update_queue.put(update)
+        return web.Response(text="ok")
+
+    async def health(request):
+        return web.Response(text="Bot is alive.")
+
+    async def ready(request):
+        if application.running:
+            return web.Response(text="ready")
+        return web.Response(status=503, text="starting")
+
+    async def show_stats(request):
+        return web.json_response(stats() if stats else {})
+
+    async def show_metrics(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def show_profile(request):
+        return web.Response(text=metrics.profiler.collapsed(), content_type="text/plain", charset="utf-8")
+
+    web_app = web.Application()
+    web_app.router.add_post(webhook_path, handle_update)
+    web_app.router.add_get("/", health)
+    web_app.router.add_get("/health", health)
+    web_app.router.add_get("/ready", ready)
+    web_app.router.add_get("/stats", show_stats)
+    web_app.router.add_get("/metrics", show_metrics)
+    web_app.router.add_get("/profile", show_profile)
+    return web_app
+
+
+async def serve_webhook(application, webhook_url, port, webhook_path="/telegram", secret_token=None, stats=None, register=True):
+    """Run the application behind a single aiohttp server until SIGINT/SIGTERM.
+
+    The application must be built with `.updater(None)`; updates arrive through
+    the HTTP endpoint and are put straight onto `application.update_queue`.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    web_app = build_web_app(application, webhook_path, secret_token, stats)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    # Bind first so the platform health check passes while the bot initializes
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info("Webhook server listening on port %s", port)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        if register:
+            await application.bot.set_webhook(
+                webhook_url.rstrip("/") + webhook_path,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)